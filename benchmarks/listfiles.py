@@ -0,0 +1,118 @@
+"""File listing benchmark module.
+
+Times DatabaseManager.listFiles for users owning 10, 1,000 and 100,000 files,
+each shared to one or two other users, and having as many files shared to them,
+against the query per file it replaced. Run from the repository root:
+
+    python -m benchmarks.listfiles [--sizes 10,1000,100000]
+
+The database is created in a temporary storage directory, removed at the end.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+def _listFilesPerFile(con, username):
+    """List files with a query per file, as listFiles used to."""
+    fileList = dict()
+    columns = 'id, name, owner, created, last_edited, last_edited_user, hash'
+    owned = con.execute(f'SELECT {columns} FROM Files WHERE owner=?;',
+                        (username, )).fetchall()
+    sharedIDs = con.execute('SELECT file FROM Shares WHERE user=?;',
+                            (username, )).fetchall()
+    shared = [
+        con.execute(f'SELECT {columns} FROM Files WHERE id=?;',
+                    (fileID, )).fetchone() for fileID, in sharedIDs
+    ]
+    for row in owned + shared:
+        fileList[row[0]] = dict(
+            zip(('name', 'owner', 'created', 'last_edited',
+                 'last_edited_user', 'hash'), row[1:]))
+    for row in owned:
+        fileList[row[0]]['shares'] = [
+            user for user, in con.execute(
+                'SELECT user FROM Shares WHERE file=?;', (row[0], ))
+        ]
+    return fileList
+
+
+def _populate(con, size):
+    """Create a user owning and having shared `size` files.
+
+    Returns:
+        The name of the user.
+    """
+    username = f'user{size}'
+    now = '2024-01-01 12:00:00'
+    con.executemany(
+        '''
+        INSERT INTO Files
+        (id, name, owner, created, last_edited, last_edited_user, hash)
+        VALUES (?,?,?,?,?,?,?);
+        ''',
+        [(f'{username}-{i}', f'file{i}', username, now, now, username,
+          f'{i:040x}') for i in range(size)] +
+        [(f'{username}-shared-{i}', f'{username}-file{i}', 'owner', now, now,
+          'owner', f'{i:040x}') for i in range(size)],
+    )
+    con.executemany(
+        'INSERT INTO Shares (user, file) VALUES (?,?);',
+        [(f'other{j}', f'{username}-{i}') for i in range(size)
+         for j in range(1 + i % 2)] +
+        [(username, f'{username}-shared-{i}') for i in range(size)],
+    )
+    con.commit()
+    return username
+
+
+def _time(function, size):
+    """Returns the mean time of a call in milliseconds."""
+    repeat = max(1, 10000 // size)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes',
+        default='10,1000,100000',
+        help='sets the comma separated numbers of files owned by the users '
+        '(default 10,1000,100000)',
+    )
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    storage = tempfile.mkdtemp(prefix='plainsync-bench-')
+    # The server reads its configuration when first imported
+    os.environ['PLAINSYNC_STORAGE'] = storage
+    os.environ.pop('PLAINSYNC_DATABASE', None)
+    os.environ['PLAINSYNC_LOGLEVEL'] = 'WARNING'
+    sys.argv = sys.argv[:1]
+    # pylint: disable=import-outside-toplevel
+    import sqlite3
+    from server import config
+    from server import dbmanager
+    try:
+        con = sqlite3.connect(config.DATABASE)
+        usernames = [_populate(con, size) for size in sizes]
+        manager = dbmanager.DatabaseManager()
+        print(f'{"files":>8}{"per file ms":>14}{"listFiles ms":>14}')
+        for size, username in zip(sizes, usernames):
+            expected = _listFilesPerFile(con, username)
+            assert manager.listFiles(username) == expected
+            perFile = _time(lambda: _listFilesPerFile(con, username), size)
+            current = _time(lambda: manager.listFiles(username), size)
+            print(f'{size:>8}{perFile:>14.2f}{current:>14.2f}')
+        con.close()
+    finally:
+        shutil.rmtree(storage, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Message encoding microbenchmark module.
+
+Times encoding every registered request and response type into JSON and
+decoding it back, see common.message. Run from the repository root:
+
+    python -m benchmarks.messages [--repeat N]
+
+A type registered without a sample message below fails the benchmark, so that
+new message types are not silently left out.
+"""
+import argparse
+import timeit
+
+from common import delta
+from common import request
+from common import response
+from common.message import MessageType
+
+_CONTENT = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit.\n' * 64
+_HASH = delta.contentHash(_CONTENT)
+_FILE_ID = 'd3b07384d113edec49eaa6238ad5ff00d3b07384'
+_FILE_INFO = {
+    'name': 'notes.txt',
+    'owner': 'alice',
+    'created': '2024-01-01 12:00:00',
+    'last_edited': '2024-01-02 12:00:00',
+    'last_edited_user': 'bob',
+    'hash': _HASH,
+    'shares': ['bob', 'carol'],
+}
+
+# Sample message of every registered type
+REQUESTS = {
+    MessageType.AUTH:
+    lambda: request.AuthRequest(user='alice', passwd='secret', protocol=3,
+                                codecs=['zlib', 'lzma']),
+    MessageType.PUSH:
+    lambda: request.PushRequest(fileID=_FILE_ID, content=_CONTENT),
+    MessageType.PULL:
+    lambda: request.PullRequest(fileID=_FILE_ID, knownHash=_HASH,
+                                lineRange=[10, 20]),
+    MessageType.LIST_FILES:
+    request.FileListRequest,
+    MessageType.NEW_FILE:
+    lambda: request.NewFileRequest(fileName='notes.txt'),
+    MessageType.DELETE_FILE:
+    lambda: request.DeleteFileRequest(fileID=_FILE_ID),
+    MessageType.NEW_SHARE:
+    lambda: request.NewShareRequest(fileID=_FILE_ID, user='bob'),
+    MessageType.DELETE_SHARE:
+    lambda: request.DeleteShareRequest(fileID=_FILE_ID, user='bob'),
+    MessageType.BATCH:
+    lambda: request.BatchRequest([
+        request.PullRequest(fileID=f'{i:040x}').toDict() for i in range(32)
+    ]),
+    MessageType.PING:
+    lambda: request.PingRequest(rtt=12.5),
+}
+RESPONSES = {
+    MessageType.OK:
+    lambda: response.OkResponse(action=f'Push file {_FILE_ID}'),
+    MessageType.PULL:
+    lambda: response.PullResponse(fileID=_FILE_ID, content=_CONTENT,
+                                  fileHash=_HASH),
+    MessageType.NOT_MODIFIED:
+    lambda: response.NotModifiedResponse(fileID=_FILE_ID, fileHash=_HASH),
+    MessageType.AUTH:
+    lambda: response.AuthResponse(sessionID='0123456789ab', user='alice',
+                                  protocol=3, codec='zlib',
+                                  compressThreshold=1024, idleTimeout=300,
+                                  resumeToken='x' * 160),
+    MessageType.LIST_FILES:
+    lambda: response.FileListResponse(
+        files={f'{i:040x}': _FILE_INFO for i in range(100)}, user='alice'),
+    MessageType.ERR:
+    lambda: response.ErrResponse(err='File has changed', retryAfter=1000),
+    MessageType.BATCH:
+    lambda: response.BatchResponse([
+        response.PullResponse(fileID=f'{i:040x}', content=_CONTENT,
+                              fileHash=_HASH).toDict() for i in range(32)
+    ]),
+    MessageType.PONG:
+    lambda: response.PongResponse(resumeToken='x' * 160),
+}
+
+
+def _time(function, repeat):
+    """Returns the best time of a call in microseconds."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e6
+
+
+def bench(family, samples, repeat):
+    """Time encoding and decoding a sample of every type of a family.
+
+    Args:
+        family: base class of the family, holding the REGISTRY.
+        samples: dictionary of the factories of the sample messages by type.
+        repeat: number of timed repetitions, the best one is reported.
+    """
+    missing = set(family.REGISTRY) - set(samples)
+    if missing:
+        raise SystemExit(f'No sample {family.__name__} of types '
+                         f'{", ".join(sorted(t.value for t in missing))}')
+    for msgType, klass in family.REGISTRY.items():
+        message = samples[msgType]()
+        encoded = message.toJSON()
+        assert family.fromJSON(encoded).toJSON() == encoded
+        print(f'{klass.__name__:<22}{len(encoded):>9}'
+              f'{_time(message.toJSON, repeat):>12.2f}'
+              f'{_time(lambda: family.fromJSON(encoded), repeat):>12.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help='sets the number of timed repetitions (default 5)',
+    )
+    args = parser.parse_args()
+    print(f'{"message":<22}{"bytes":>9}{"encode us":>12}{"decode us":>12}')
+    bench(request.Request, REQUESTS, args.repeat)
+    bench(response.Response, RESPONSES, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,8 @@ from PyQt5.QtWidgets import QWidget, QPushButton, QTextEdit
 from common import request
 from common import response
 from common import transfer
+from common import delta
+from common.message import MessageType
 
 from client.errors import FunnyClassForErrorMsg
 
@@ -50,13 +52,47 @@ class fileWindow(QWidget):
     def saveButtonPressed(self):
         content = self.textEdit.toPlainText()
 
-        req = request.PushRequest(fileID=self.fileID, content=content)
-        transfer.send(self.connection, req)
-        resp = response.OkResponse.fromJSON(transfer.recieve(self.connection))
+        resp = None
+        if self.content:
+            # Send only the changes against the opened contents
+            req = request.PushRequest(
+                fileID=self.fileID,
+                content=None,
+                baseHash=delta.contentHash(self.content),
+                edits=delta.makeDelta(self.content, content),
+            )
+            transfer.send(self.connection, req)
+            resp = response.OkResponse.fromJSON(
+                transfer.recieve(self.connection))
+            if resp.type == MessageType.ERR and resp.conflict:
+                # Someone else has saved the file, never overwrite it
+                self.reload(resp.description)
+                return
+        # Servers which can not apply the changes get the whole contents
+        if resp is None or resp.type == MessageType.ERR:
+            req = request.PushRequest(fileID=self.fileID, content=content)
+            transfer.send(self.connection, req)
+            resp = response.OkResponse.fromJSON(
+                transfer.recieve(self.connection))
+        if resp.type != MessageType.ERR:
+            self.content = content
         FunnyClassForErrorMsg().showMsg(self, resp.description)
 
         self.close()
 
+    def reload(self, reason):
+        """Replace the edited contents with the current ones of the file."""
+        transfer.send(self.connection, request.PullRequest(self.fileID))
+        resp = response.PullResponse.fromJSON(
+            transfer.recieve(self.connection))
+        if resp.type == MessageType.ERR:
+            FunnyClassForErrorMsg().showMsg(self, resp.description)
+            return
+        self.content = resp.content
+        self.textEdit.setText(self.content)
+        FunnyClassForErrorMsg().showMsg(
+            self, f'{reason} Its current contents have been loaded.')
+
     def closeButtonPressed(self):
         self.close()
 
@@ -59,16 +59,28 @@ class MainWindow(QMainWindow):
             self.username = self.loginTextBox.text()
             self.passwd = self.passwordTextBox.text()
 
-            s = Connection().getSocket()
-            req = request.AuthRequest(user=self.username, passwd=self.passwd)
+            s = transfer.Channel(Connection().getSocket())
+            req = request.AuthRequest(
+                user=self.username,
+                passwd=self.passwd,
+                protocol=transfer.PROTOCOL_VERSION,
+                codecs=['zlib'],
+            )
             transfer.send(s, req)
             resp = response.AuthResponse.fromJSON(transfer.recieve(s))
             if resp.type == MessageType.ERR:
                 FunnyClassForErrorMsg().showMsg(self, resp.description)
             else:
+                s.protocol = transfer.negotiate(getattr(resp, 'protocol', None))
+                s.codec = getattr(resp, 'codec', None)
+                s.compressThreshold = getattr(
+                    resp, 'compressThreshold',
+                    transfer.DEFAULT_COMPRESS_THRESHOLD,
+                ) or transfer.DEFAULT_COMPRESS_THRESHOLD
                 if self.operatingWindow is None:
                     self.operatingWindow = OperatingWindow(self.username)
                     self.operatingWindow.set_connection(s)
+                    self.operatingWindow.startHeartbeat(resp.idleTimeout)
                     self.operatingWindow.refreshFileList()
                     self.operatingWindow.show()
                     self.hide()
@@ -1,4 +1,7 @@
+import time
+
 from PyQt5 import QtWidgets, QtGui
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QMessageBox, QWidget, QTextEdit, QPushButton, QInputDialog, QTreeWidget, QTreeWidgetItem
 
 from common import request
@@ -10,6 +13,9 @@ from client.errors import FunnyClassForErrorMsg
 from client.shareWindow import ShareWindow
 from client.fileWindow import fileWindow
 
+# Seconds between heartbeats keeping the session alive
+HEARTBEAT_INTERVAL = 30
+
 
 class OperatingWindow(QWidget):
     def __init__(self, user):
@@ -20,6 +26,11 @@ class OperatingWindow(QWidget):
 
         self.user = user
         self.connection = None
+        # Contents of opened files as fileID: (hash, content)
+        self.contentCache = {}
+        # Last round trip time of a heartbeat in milliseconds
+        self.rtt = None
+        self.heartbeatTimer = None
 
         self.initUserBoard()
 
@@ -65,6 +76,21 @@ class OperatingWindow(QWidget):
     def set_connection(self, connection):
         self.connection = connection
 
+    def startHeartbeat(self, idleTimeout=None):
+        interval = HEARTBEAT_INTERVAL
+        if idleTimeout:
+            # Ping well before the server closes the idle session
+            interval = min(interval, idleTimeout / 2)
+        self.heartbeatTimer = QTimer(self)
+        self.heartbeatTimer.timeout.connect(self.heartbeat)
+        self.heartbeatTimer.start(int(interval * 1000))
+
+    def heartbeat(self):
+        start = time.monotonic()
+        transfer.send(self.connection, request.PingRequest(rtt=self.rtt))
+        response.Response.fromJSON(transfer.recieve(self.connection))
+        self.rtt = round((time.monotonic() - start) * 1000, 3)
+
     def openButtonClicked(self):
         seletedFile = self.fileTree.selectedItems()
         if seletedFile:
@@ -157,12 +183,16 @@ class OperatingWindow(QWidget):
             return fileInfo[0]
 
     def getFileContent(self, fileID):
-        req = request.PullRequest(fileID)
+        knownHash, content = self.contentCache.get(fileID, (None, None))
+        req = request.PullRequest(fileID, knownHash=knownHash)
         transfer.send(self.connection, req)
         resp = response.FileListResponse.fromJSON(transfer.recieve(self.connection))
         if resp.type == MessageType.ERR:
             QMessageBox.question(self, 'Error', resp.description, QMessageBox.Ok,
                                  QMessageBox.Ok)
+        elif resp.type == MessageType.NOT_MODIFIED:
+            return content
         else:
             content = resp.content
+            self.contentCache[fileID] = (resp.hash, content)
             return content
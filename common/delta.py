@@ -0,0 +1,83 @@
+"""Delta module.
+
+Contains tools for describing changes of file contents as compact edit scripts,
+so that small edits of large files can be pushed without sending the whole
+file.
+
+An edit script is a list of [start, end, text] edits in ascending order, each
+replacing the characters between `start` and `end` of the base contents with
+`text`. Offsets refer to the base contents, so the edits do not overlap.
+"""
+import difflib
+import hashlib
+import itertools
+
+
+def contentHash(contents):
+    """Hash the file contents.
+
+    Args:
+        contents: the file contents as a string.
+
+    Returns:
+        Hexadecimal SHA-1 digest of the UTF-8 encoded contents.
+    """
+    return hashlib.sha1(contents.encode('utf-8')).hexdigest()
+
+
+def makeDelta(base, contents):
+    """Create an edit script turning the base contents into new contents.
+
+    The contents are compared line by line, which keeps the comparison fast
+    for large files.
+
+    Args:
+        base: the contents known to the other side.
+        contents: the new contents.
+
+    Returns:
+        List of [start, end, text] edits.
+    """
+    baseLines = base.splitlines(keepends=True)
+    newLines = contents.splitlines(keepends=True)
+    # Character offset of the start of every line
+    baseOffsets = [0] + list(itertools.accumulate(map(len, baseLines)))
+    edits = list()
+    matcher = difflib.SequenceMatcher(None, baseLines, newLines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != 'equal':
+            edits.append([
+                baseOffsets[i1],
+                baseOffsets[i2],
+                ''.join(newLines[j1:j2]),
+            ])
+    return edits
+
+
+def applyDelta(base, edits):
+    """Apply an edit script to the base contents.
+
+    Args:
+        base: the contents the edit script has been created against.
+        edits: list of [start, end, text] edits obtained with makeDelta.
+
+    Returns:
+        The new contents.
+
+    Raises:
+        ValueError if the edit script is malformed or does not fit the base.
+    """
+    parts = list()
+    position = 0
+    for edit in edits:
+        start, end, text = edit
+        if not (isinstance(start, int) and isinstance(end, int)
+                and isinstance(text, str)):
+            raise ValueError(f'Malformed edit: {edit}')
+        if not position <= start <= end <= len(base):
+            raise ValueError(f'Edit out of order or range: {start}-{end}')
+        parts.append(base[position:start])
+        parts.append(text)
+        position = end
+    parts.append(base[position:])
+    return ''.join(parts)
@@ -18,11 +18,15 @@ class MessageType(str, Enum):
     AUTH = 'AUTH'
     PUSH = 'PUSH'
     PULL = 'PULL'
+    NOT_MODIFIED = 'NOT_MODIFIED'
     LIST_FILES = 'LIST_FILES'
     NEW_FILE = 'NEW_FILE'
     DELETE_FILE = 'DELETE_FILE'
     NEW_SHARE = 'NEW_SHARE'
     DELETE_SHARE = 'DELETE_SHARE'
+    BATCH = 'BATCH'
+    PING = 'PING'
+    PONG = 'PONG'
 
 
 class Message():
@@ -31,43 +35,128 @@ class Message():
     Turned from/into a JSON string when transmitted over TCP as means of
     client-server communication.
 
+    Every message class declares its attributes in `__slots__`. All of them,
+    except for the LOCAL ones, are transmitted, other keys are refused when
+    decoding. Concrete classes set TYPE and are registered in the REGISTRY of
+    their family (requests or responses), so a message is decoded straight
+    into the class of its type.
+
     Items:
        type: MessageType enum specifying the type of message.
     """
+    __slots__ = ('type', )
+    # Type of the concrete message class
+    TYPE = None
+    # Concrete classes of the family as (MessageType, class) pairs
+    REGISTRY = None
+    # Attribute which may be transmitted as a raw binary body after the JSON
+    BODY = None
+    # Attributes which are never transmitted
+    LOCAL = ('bodyPath', 'bodyFile', 'bodyRange', 'bodyKey')
+    # Keys added to the JSON by the framing, see transfer.Channel
+    FRAMING = ('bodyField', 'bodyLength')
+    # Names of the transmitted attributes, computed for every class
+    FIELDS = ('type', )
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        slots = list()
+        for klass in reversed(cls.__mro__):
+            slots.extend(klass.__dict__.get('__slots__', ()))
+        cls.FIELDS = tuple(slot for slot in slots if slot not in cls.LOCAL)
+        cls.SLOTS = tuple(slots)
+        if cls.TYPE is not None and cls.REGISTRY is not None:
+            cls.REGISTRY.setdefault(cls.TYPE, cls)
+
     def __init__(self, msgType=MessageType.NONE):
         super().__init__()
+        for slot in self.SLOTS:
+            setattr(self, slot, None)
         self.type = msgType
 
     def __str__(self):
         return self.toJSON()
 
+    def toDict(self):
+        """Returns the transmitted attributes of the message as a dictionary.
+
+        Attributes set to None are omitted.
+        """
+        dictionary = dict()
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                dictionary[field] = value
+        return dictionary
+
     def toJSON(self):
         """Converts the message to a JSON string.
 
         Returns:
             A valid JSON string representation of the message.
         """
-        return json.dumps(self.__dict__)
+        return json.dumps(self.toDict())
 
     @classmethod
     def fromJSON(cls, jsonStr):
         """Recreates the Message form a UTF-8 JSON byte string.
 
-        **Warning:** in order for this to work ALL classes extending Message
-        must have a default empty constructor.
-
         Args:
-            jsonStr: valid JSON string obtained  with Message.toJSON.
+            jsonStr: valid JSON string obtained  with Message.toJSON. If it
+                has been received with a binary body (see transfer.Frame) the
+                body is restored into the attribute named by `bodyField`.
 
         Returns:
-            A new Message object created form the JSON byte string.
+            A new Message object of the class registered for its type.
+
+        Raises:
+            TypeError if the message has an unknown type or fields.
         """
         # Load the json string into a Python dict
         jsonDict = json.loads(jsonStr)
-        new = cls()
-        # Copy all keys into attributes
+        new = cls.fromDict(jsonDict)
+        # Restore the body sent outside of the JSON
+        bodyField = jsonDict.get('bodyField')
+        if bodyField:
+            if bodyField != new.BODY:
+                raise TypeError(f'Unexpected body field: {bodyField}')
+            body = getattr(jsonStr, 'body', None)
+            if body is not None:
+                body = str(body, 'utf-8')
+            setattr(new, bodyField, body)
+            new.bodyPath = getattr(jsonStr, 'bodyPath', None)
+        return new
+
+    @classmethod
+    def fromDict(cls, jsonDict):
+        """Recreates the Message from a dictionary obtained with toDict.
+
+        Args:
+            jsonDict: dictionary of the message attributes.
+
+        Returns:
+            A new Message object of the class registered for its type.
+
+        Raises:
+            TypeError if the message has an unknown type or fields.
+        """
+        try:
+            msgType = MessageType(jsonDict['type'])
+        except (KeyError, ValueError) as ex:
+            raise TypeError(f'Unknown message type: {ex}') from ex
+        klass = cls
+        if cls.REGISTRY is not None:
+            klass = cls.REGISTRY.get(msgType)
+            if klass is None:
+                raise TypeError(f'Unexpected message type: {msgType.value}')
+        # Skip the constructor, the attributes are set directly
+        new = klass.__new__(klass)
+        for slot in klass.SLOTS:
+            setattr(new, slot, None)
         for key, value in jsonDict.items():
-            setattr(new, key, value)
-        # Turn type into enum from JSON's string
-        new.type = MessageType[jsonDict['type']]
+            if key in klass.FIELDS:
+                setattr(new, key, value)
+            elif key not in klass.FRAMING:
+                raise TypeError(f'Unknown field of {klass.__name__}: {key}')
+        new.type = msgType
         return new
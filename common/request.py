@@ -10,7 +10,15 @@ class Request(Message):
     """Base request class.
 
     Used by the client to request response from a server.
+
+    Items:
+        requestID: optional ID chosen by the client. Requests with an ID may be
+            processed concurrently and answered out of order, the response
+            carries the same ID. Requests without an ID are answered in order.
     """
+    __slots__ = ('requestID', )
+    REGISTRY = dict()
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
@@ -25,11 +33,24 @@ class AuthRequest(Request):
     Items:
         user: username of the authenticating user.
         passwd: password of the authenticating user.
+        protocol: highest framing protocol version supported by the client,
+            None for legacy clients.
+        codecs: compression codecs supported by the client in order of
+            preference, see transfer.CODECS.
+        resumeToken: token of a session to resume, given in the last
+            `AuthResponse` or `PongResponse`, in place of the credentials.
     """
-    def __init__(self, user=None, passwd=None):
+    __slots__ = ('user', 'passwd', 'protocol', 'codecs', 'resumeToken')
+    TYPE = MessageType.AUTH
+
+    def __init__(self, user=None, passwd=None, protocol=None, codecs=None,
+                 resumeToken=None):
         super().__init__(msgType=MessageType.AUTH, )
         self.user = user
         self.passwd = passwd
+        self.protocol = protocol
+        self.codecs = codecs
+        self.resumeToken = resumeToken
 
 
 class PushRequest(Request):
@@ -38,18 +59,35 @@ class PushRequest(Request):
     Used by the client to push local changes to the server. The server responds
     with `OkResponse` if everything went fine or `ErrResponse`.
 
+    Instead of the whole contents the client may send an edit script (see
+    common.delta) along with the hash of the contents it has been created
+    against. The server rejects it with `ErrResponse` marked as a `conflict` if
+    the file has changed in the meantime.
+
     Items:
         fileID: the ID of file to be updated.
         content: the contents to update the file with.
+        baseHash: hash of the contents the edits apply to, see
+            delta.contentHash.
+        edits: edit script obtained with delta.makeDelta or None to replace
+            the whole contents.
+        bodyPath: path of the file the content has been spooled into when it
+            was received as a binary body, never transmitted.
     """
-    def __init__(self, fileID=None, content=''):
+    __slots__ = ('fileID', 'content', 'baseHash', 'edits', 'bodyPath')
+    TYPE = MessageType.PUSH
+    BODY = 'content'
+
+    def __init__(self, fileID=None, content='', baseHash=None, edits=None):
         super().__init__(msgType=MessageType.PUSH, )
         self.content = content
         self.fileID = fileID
+        self.baseHash = baseHash
+        self.edits = edits
 
     def __str__(self):
-        dictionary = self.__dict__.copy()
-        del dictionary['content']
+        dictionary = self.toDict()
+        dictionary.pop('content', None)
         return json.dumps(dictionary)
 
 
@@ -58,14 +96,32 @@ class PullRequest(Request):
     """Pull request class.
 
     Used by the client to to pull changes from the server. The server responds
-    with `PullResponse` containing the file contents or `ErrResponse`.
+    with `PullResponse` containing the file contents or `ErrResponse`. If the
+    client already has the current contents, identified by their hash, the
+    server responds with `NotModifiedResponse` instead.
+
+    The client may request only a part of the file, either as a range of bytes
+    or a range of lines. Byte ranges are widened by the server so that they do
+    not split UTF-8 characters.
 
     Items:
         fileID: the ID of the file to be pulled.
+        knownHash: hash of the contents known to the client, see
+            delta.contentHash, or None.
+        byteRange: [start, end) byte offsets of the requested part or None.
+        lineRange: [first, last) 0-based numbers of the requested lines or
+            None.
     """
-    def __init__(self, fileID=None):
+    __slots__ = ('fileID', 'knownHash', 'byteRange', 'lineRange')
+    TYPE = MessageType.PULL
+
+    def __init__(self, fileID=None, knownHash=None, byteRange=None,
+                 lineRange=None):
         super().__init__(msgType=MessageType.PULL, )
         self.fileID = fileID
+        self.knownHash = knownHash
+        self.byteRange = byteRange
+        self.lineRange = lineRange
 
 
 class FileListRequest(Request):
@@ -75,8 +131,11 @@ class FileListRequest(Request):
     server responds with `FileListResponse`, containing a dictionary of (file
     ID, (info)) pairs, where the ID is the unique ID assigned to every file and
     info is a dicitonary that contains information about the owner, file name,
-    last edited date and last edited user.
+    last edited date, last edited user and content hash.
     """
+    __slots__ = ()
+    TYPE = MessageType.LIST_FILES
+
     def __init__(self):
         super().__init__(msgType=MessageType.LIST_FILES)
 
@@ -87,6 +146,9 @@ class NewFileRequest(Request):
     server responds with `OkResponse` if the action was successful or
     `ErrResponse`.
     """
+    __slots__ = ('fileName', )
+    TYPE = MessageType.NEW_FILE
+
     def __init__(self, fileName=None):
         super().__init__(msgType=MessageType.NEW_FILE)
         self.fileName = fileName
@@ -102,6 +164,9 @@ class DeleteFileRequest(Request):
     The server responds with `OkResponse` if the action was successful or
     `ErrResponse`.
     """
+    __slots__ = ('fileID', )
+    TYPE = MessageType.DELETE_FILE
+
     def __init__(self, fileID=None):
         super().__init__(msgType=MessageType.DELETE_FILE)
         self.fileID = fileID
@@ -114,6 +179,9 @@ class NewShareRequest(Request):
     The server responds with `OkResponse` if the action was successful or
     `ErrResponse`.
     """
+    __slots__ = ('fileID', 'user')
+    TYPE = MessageType.NEW_SHARE
+
     def __init__(self, fileID=None, user=None):
         super().__init__(msgType=MessageType.NEW_SHARE)
         self.fileID = fileID
@@ -129,7 +197,56 @@ class DeleteShareRequest(Request):
     The server responds with `OkResponse` if the action was successful or
     `ErrResponse`.
     """
+    __slots__ = ('fileID', 'user')
+    TYPE = MessageType.DELETE_SHARE
+
     def __init__(self, fileID=None, user=None):
         super().__init__(msgType=MessageType.DELETE_SHARE)
         self.fileID = fileID
         self.user = user
+
+
+class BatchRequest(Request):
+    """Batch request.
+
+    Used by the client to request many operations in a single round trip. The
+    operations are executed in order within a single database transaction.
+
+    The server responds with `BatchResponse` containing a response for every
+    operation. If the batch is atomic, the server responds with `ErrResponse`
+    and no changes are made as soon as any of the operations fails.
+
+    Items:
+        requests: list of dictionaries of the requests to execute, as obtained
+            with Message.toDict. Authentication and nested batches are not
+            allowed.
+        atomic: whether the batch should be executed all-or-nothing.
+    """
+    __slots__ = ('requests', 'atomic')
+    TYPE = MessageType.BATCH
+
+    def __init__(self, requests=None, atomic=False):
+        super().__init__(msgType=MessageType.BATCH)
+        self.requests = [
+            req.toDict() if isinstance(req, Request) else req
+            for req in requests or ()
+        ]
+        self.atomic = atomic
+
+
+class PingRequest(Request):
+    """Heartbeat request.
+
+    Sent by the client periodically to keep an idle session alive and to
+    measure the round trip time. The server responds with `PongResponse`.
+
+    Items:
+        rtt: the last round trip time in milliseconds measured by the client,
+            reported to the server.
+    """
+    __slots__ = ('rtt', )
+    TYPE = MessageType.PING
+
+    def __init__(self, rtt=None):
+        super().__init__(msgType=MessageType.PING)
+        self.rtt = rtt
@@ -13,7 +13,11 @@ class Response(Message):
 
     Items:
         description: string describing the response contents.
+        requestID: the ID of the answered request, if it had one.
     """
+    __slots__ = ('description', 'requestID')
+    REGISTRY = dict()
+
     def __init__(self, description='', **kwargs):
         super().__init__(**kwargs)
         self.description=description
@@ -27,6 +31,9 @@ class OkResponse(Response):
     Args:
         action: string describing the succesfull action.
     """
+    __slots__ = ()
+    TYPE = MessageType.OK
+
     def __init__(self, action=None):
         super().__init__(
             msgType=MessageType.OK,
@@ -41,21 +48,63 @@ class PullResponse(Response):
 
     Args:
         content: contents of the specified file.
+        fileHash: hash of the contents, see delta.contentHash.
+
+    Items:
+        hash: hash of the contents.
+        range: [start, end) byte offsets of the sent part of a ranged pull.
+        size: size of the whole file in bytes, for ranged pulls.
+        bodyPath: path of the file the content has been spooled into when it
+            has been received as a binary body, never transmitted.
+        bodyFile: binary file opened for reading to send as the content,
+            closed once sent. Never transmitted.
+        bodyRange: [start, end) byte offsets of the part of `bodyFile` to
+            send, never transmitted.
+        bodyKey: tuple identifying the contents of `bodyFile`, under which
+            their encoded forms may be cached, see transfer.Channel. Never
+            transmitted.
     """
-    def __init__(self, fileID=None, content=None):
+    __slots__ = ('content', 'hash', 'range', 'size', 'bodyPath', 'bodyFile',
+                 'bodyRange', 'bodyKey')
+    TYPE = MessageType.PULL
+    BODY = 'content'
+
+    def __init__(self, fileID=None, content=None, fileHash=None):
         super().__init__(
             msgType=MessageType.PULL,
             description=f'Sending file contents: {fileID}',
         )
         self.content = content
+        self.hash = fileHash
 
     def __str__(self):
-        dictionary = self.__dict__.copy()
-        del dictionary['content']
+        dictionary = self.toDict()
+        dictionary.pop('content', None)
         return json.dumps(dictionary)
 
 
 
+class NotModifiedResponse(Response):
+    """Not modified response class.
+
+    Used by the server to respond to a pull request if the client already has
+    the current contents of the file.
+
+    Args:
+        fileID: the ID of the pulled file.
+        fileHash: hash of the current contents.
+    """
+    __slots__ = ('hash', )
+    TYPE = MessageType.NOT_MODIFIED
+
+    def __init__(self, fileID=None, fileHash=None):
+        super().__init__(
+            msgType=MessageType.NOT_MODIFIED,
+            description=f'File not modified: {fileID}',
+        )
+        self.hash = fileHash
+
+
 class AuthResponse(Response):
     """Authentication response class.
 
@@ -66,13 +115,40 @@ class AuthResponse(Response):
 
     Items:
         userID: a generated ID of the user authenticating him in this session.
+        protocol: framing protocol version used for the rest of the session.
+        codec: compression codec used for the rest of the session or None.
+        compressThreshold: smallest message in bytes which gets compressed.
+        idleTimeout: seconds after which an idle session is closed by the
+            server or None, see request.PingRequest.
+        resumeToken: token resuming the session on a new connection, see
+            request.AuthRequest.
+        resumed: True if an earlier session has been resumed.
     """
-    def __init__(self, sessionID=None, user=''):
+    __slots__ = (
+        'sessionID',
+        'protocol',
+        'codec',
+        'compressThreshold',
+        'idleTimeout',
+        'resumeToken',
+        'resumed',
+    )
+    TYPE = MessageType.AUTH
+
+    def __init__(self, sessionID=None, user='', protocol=None, codec=None,
+                 compressThreshold=None, idleTimeout=None, resumeToken=None,
+                 resumed=None):
         super().__init__(
             msgType=MessageType.AUTH,
             description=f'Authenticated :: {user}',
         )
         self.sessionID=sessionID
+        self.protocol=protocol
+        self.codec=codec
+        self.compressThreshold=compressThreshold
+        self.idleTimeout=idleTimeout
+        self.resumeToken=resumeToken
+        self.resumed=resumed
 
 class FileListResponse(Response):
     """Response with file names owned by the user.
@@ -84,8 +160,12 @@ class FileListResponse(Response):
         filelist: a list of files accessible to the user as a dictionary of
             (file ID, (info)) pairs, where the ID is the unique ID assigned to
             every file and info is a dicitonary that contains information about
-            the owner, file name, last edited date and last edited user.
+            the owner, file name, last edited date, last edited user and
+            content hash.
     """
+    __slots__ = ('files', )
+    TYPE = MessageType.LIST_FILES
+
     def __init__(self, files=None, user=None):
         super().__init__(
             msgType=MessageType.LIST_FILES,
@@ -96,8 +176,8 @@ class FileListResponse(Response):
             self.files = dict()
 
     def __str__(self):
-        dictionary = self.__dict__.copy()
-        del dictionary['files']
+        dictionary = self.toDict()
+        dictionary.pop('files', None)
         return json.dumps(dictionary)
 
 
@@ -109,9 +189,66 @@ class ErrResponse(Response):
 
     Args:
         err: error description with optional stack trace.
+        retryAfter: milliseconds after which the request may be retried, if
+            the server refused it because it is busy.
+        conflict: True if a push has been refused because the file has
+            changed since its base hash, see request.PushRequest, else None.
     """
-    def __init__(self, err=None):
+    __slots__ = ('retryAfter', 'conflict')
+    TYPE = MessageType.ERR
+
+    def __init__(self, err=None, retryAfter=None, conflict=None):
         super().__init__(
             msgType=MessageType.ERR,
             description=f'Error: {err}.',
         )
+        self.retryAfter = retryAfter
+        self.conflict = conflict
+
+
+class BatchResponse(Response):
+    """Batch response class.
+
+    Used by the server to send the results of all operations of a batch
+    request.
+
+    Args:
+        responses: list of dictionaries of the responses to the operations,
+            in the order of the requests, as obtained with Message.toDict.
+    """
+    __slots__ = ('responses', )
+    TYPE = MessageType.BATCH
+
+    def __init__(self, responses=None):
+        super().__init__(
+            msgType=MessageType.BATCH,
+            description=f'Sending {len(responses or ())} batch responses',
+        )
+        self.responses = responses
+        if self.responses is None:
+            self.responses = list()
+
+    def __str__(self):
+        dictionary = self.toDict()
+        dictionary.pop('responses', None)
+        return json.dumps(dictionary)
+
+
+class PongResponse(Response):
+    """Heartbeat response.
+
+    Used by the server to answer a `PingRequest`.
+
+    Items:
+        resumeToken: fresh token resuming the session, replacing the one of
+            the `AuthResponse` before it expires.
+    """
+    __slots__ = ('resumeToken', )
+    TYPE = MessageType.PONG
+
+    def __init__(self, resumeToken=None):
+        super().__init__(
+            msgType=MessageType.PONG,
+            description='Pong',
+        )
+        self.resumeToken = resumeToken
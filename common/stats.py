@@ -0,0 +1,63 @@
+"""Statistics module.
+
+Contains thread-safe counters used to expose runtime statistics, such as
+compression ratios, of the client and the server.
+"""
+import threading
+
+_registry = dict()
+_registryLock = threading.Lock()
+
+
+class Counters:
+    """Table of named counters grouped by key.
+
+    Items:
+        name: name under which the table is registered.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._values = dict()
+
+    def add(self, key, **amounts):
+        """Add the given amounts to the counters of a key.
+
+        Args:
+            key: the group of counters, for example a MessageType.
+            amounts: (counter name, amount) pairs to add.
+        """
+        with self._lock:
+            values = self._values.setdefault(str(key), dict())
+            for counter, amount in amounts.items():
+                values[counter] = values.get(counter, 0) + amount
+
+    def set(self, key, **values):
+        """Overwrite the counters of a key with the given values."""
+        with self._lock:
+            self._values.setdefault(str(key), dict()).update(values)
+
+    def remove(self, key):
+        """Remove all counters of a key."""
+        with self._lock:
+            self._values.pop(str(key), None)
+
+    def snapshot(self):
+        """Returns a copy of all counters as a dictionary of dictionaries."""
+        with self._lock:
+            return {key: dict(values) for key, values in self._values.items()}
+
+
+def counters(name):
+    """Get the counters registered under a name, creating them if needed."""
+    with _registryLock:
+        if name not in _registry:
+            _registry[name] = Counters(name)
+        return _registry[name]
+
+
+def snapshot():
+    """Returns a snapshot of all registered counters keyed by table name."""
+    with _registryLock:
+        tables = list(_registry.values())
+    return {table.name: table.snapshot() for table in tables}
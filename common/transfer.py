@@ -1,31 +1,572 @@
 """Transfer module.
 
 This module contains a common tools for sending and recieving messages.
+
+Two framing modes are supported. The legacy mode (protocol version 1) prefixes
+every message with a 2-byte length, which limits messages to 64 KiB. The wide
+mode (protocol version 2) uses an 8-byte header, where the lowest 7 bytes hold
+the length and the highest byte holds frame flags. Protocol version 3 adds
+binary bodies: the content of a message (see Message.BODY) is sent as a second
+raw frame right after the JSON, so it is never escaped into JSON. Every
+connection starts in legacy mode and switches to the version agreed upon in the
+AuthRequest / AuthResponse handshake.
+
+From protocol version 2 on the handshake may also agree upon a compression
+codec. Frames at least as large as the agreed threshold are then compressed and
+flagged as such in the header.
 """
+import bz2
+import codecs
+import json
+import lzma
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+from common import stats
+
+PROTOCOL_LEGACY = 1
+PROTOCOL_WIDE = 2
+PROTOCOL_BODY = 3
+# Latest protocol version supported by this implementation
+PROTOCOL_VERSION = PROTOCOL_BODY
+
+HEADER_SIZE = {
+    PROTOCOL_LEGACY: 2,
+    PROTOCOL_WIDE: 8,
+    PROTOCOL_BODY: 8,
+}
+
+# Flags stored in the highest byte of the wide header
+FLAG_BODY = 1 << 56
+FLAG_COMPRESSED = 1 << 57
+LENGTH_MASK = FLAG_BODY - 1
+
+# Compression codecs as (compress, decompressor factory) pairs
+CODECS = {
+    'zlib': (zlib.compress, zlib.decompressobj),
+    'lzma': (lzma.compress, lzma.LZMADecompressor),
+    'bz2': (bz2.compress, bz2.BZ2Decompressor),
+}
+DEFAULT_COMPRESS_THRESHOLD = 1024
+
+# Compression statistics per MessageType of sent messages
+compressionStats = stats.counters('compression')
+
+DEFAULT_MAX_FRAME = 64 * 1024 * 1024
+# Size of the chunks in which bodies are spooled to disk
+SPOOL_CHUNK = 64 * 1024
+# Largest receive buffer kept by a channel between frames, larger frames are
+# read into buffers of their own
+MAX_RECV_BUFFER = 64 * 1024
+
+
+class FrameTooLarge(ValueError):
+    """Raised when a frame exceeds the maximum size allowed for the channel."""
+
+
+class Frame(str):
+    """JSON string of a received message with its optional binary body.
+
+    Items:
+        body: bytes of the body read into memory or None.
+        bodyPath: path of the file the body has been spooled into or None.
+        bodyError: why a body has been dropped instead of spooled, or None.
+    """
+    body = None
+    bodyPath = None
+    bodyError = None
+
+
+def negotiate(requested):
+    """Choose the protocol version to use for a connection.
+
+    Args:
+        requested: the highest version supported by the other side or None
+            for clients which predate negotiation.
+
+    Returns:
+        Highest protocol version supported by both sides.
+    """
+    if not requested:
+        return PROTOCOL_LEGACY
+    return max(PROTOCOL_LEGACY, min(int(requested), PROTOCOL_VERSION))
+
+
+def negotiateCodec(requested, allowed, protocol):
+    """Choose the compression codec to use for a connection.
+
+    Args:
+        requested: codec names supported by the other side in order of
+            preference or None for clients which do not support compression.
+        allowed: codec names allowed on this side.
+        protocol: the negotiated protocol version.
+
+    Returns:
+        Name of the first requested codec which is allowed, or None.
+    """
+    if protocol < PROTOCOL_WIDE:
+        return None
+    for codec in requested or ():
+        if codec in allowed and codec in CODECS:
+            return codec
+    return None
+
+
+class Channel:
+    """Framed message channel over a TCP socket.
+
+    Keeps the per-connection framing state: the negotiated protocol version,
+    the maximum frame size and a receive buffer of at most MAX_RECV_BUFFER
+    bytes reused between frames.
+
+    Items:
+        sock: the underlying TCP socket.
+        protocol: protocol version used for framing.
+        maxFrame: largest frame accepted or sent, in bytes.
+        spoolDir: if set, received bodies are written to temporary files in
+            this directory instead of being kept in memory.
+        codec: name of the compression codec or None.
+        compressThreshold: smallest frame in bytes which gets compressed.
+        bodyCache: if set, object with get(key) and put(key, value, size,
+            source) methods caching the encoded bodies sent from the
+            `bodyFile` of messages with a `bodyKey`, as compressed frames or
+            JSON strings. The source is the body the value has been encoded
+            from.
+        sendSock: if set, socket on which messages are sent instead of
+            `sock`, for example a duplicate of it with a timeout of its own.
+    """
+    def __init__(self, sock, protocol=PROTOCOL_LEGACY, maxFrame=None,
+                 spoolDir=None):
+        self.sock = sock
+        self.protocol = protocol
+        self.maxFrame = maxFrame or DEFAULT_MAX_FRAME
+        self.spoolDir = spoolDir
+        self.codec = None
+        self.compressThreshold = DEFAULT_COMPRESS_THRESHOLD
+        self.bodyCache = None
+        self.sendSock = None
+        self._buffer = bytearray(4096)
+        self._sendLock = threading.Lock()
+
+    def fileno(self):
+        """Return the file descriptor of the underlying socket."""
+        return self.sock.fileno()
+
+    @property
+    def _out(self):
+        """The socket messages are sent on."""
+        return self.sendSock or self.sock
+
+    def _recvInto(self, view):
+        """Fill the whole memoryview with data read from the socket.
+
+        Raises:
+            ConnectionAbortedError if the peer closes the connection early.
+        """
+        read = 0
+        size = len(view)
+        while read < size:
+            count = self.sock.recv_into(view[read:], size - read)
+            if count == 0:
+                raise ConnectionAbortedError
+            read += count
+
+    def _recvExact(self, size):
+        """Read exactly `size` bytes, see receiving.
+
+        Returns:
+            A memoryview of the reused receive buffer holding the data, or of
+            a buffer of its own if larger than MAX_RECV_BUFFER. It is only
+            valid until the next read.
+        """
+        if size > MAX_RECV_BUFFER:
+            # Not kept for the rest of the connection
+            view = memoryview(bytearray(size))
+            yield view
+            return view
+        if len(self._buffer) < size:
+            self._buffer = bytearray(
+                min(max(size, 2 * len(self._buffer)), MAX_RECV_BUFFER))
+        view = memoryview(self._buffer)[:size]
+        yield view
+        return view
+
+    def _recvHeader(self):
+        """Read a frame header, see receiving.
+
+        Returns:
+            Tuple of the frame length and the frame flags.
+        """
+        header = yield from self._recvExact(HEADER_SIZE[self.protocol])
+        value = int.from_bytes(header, byteorder='big')
+        length, flags = value & LENGTH_MASK, value & ~LENGTH_MASK
+        if length > self.maxFrame:
+            raise FrameTooLarge(
+                f'Frame of {length} bytes exceeds limit of {self.maxFrame}')
+        return length, flags
+
+    def _header(self, length, flags=0):
+        headerSize = HEADER_SIZE[self.protocol]
+        limit = min(self.maxFrame, 2**(8 * headerSize) - 1, LENGTH_MASK)
+        if length > limit:
+            raise FrameTooLarge(
+                f'Message of {length} bytes exceeds limit of {limit}')
+        return (length | flags).to_bytes(headerSize, byteorder='big')
+
+    def _decompressor(self):
+        if self.codec is None:
+            raise ValueError('Compressed frame without a negotiated codec')
+        return CODECS[self.codec][1]()
+
+    def _inflate(self, decompressor, data):
+        """Decompress a chunk of data in blocks of at most SPOOL_CHUNK bytes.
+
+        The callers check the limit after every block, so that a small
+        compressed frame can never make the whole inflated data be held in
+        memory.
+
+        Args:
+            decompressor: the decompressor of the negotiated codec.
+            data: the compressed chunk.
+
+        Yields:
+            The decompressed blocks.
+        """
+        while not decompressor.eof:
+            block = decompressor.decompress(data, SPOOL_CHUNK)
+            if block:
+                yield block
+            # Input zlib did not get to, or output lzma and bz2 hold back
+            data = getattr(decompressor, 'unconsumed_tail', b'')
+            if data or len(block) == SPOOL_CHUNK:
+                continue
+            if getattr(decompressor, 'needs_input', True):
+                return
+
+    def _decompress(self, data):
+        """Decompress a whole frame, refusing to inflate beyond maxFrame."""
+        start = time.thread_time()
+        result = bytearray()
+        for block in self._inflate(self._decompressor(), data):
+            result += block
+            if len(result) > self.maxFrame:
+                raise FrameTooLarge(
+                    f'Decompressed frame exceeds limit of {self.maxFrame}')
+        compressionStats.add(
+            'decompressed', messages=1, cpuTime=time.thread_time() - start)
+        return bytes(result)
+
+    def _recvBody(self, frame):
+        """Read the body frame following a JSON frame into `frame`.
+
+        A spooled body is validated as UTF-8 text while it is written. A body
+        which is not is still received to the end, but dropped, with the
+        reason in `bodyError`.
+        """
+        length, flags = yield from self._recvHeader()
+        compressed = flags & FLAG_COMPRESSED
+        if self.spoolDir is None:
+            body = bytearray(length)
+            yield memoryview(body)
+            frame.body = self._decompress(body) if compressed else body
+            return
+        decompressor = self._decompressor() if compressed else None
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        fd, frame.bodyPath = tempfile.mkstemp(dir=self.spoolDir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as spool:
+                remaining = length
+                written = 0
+                cpuTime = 0
+                while remaining:
+                    chunk = yield from self._recvExact(
+                        min(remaining, SPOOL_CHUNK))
+                    remaining -= len(chunk)
+                    if frame.bodyError is not None:
+                        continue
+                    start = time.thread_time()
+                    blocks = (chunk, ) if decompressor is None else (
+                        self._inflate(decompressor, chunk))
+                    try:
+                        for block in blocks:
+                            written += len(block)
+                            if written > self.maxFrame:
+                                raise FrameTooLarge(
+                                    f'Body exceeds limit of {self.maxFrame}')
+                            decoder.decode(block)
+                            spool.write(block)
+                        if not remaining:
+                            decoder.decode(b'', final=True)
+                    except UnicodeDecodeError as ex:
+                        frame.bodyError = (
+                            f'Body is not valid UTF-8: {ex.reason}')
+                    cpuTime += time.thread_time() - start
+                if decompressor is not None:
+                    compressionStats.add(
+                        'decompressed', messages=1, cpuTime=cpuTime)
+        except BaseException:
+            os.remove(frame.bodyPath)
+            raise
+        if frame.bodyError is not None:
+            os.remove(frame.bodyPath)
+            frame.bodyPath = None
+
+    def receiving(self):
+        """Receive a message without performing any I/O itself.
+
+        A generator yielding every memoryview which has to be filled with the
+        next bytes read from the connection before it is resumed, so that the
+        same framing serves blocking sockets (see recieve) as well as an event
+        loop. Closing it early removes a partly spooled body.
+
+        Returns:
+            Frame holding the JSON representation of a Message, as the value
+            of the StopIteration.
+        Raises:
+            ConnectionAbortedError when a zero length is read from the header.
+            FrameTooLarge when the announced length exceeds maxFrame.
+        """
+        msgLen, flags = yield from self._recvHeader()
+        if msgLen == 0:
+            raise ConnectionAbortedError
+        payload = yield from self._recvExact(msgLen)
+        if flags & FLAG_COMPRESSED:
+            payload = self._decompress(payload)
+        frame = Frame(payload, 'utf-8')
+        if flags & FLAG_BODY:
+            yield from self._recvBody(frame)
+        return frame
+
+    def recieve(self):
+        """Recieve a message as a JSON string.
+
+        Returns:
+            Frame holding the JSON representation of a Message, ready to be
+            used in Message.fromJSON.
+        Raises:
+            ConnectionAbortedError when the connection is closed or a zero
+            length is read from the header.
+            FrameTooLarge when the announced length exceeds maxFrame.
+        """
+        steps = self.receiving()
+        try:
+            while True:
+                self._recvInto(next(steps))
+        except StopIteration as received:
+            return received.value
+        finally:
+            steps.close()
+
+    def _frame(self, payload, msgType, flags=0):
+        """Encode a frame, compressing the payload if it is large enough.
+
+        Args:
+            payload: bytes of the frame.
+            msgType: type of the sent message, used for the statistics.
+            flags: flags to set in the header.
+
+        Returns:
+            The header followed by the (compressed) payload.
+        """
+        if self.codec is not None and len(payload) >= self.compressThreshold:
+            start = time.thread_time()
+            compressed = CODECS[self.codec][0](payload)
+            compressionStats.add(
+                getattr(msgType, 'value', msgType),
+                messages=1,
+                rawBytes=len(payload),
+                compressedBytes=len(compressed),
+                cpuTime=time.thread_time() - start,
+            )
+            return self._header(
+                len(compressed), flags | FLAG_COMPRESSED) + compressed
+        return self._header(len(payload), flags) + payload
+
+    def send(self, message):
+        """Send the message over the channel.
+
+        The message is encoded as a Bytes object where the header holds the
+        length of the UTF-8 message as an unsigned integer in byteorder 'big',
+        after which the message as UTF-8 encoded JSON bytes object follows.
+        If the protocol supports it, the body of the message follows as a
+        second frame holding raw UTF-8 bytes.
+
+        Safe to call from many threads, messages are never interleaved.
+
+        Raises:
+            FrameTooLarge if the message does not fit in a single frame.
+        """
+        with self._sendLock:
+            self._send(message)
+
+    def _send(self, message):
+        bodyFile = getattr(message, 'bodyFile', None)
+        if message.BODY is None:
+            payload = message.toJSON().encode('utf-8')
+            self._out.sendall(self._frame(payload, message.type))
+        elif bodyFile is not None:
+            with bodyFile as source:
+                if self._sendCached(message):
+                    return
+                start, end = getattr(message, 'bodyRange', None) or (
+                    0, source.seek(0, os.SEEK_END))
+                size = end - start
+                # Files without a descriptor are sent from their position
+                source.seek(start)
+                if self.protocol < PROTOCOL_BODY:
+                    self._sendInline(message, source.read(size))
+                elif self.codec is not None and size >= self.compressThreshold:
+                    # Compression beats a zero-copy send on slow links
+                    self._sendBody(message, source.read(size))
+                else:
+                    self._out.sendall(
+                        self._jsonFrame(message, size) + self._header(size))
+                    if size:
+                        self._out.sendfile(source, start, size)
+        elif self.protocol < PROTOCOL_BODY:
+            self._sendInline(message)
+        else:
+            body = (getattr(message, message.BODY) or '').encode('utf-8')
+            self._sendBody(message, body)
+
+    def _bodyCacheKey(self, message):
+        """Key of the encoded body of a message in bodyCache, or None."""
+        bodyKey = getattr(message, 'bodyKey', None)
+        if self.bodyCache is None or bodyKey is None:
+            return None
+        if self.protocol < PROTOCOL_BODY:
+            return bodyKey + ('json', )
+        if self.codec is not None:
+            return bodyKey + (self.codec, self.compressThreshold)
+        # Sent straight from the file, nothing to cache
+        return None
+
+    def _sendCached(self, message):
+        """Send a message whose encoded body is in bodyCache.
+
+        Returns:
+            True if the message has been sent.
+        """
+        key = self._bodyCacheKey(message)
+        encoded = None if key is None else self.bodyCache.get(key)
+        if encoded is None:
+            return False
+        if self.protocol < PROTOCOL_BODY:
+            self._sendInline(message, encoded=encoded)
+        else:
+            self._sendFramed(message, *encoded)
+        return True
+
+    def _sendInline(self, message, body=None, encoded=None):
+        """Send a message with the body embedded in the JSON.
+
+        Args:
+            message: the message to send.
+            body: UTF-8 bytes to embed as the body instead of its value in
+                the message, if given.
+            encoded: the body already encoded as JSON, if given.
+        """
+        dictionary = message.toDict()
+        if encoded is None and body is not None:
+            encoded = json.dumps(str(body, 'utf-8'))
+            key = self._bodyCacheKey(message)
+            if key is not None:
+                self.bodyCache.put(key, encoded, len(encoded), body)
+        if encoded is None:
+            payload = json.dumps(dictionary)
+        else:
+            # Spliced in, so that the body is not escaped again
+            dictionary.pop(message.BODY, None)
+            payload = json.dumps(dictionary)[:-1] + (
+                f', "{message.BODY}": {encoded}}}')
+        self._out.sendall(self._frame(payload.encode('utf-8'), message.type))
+
+    def _sendBody(self, message, body):
+        """Send a message followed by the body held in memory."""
+        bodyFrame = self._frame(body, message.type)
+        key = self._bodyCacheKey(message)
+        if key is not None:
+            self.bodyCache.put(
+                key, (len(body), bodyFrame), len(bodyFrame), body)
+        self._sendFramed(message, len(body), bodyFrame)
+
+    def _sendFramed(self, message, bodyLength, bodyFrame):
+        """Send a message followed by the already framed body."""
+        jsonFrame = self._jsonFrame(message, bodyLength)
+        if len(bodyFrame) < SPOOL_CHUNK:
+            self._out.sendall(jsonFrame + bodyFrame)
+        else:
+            self._out.sendall(jsonFrame)
+            self._out.sendall(bodyFrame)
+
+    def _jsonFrame(self, message, bodyLength):
+        """Encode the JSON frame of a message whose body follows."""
+        dictionary = message.toDict()
+        dictionary.pop(message.BODY, None)
+        dictionary['bodyField'] = message.BODY
+        dictionary['bodyLength'] = bodyLength
+        payload = json.dumps(dictionary).encode('utf-8')
+        return self._frame(payload, message.type, FLAG_BODY)
+
+
+def _channel(sock):
+    if isinstance(sock, Channel):
+        return sock
+    return Channel(sock)
 
 
 def recieve(sock):
     """Recieve a message as a JSON string from the specified TCP socket.
 
+    Args:
+        sock: a Channel or a plain socket, which is read in legacy mode.
+
     Returns:
         JSON representation of a Message, ready to be used in Message.fromJSON.
     Raises:
-        ConnectionAbortedError when null is read from the first 8 bytes.
+        ConnectionAbortedError when null is read from the header.
     """
-    msgLen = int.from_bytes(sock.recv(2).strip(), byteorder='big')
-    if msgLen == 0:
-        raise ConnectionAbortedError
-    return sock.recv(msgLen).decode('utf-8')
+    return _channel(sock).recieve()
 
 
-def send(socket, message):
+def send(sock, message):
+    """Sends the message over a TCP connection on the specified socket.
+
+    Args:
+        sock: a Channel or a plain socket, which is written in legacy mode.
+        message: the Message to send.
     """
-    Sends the message over a TCP connection on the specified socket.
+    _channel(sock).send(message)
+
 
-    The message is encoed as a Bytes object where the first 8 bytes represent
-    length of the UTF-8 message as uint64 in byteorder 'big', after which the
-    message as UTF-8 encoded JSON bytes object follows.
+def exchange(sock, requests, window=16):
+    """Send many requests at once and recieve all of their responses.
+
+    The requests are pipelined: up to `window` of them are sent before the
+    first response is awaited, so the whole exchange costs roughly one round
+    trip per window. The server may answer them in any order. The window
+    should not exceed the pipeline depth allowed by the server.
+
+    Args:
+        sock: a Channel or a plain socket.
+        requests: a list of Request objects. Their requestID is overwritten.
+        window: the maximum number of requests in flight.
+
+    Returns:
+        List of JSON representations of the responses, in the order of the
+        requests.
     """
-    payload = message.toJSON().encode('utf-8')
-    payload = len(payload).to_bytes(2, byteorder='big', signed=False) + payload
-    socket.sendall(payload)
+    channel = _channel(sock)
+    responses = [None] * len(requests)
+    sent = 0
+    for received in range(len(requests)):
+        while sent < min(len(requests), received + window):
+            requests[sent].requestID = sent
+            channel.send(requests[sent])
+            sent += 1
+        data = channel.recieve()
+        responses[json.loads(data)['requestID']] = data
+    return responses
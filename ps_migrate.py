@@ -0,0 +1,27 @@
+"""Storage migration executable module.
+
+Moves the files stored directly in the storage directory into the layout set
+with the storage depth option, see server.layout. Takes the same options as
+ps_server.py, and may run while servers using that layout keep serving.
+"""
+import contextlib
+import sqlite3
+import sys
+from logging import error, info
+
+from server import config
+from server import layout
+
+if config.STORAGE_DEPTH == 0:
+    error('Set the storage depth of the layout to migrate to')
+    sys.exit(1)
+try:
+    with contextlib.closing(
+            sqlite3.connect(f'file:{config.DATABASE}?mode=ro',
+                            uri=True)) as con:
+        fileIDs = [row[0] for row in con.execute('SELECT id FROM Files;')]
+except sqlite3.DatabaseError as ex:
+    error(f'Fatal error reading database at {config.DATABASE}: {ex}')
+    sys.exit(1)
+info(f'Migrating {len(fileIDs)} files to storage depth {config.STORAGE_DEPTH}')
+info(f'Migrated {layout.migrate(fileIDs)} files')
@@ -1,9 +1,24 @@
 """Server executable module."""
-from server.tcpserver import TCPServer
-
-with TCPServer() as server:
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        print()
-        server.shutdown()
+from server import config
+from server import supervisor
+
+if config.ENGINE == 'asyncio':
+    from server.aioserver import AsyncServer as Server
+else:
+    from server.tcpserver import TCPServer as Server
+
+
+def serve():
+    """Run the server until interrupted."""
+    with Server() as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print()
+            server.shutdown()
+
+
+if config.WORKERS > 1:
+    supervisor.supervise(serve, config.WORKERS)
+else:
+    serve()
@@ -0,0 +1,171 @@
+"""Access module.
+
+Caches whether users have access to files, which is checked by every pull and
+push, so that the checks do not query the database each time.
+
+Entries are invalidated by the modifications changing the access, once they
+are commited. Every such modification is also recorded in the AccessChanges
+table, which the other worker processes read before using their caches, see
+AccessCache.sync.
+
+The number of hits, misses, evictions and invalidations, along with the hit
+rate, are exposed in the 'access' statistics.
+"""
+import threading
+from collections import OrderedDict
+
+from common import stats
+from server import config
+
+_stats = stats.counters('access')
+# Number of changes kept in the AccessChanges table
+KEEP_CHANGES = 1000
+
+
+def recordChange(con, fileID, user=None):
+    """Record a change of access to a file in the current transaction.
+
+    Args:
+        con: sqlite connection to the database.
+        fileID: ID of the file.
+        user: the user whose access changed, None for all of them.
+    """
+    version = con.execute(
+        '''
+        INSERT INTO AccessChanges (file, user) VALUES (?, ?);
+        ''',
+        (fileID, user),
+    ).lastrowid
+    if version % KEEP_CHANGES == 0:
+        con.execute(
+            '''
+            DELETE FROM AccessChanges WHERE version <= ?;
+            ''',
+            (version - KEEP_CHANGES, ),
+        )
+
+
+class AccessCache:
+    """Bounded cache of access of users to files with LRU eviction.
+
+    Filling the cache with a value queried before an invalidation is refused,
+    see get and put.
+
+    Args:
+        size: the maximum number of entries.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Cached users of every file, to invalidate the file as a whole
+        self._users = dict()
+        self._generation = 0
+        self._version = None
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, user, fileID):
+        """Look up the access of a user to a file.
+
+        Returns:
+            Tuple of the cached access, None on a miss, and the generation of
+            the cache to be passed to put along with the queried access.
+        """
+        with self._lock:
+            allowed = self._entries.get((user, fileID))
+            if allowed is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._entries.move_to_end((user, fileID))
+            _stats.set(
+                'cache',
+                hits=self._hits,
+                misses=self._misses,
+                hitRate=self._hits / (self._hits + self._misses),
+                size=len(self._entries),
+            )
+            return allowed, self._generation
+
+    def put(self, user, fileID, allowed, generation):
+        """Cache the access of a user to a file.
+
+        Ignored if the cache has been invalidated since get returned the
+        generation, as the access may have been queried before the change.
+        """
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[(user, fileID)] = allowed
+            self._users.setdefault(fileID, set()).add(user)
+            if len(self._entries) > self.size:
+                (oldUser, oldFile), _ = self._entries.popitem(last=False)
+                self._discard(oldUser, oldFile)
+                _stats.add('cache', evictions=1)
+
+    def _discard(self, user, fileID):
+        users = self._users[fileID]
+        users.discard(user)
+        if not users:
+            del self._users[fileID]
+
+    def invalidate(self, fileID, user=None):
+        """Drop the cached access to a file.
+
+        Args:
+            fileID: ID of the file.
+            user: the user whose access changed, None for all of them.
+        """
+        with self._lock:
+            self._generation += 1
+            if user is None:
+                users = self._users.pop(fileID, ())
+            else:
+                users = (user, ) if user in self._users.get(fileID, ()) else ()
+            for cachedUser in users:
+                del self._entries[(cachedUser, fileID)]
+                if user is not None:
+                    self._discard(cachedUser, fileID)
+            _stats.add('cache', invalidations=1)
+
+    def clear(self):
+        """Drop all cached entries."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._users.clear()
+
+    def sync(self, con):
+        """Apply the changes recorded by other processes since the last sync.
+
+        Everything is dropped if the changes have been trimmed in the
+        meantime.
+
+        Args:
+            con: sqlite connection to the database.
+        """
+        oldest, latest = con.execute(
+            '''
+            SELECT min(version), max(version) FROM AccessChanges;
+            ''').fetchone()
+        with self._lock:
+            seen = self._version
+        if latest is None or latest == seen:
+            return
+        if seen is None or oldest > seen + 1:
+            self.clear()
+        else:
+            for fileID, user in con.execute(
+                    '''
+                SELECT file, user FROM AccessChanges
+                WHERE version > ? AND version <= ?;
+                ''',
+                (seen, latest),
+            ):
+                self.invalidate(fileID, user)
+        with self._lock:
+            self._version = max(self._version or 0, latest)
+
+
+cache = AccessCache(config.ACCESS_CACHE_SIZE)
@@ -0,0 +1,132 @@
+"""Admission module.
+
+Limits the number of connections and of requests in flight, globally and per
+user, so that a burst of clients is refused with a quick "server busy" error
+telling them when to retry, instead of being queued without bounds.
+
+Every refusal is counted in the 'admission' statistics, along with the highest
+level reached of every limit.
+"""
+import random
+import socket
+import threading
+from collections import Counter
+
+from common import response
+from common import stats
+from common import transfer
+from server import config
+
+_stats = stats.counters('admission')
+
+
+class Busy(Exception):
+    """Raised when a limit does not admit a connection or a request."""
+
+
+class Limit:
+    """Global and per user limit of concurrently held slots.
+
+    Args:
+        name: name of the limit in the statistics.
+        limit: maximum number of slots held in total, 0 for no limit.
+        userLimit: maximum number of slots held by a single user, 0 for no
+            limit.
+    """
+    def __init__(self, name, limit, userLimit):
+        self.name = name
+        self.limit = limit
+        self.userLimit = userLimit
+        self._lock = threading.Lock()
+        self._held = 0
+        self._userHeld = Counter()
+        self._peak = 0
+
+    def acquire(self, user=None):
+        """Take a slot of the global limit and of the limit of the user.
+
+        Args:
+            user: the user taking the slot, only the global limit applies if
+                None.
+
+        Raises:
+            Busy if a limit has been reached.
+        """
+        with self._lock:
+            if self.limit and self._held >= self.limit:
+                _stats.add(self.name, rejected=1)
+                raise Busy(f'Server busy, too many {self.name}')
+            if user is not None:
+                self._acquireUser(user)
+            self._held += 1
+            if self._held > self._peak:
+                self._peak = self._held
+                _stats.set(self.name, peak=self._peak)
+
+    def acquireUser(self, user):
+        """Take a slot of the limit of the user only, see acquire."""
+        with self._lock:
+            self._acquireUser(user)
+
+    def _acquireUser(self, user):
+        if self.userLimit and self._userHeld[user] >= self.userLimit:
+            _stats.add(self.name, rejectedUser=1)
+            raise Busy(f'Server busy, too many {self.name} of user {user}')
+        self._userHeld[user] += 1
+
+    def release(self, user=None):
+        """Return a slot taken with acquire."""
+        with self._lock:
+            self._held -= 1
+            if user is not None:
+                self._releaseUser(user)
+
+    def releaseUser(self, user):
+        """Return a slot taken with acquireUser."""
+        with self._lock:
+            self._releaseUser(user)
+
+    def _releaseUser(self, user):
+        self._userHeld[user] -= 1
+        if not self._userHeld[user]:
+            del self._userHeld[user]
+
+
+connections = Limit(
+    'connections',
+    config.MAX_CONNECTIONS,
+    config.MAX_USER_CONNECTIONS,
+)
+requests = Limit(
+    'requests',
+    config.MAX_REQUESTS,
+    config.MAX_USER_REQUESTS,
+)
+
+
+def busyResponse(ex):
+    """Create the response to a refused connection or request.
+
+    The time to retry after is randomized, so that refused clients do not
+    return all at once.
+    """
+    return response.ErrResponse(
+        err=ex,
+        retryAfter=random.randint(config.RETRY_AFTER, 2 * config.RETRY_AFTER),
+    )
+
+
+def reject(sock, ex):
+    """Refuse a new connection with a busy response, without serving it.
+
+    The response is framed as the handshake. Whatever the client has sent so
+    far is drained, so that closing the socket does not reset the connection
+    before the client reads the response.
+    """
+    try:
+        transfer.Channel(sock).send(busyResponse(ex))
+        sock.shutdown(socket.SHUT_WR)
+        while sock.recv(transfer.SPOOL_CHUNK, socket.MSG_DONTWAIT):
+            pass
+    except OSError:
+        pass
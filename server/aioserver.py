@@ -0,0 +1,241 @@
+"""Asyncio server module.
+
+Serves the plainsync protocol from a single asyncio event loop, an alternative
+to the thread per connection tcpserver.TCPServer.
+
+The loop receives the requests itself, so neither an idle session nor a client
+sending a request slowly holds a thread. Only complete requests are handed to
+the same handler code as in the threaded server, on a bounded pool of threads
+which performs all the blocking authentication, database and file operations.
+"""
+import asyncio
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from logging import info, warning
+
+from common import transfer
+from server import admission
+from server import config
+from server import handler
+from server.tcpserver import keepalive, logStats
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Seconds a session may take to send a frame or a chunk of a body of a started
+# request
+READ_TIMEOUT = 60
+
+
+class Session(handler.TCPHandler):
+    """Handler of a single connection of the asyncio server.
+
+    Only opens the channel when created. The requests, starting with the
+    authentication, are received by AsyncServer and handed over one at a time
+    to authenticate and dispatch.
+    """
+    def setup(self):
+        self.openChannel()
+
+    def handle(self):
+        pass
+
+    def finish(self):
+        pass
+
+
+def _raiseFileLimit():
+    """Raise the limit of open files to the maximum allowed."""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError) as ex:
+            warning('Unable to raise the limit of open files: %s', ex)
+        else:
+            soft = hard
+    info('Limit of open files is %s', soft)
+
+
+class AsyncServer:
+    """Asyncio server class.
+
+    Listens on the socket defined in config.HOST and config.PORT, handling
+    every connection with a Session.
+
+    Items:
+        socket: the listening socket.
+        executor: pool of threads receiving and processing requests.
+    """
+    def __init__(self):
+        _raiseFileLimit()
+        self.socket = socket.create_server(
+            (config.HOST, config.PORT),
+            backlog=config.ACCEPT_QUEUE,
+            # Worker processes share the port, see supervisor
+            reuse_port=config.WORKERS > 1,
+        )
+        self.socket.setblocking(False)
+        self.executor = ThreadPoolExecutor(
+            max_workers=config.WORKER_THREADS,
+            thread_name_prefix='plainsync-io',
+        )
+        info('Created plainsync server on %s:%s', config.HOST, config.PORT)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.server_close()
+
+    def serve_forever(self):
+        """Run the event loop until interrupted."""
+        info(
+            'Started plainsync server on %s:%s (asyncio)',
+            config.HOST,
+            config.PORT,
+        )
+        asyncio.run(self._serve())
+
+    def shutdown(self):
+        """Stop processing requests."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def server_close(self):
+        """Close the listening socket."""
+        self.socket.close()
+        logStats()
+        info('Shut down plainsync server on %s:%s', config.HOST, config.PORT)
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(self.executor)
+        if config.STATS_INTERVAL > 0:
+            loop.create_task(self._logStatsPeriodically())
+        sessions = set()
+        while True:
+            conn, address = await loop.sock_accept(self.socket)
+            try:
+                admission.connections.acquire()
+            except admission.Busy as ex:
+                info('Refused connection of %s: %s', address[0], ex)
+                admission.reject(conn, ex)
+                conn.close()
+                continue
+            task = loop.create_task(self._session(conn, address))
+            # Keep a reference, the loop only holds weak ones
+            sessions.add(task)
+            task.add_done_callback(sessions.discard)
+
+    async def _logStatsPeriodically(self):
+        while True:
+            await asyncio.sleep(config.STATS_INTERVAL)
+            logStats()
+
+    async def _session(self, conn, address):
+        loop = asyncio.get_running_loop()
+        keepalive(conn)
+        conn.setblocking(False)
+        session = None
+        try:
+            try:
+                await asyncio.wait_for(
+                    self._readable(conn),
+                    config.IDLE_TIMEOUT or None,
+                )
+            except asyncio.TimeoutError:
+                return
+            session = Session(conn, address, self)
+            try:
+                data = await self._recieve(conn, session.channel)
+            except (
+                    asyncio.TimeoutError,
+                    OSError,
+                    UnicodeDecodeError,
+                    transfer.FrameTooLarge,
+            ):
+                return
+            await loop.run_in_executor(None, session.authenticate, data)
+            if session.sessionID is None:
+                return
+            try:
+                while True:
+                    try:
+                        await asyncio.wait_for(
+                            self._readable(conn),
+                            config.IDLE_TIMEOUT or None,
+                        )
+                    except asyncio.TimeoutError:
+                        session.logTimeout()
+                        break
+                    try:
+                        data = await self._recieve(conn, session.channel)
+                    except asyncio.TimeoutError:
+                        session.logTimeout()
+                        break
+                    except (OSError, transfer.FrameTooLarge) as ex:
+                        session.logFailedReceive(ex)
+                        break
+                    if not await loop.run_in_executor(
+                            None,
+                            session.dispatch,
+                            data,
+                    ):
+                        break
+            finally:
+                await loop.run_in_executor(None, session.closeSession)
+        except OSError:
+            pass
+        finally:
+            if session is not None:
+                session.channel.sendSock.close()
+            conn.close()
+            admission.connections.release()
+
+    @staticmethod
+    async def _recieve(conn, channel):
+        """Receive a whole message, see transfer.Channel.receiving.
+
+        Every frame, or chunk of a body, has to arrive within READ_TIMEOUT.
+        """
+        steps = channel.receiving()
+        try:
+            while True:
+                await asyncio.wait_for(
+                    AsyncServer._recvInto(conn, next(steps)),
+                    READ_TIMEOUT,
+                )
+        except StopIteration as received:
+            return received.value
+        finally:
+            steps.close()
+
+    @staticmethod
+    async def _recvInto(conn, view):
+        """Fill the whole memoryview with data read from the connection."""
+        loop = asyncio.get_running_loop()
+        read = 0
+        while read < len(view):
+            count = await loop.sock_recv_into(conn, view[read:])
+            if count == 0:
+                raise ConnectionAbortedError
+            read += count
+
+    @staticmethod
+    async def _readable(conn):
+        """Wait until the connection has data to receive."""
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_reader(
+            conn.fileno(),
+            # The callback may run again before the waiting task resumes
+            lambda: ready.done() or ready.set_result(None),
+        )
+        try:
+            await ready
+        finally:
+            loop.remove_reader(conn.fileno())
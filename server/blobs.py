@@ -0,0 +1,197 @@
+"""Blobs module.
+
+Content addressed storage of the contents of files, used by dbmanager with
+config.DEDUP. The contents are stored once per distinct content hash, see
+delta.contentHash, as blobs under the `blobs` directory of the storage, and the
+Files table points every file at the blob of its contents. Files with the same
+contents share a blob, and pushing contents which are already stored only
+changes the database.
+
+The Blobs table counts the files referencing every blob. A blob which is no
+longer referenced is kept for config.BLOB_GRACE seconds, so that pulls which
+located it just before do not fail, and is reused if its contents are pushed
+again in the meantime. It is then deleted by collect.
+
+Blob files are only ever written and deleted by the writer holding the
+database write lock, before it commits, so no worker process deletes a blob
+while another one references it. A transaction rolled back after storing a
+blob leaves it unreferenced on the disk, where it is reused by the next push
+of the same contents.
+
+The number of stored, deduplicated and collected blobs are exposed in the
+'blobs' statistics.
+"""
+import os
+import tempfile
+import time
+
+from common import stats
+from server import config
+from server import durability
+from server import lineindex
+
+_stats = stats.counters('blobs')
+ROOT = config.STORAGE + os.sep + 'blobs'
+# Time of the next collection of unreferenced blobs by this process
+_nextCollection = 0
+
+
+def blobPath(blobHash):
+    """Returns the path of the blob of given content hash."""
+    return ROOT + os.sep + blobHash[:2] + os.sep + blobHash
+
+
+def exists(blobHash):
+    """Check if the blob of given content hash is stored."""
+    return os.path.exists(blobPath(blobHash))
+
+
+def drop(sourcePath=None, indexPath=None):
+    """Remove pushed contents which are already stored as a blob."""
+    if sourcePath is not None:
+        os.remove(sourcePath)
+    if indexPath is not None:
+        os.remove(indexPath)
+    _stats.add('blobs', deduplicated=1)
+
+
+def acquire(con, blobHash, sourcePath=None, indexPath=None, contents=''):
+    """Reference a blob in the current transaction, storing it if needed.
+
+    Args:
+        con: the writer connection to the database.
+        blobHash: content hash of the blob.
+        sourcePath: path of a file in the storage directory holding the
+            contents, if any. It is moved into place, or removed if the blob is
+            already stored.
+        indexPath: path of the line index of the source file, if any.
+        contents: the contents, written if there is no source file and the
+            blob is not stored.
+    """
+    con.execute(
+        '''
+        INSERT INTO Blobs (hash, refs) VALUES (?, 1)
+        ON CONFLICT (hash) DO UPDATE SET refs=refs+1, released=NULL;
+        ''',
+        (blobHash, ),
+    )
+    path = blobPath(blobHash)
+    if os.path.exists(path):
+        drop(sourcePath, indexPath)
+    else:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+            # Flush the entries of the new directory and of the blobs root
+            durability.syncDirectory(directory)
+            durability.syncDirectory(ROOT)
+        if sourcePath is None:
+            # Written aside first, a partial blob must never be reused
+            fd, sourcePath = tempfile.mkstemp(
+                dir=config.STORAGE, suffix='.tmp')
+            with open(fd, 'w', encoding='utf-8') as fNew:
+                fNew.write(contents)
+            durability.syncFile(sourcePath)
+        os.replace(sourcePath, path)
+        durability.syncDirectory(path)
+        if indexPath is not None:
+            os.replace(indexPath, lineindex.indexPath(path))
+        _stats.add('blobs', stored=1)
+    collect(con)
+
+
+def release(con, blobHash):
+    """Drop a reference to a blob in the current transaction.
+
+    Unreferenced blobs are deleted by a later collect, which also runs on
+    acquire.
+    """
+    con.execute(
+        '''
+        UPDATE Blobs
+        SET refs=refs-1, released=CASE WHEN refs=1 THEN ? ELSE released END
+        WHERE hash=?;
+        ''',
+        (time.time(), blobHash),
+    )
+    collect(con)
+
+
+def clean(con):
+    """Delete unreferenced blobs and the blob files missing in the database.
+
+    Run on startup, in a transaction holding the write lock. Besides the blobs
+    collect deletes, this removes the files of blobs whose transaction was
+    rolled back, or whose deletion was interrupted, along with their line
+    indexes.
+
+    Returns:
+        The number of removed files.
+    """
+    global _nextCollection    # pylint: disable=global-statement
+    _nextCollection = 0
+    collect(con)
+    if not os.path.isdir(ROOT):
+        return 0
+    removed = 0
+    with os.scandir(ROOT) as directories:
+        for directory in directories:
+            if not directory.is_dir():
+                continue
+            prefix = directory.name
+            # Hashes are lowercase hexadecimal, 'g' follows all of them
+            known = {
+                row[0] for row in con.execute(
+                    'SELECT hash FROM Blobs WHERE hash>=? AND hash<?;',
+                    (prefix, prefix + 'g'),
+                )
+            }
+            with os.scandir(directory.path) as entries:
+                for entry in entries:
+                    blobHash = entry.name
+                    if blobHash.endswith('.lines'):
+                        blobHash = blobHash[:-len('.lines')]
+                    if blobHash in known:
+                        continue
+                    try:
+                        os.remove(entry.path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+    return removed
+
+
+def collect(con):
+    """Delete blobs unreferenced for config.BLOB_GRACE seconds.
+
+    Runs at most once every config.BLOB_GRACE seconds. Must be called in a
+    transaction which already modified the database, so that the write lock is
+    held and no other writer references the blobs while they are deleted.
+    """
+    global _nextCollection    # pylint: disable=global-statement
+    now = time.time()
+    if now < _nextCollection:
+        return
+    _nextCollection = now + config.BLOB_GRACE
+    collected = [
+        row[0] for row in con.execute(
+            '''
+            SELECT hash FROM Blobs WHERE refs=0 AND released<?;
+            ''',
+            (now - config.BLOB_GRACE, ),
+        )
+    ]
+    for blobHash in collected:
+        con.execute(
+            '''
+            DELETE FROM Blobs WHERE hash=?;
+            ''',
+            (blobHash, ),
+        )
+        try:
+            os.remove(blobPath(blobHash))
+        except FileNotFoundError:
+            pass
+        lineindex.remove(blobPath(blobHash))
+    if collected:
+        _stats.add('blobs', collected=len(collected))
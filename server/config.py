@@ -6,6 +6,7 @@ Defines fallback options if no configuration is provided.
 import argparse
 import logging
 import os
+import secrets
 
 _parser = argparse.ArgumentParser(description='Plainsync server executable.', )
 _parser.add_argument(
@@ -17,14 +18,220 @@ _parser.add_argument(
     type=int,
     help='sets the port number for TCP server',
 )
+_parser.add_argument(
+    '--engine',
+    choices=('threads', 'asyncio'),
+    help='sets the server engine (default threads)',
+)
+_parser.add_argument(
+    '--workers',
+    type=int,
+    help='sets the number of server processes (default 1)',
+)
+_parser.add_argument(
+    '--store',
+    choices=('sqlite', 'memory'),
+    help='sets the store of users, files and shares (default sqlite)',
+)
+_parser.add_argument(
+    '--memory-users',
+    help='sets the comma separated USER:PASSWORD users of the memory store',
+)
 _parser.add_argument(
     '--database',
     help='sets the path to the sqlite database',
 )
+_parser.add_argument(
+    '--db-readers',
+    type=int,
+    help='sets the number of pooled database connections used for reading',
+)
+_parser.add_argument(
+    '--db-synchronous',
+    choices=('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    help='sets the sqlite synchronous pragma (default NORMAL)',
+)
+_parser.add_argument(
+    '--db-cache-size',
+    type=int,
+    help='sets the sqlite cache_size pragma of every connection, in pages '
+    'or in KiB if negative',
+)
+_parser.add_argument(
+    '--db-mmap-size',
+    type=int,
+    help='sets the sqlite mmap_size pragma in bytes (default no mmap)',
+)
+_parser.add_argument(
+    '--db-busy-timeout',
+    type=int,
+    help='sets the milliseconds waited for a locked database',
+)
 _parser.add_argument(
     '--storage',
     help='sets the path to the storage directory',
 )
+_parser.add_argument(
+    '--storage-depth',
+    type=int,
+    help='sets the levels of directories named by file ID prefixes the '
+    'stored files are fanned out into (default 0, flat)',
+)
+_parser.add_argument(
+    '--durability',
+    choices=('none', 'fdatasync', 'fsync'),
+    help='sets how pushed files are flushed to the disk: not at all, their '
+    'contents, or their contents and directory (default none)',
+)
+_parser.add_argument(
+    '--dedup',
+    choices=('on', 'off'),
+    help='stores identical file contents once, as content addressed blobs '
+    '(default off)',
+)
+_parser.add_argument(
+    '--blob-grace',
+    type=int,
+    help='sets the seconds for which unreferenced blobs, and files migrated '
+    'to another layout, are kept',
+)
+_parser.add_argument(
+    '--access-cache-size',
+    type=int,
+    help='sets the number of cached access checks of users to files',
+)
+_parser.add_argument(
+    '--content-cache-size',
+    type=int,
+    help='sets the bytes of pulled file contents cached by every server '
+    'process, 0 disables the cache',
+)
+_parser.add_argument(
+    '--group-commit-window',
+    type=int,
+    help='sets the milliseconds for which modifications are collected to be '
+    'commited together (default no group commit)',
+)
+_parser.add_argument(
+    '--group-commit-size',
+    type=int,
+    help='sets the maximum number of modifications commited together',
+)
+_parser.add_argument(
+    '--max-frame',
+    type=int,
+    help='sets the maximum size of a single message in bytes',
+)
+_parser.add_argument(
+    '--max-batch',
+    type=int,
+    help='sets the maximum number of requests in a batch',
+)
+_parser.add_argument(
+    '--compression',
+    help='sets the comma separated compression codecs allowed, or "none"',
+)
+_parser.add_argument(
+    '--compress-threshold',
+    type=int,
+    help='sets the smallest message size in bytes which gets compressed',
+)
+_parser.add_argument(
+    '--worker-threads',
+    type=int,
+    help='sets the number of threads processing requests',
+)
+_parser.add_argument(
+    '--priorities',
+    help='sets the comma separated TYPE:CLASS priority classes of request '
+    'types, lower classes are processed first',
+)
+_parser.add_argument(
+    '--user-weights',
+    help='sets the comma separated USER:WEIGHT shares of the workers of '
+    'users (default 1)',
+)
+_parser.add_argument(
+    '--pipeline-depth',
+    type=int,
+    help='sets the maximum number of pipelined requests of a session',
+)
+_parser.add_argument(
+    '--max-connections',
+    type=int,
+    help='sets the maximum number of connections (default no limit)',
+)
+_parser.add_argument(
+    '--max-user-connections',
+    type=int,
+    help='sets the maximum number of sessions of a user (default no limit)',
+)
+_parser.add_argument(
+    '--max-requests',
+    type=int,
+    help='sets the maximum number of requests in flight (default no limit)',
+)
+_parser.add_argument(
+    '--max-user-requests',
+    type=int,
+    help='sets the maximum number of requests in flight of a user '
+    '(default no limit)',
+)
+_parser.add_argument(
+    '--accept-queue',
+    type=int,
+    help='sets the maximum number of connections waiting to be accepted',
+)
+_parser.add_argument(
+    '--retry-after',
+    type=int,
+    help='sets the milliseconds after which refused clients may retry',
+)
+_parser.add_argument(
+    '--idle-timeout',
+    type=int,
+    help='sets the seconds after which idle sessions are closed '
+    '(default never)',
+)
+_parser.add_argument(
+    '--send-timeout',
+    type=int,
+    help='sets the seconds after which sending a response to a client which '
+    'does not read it fails and closes the connection (0 means never)',
+)
+_parser.add_argument(
+    '--session-ttl',
+    type=int,
+    help='sets the seconds for which a session may be resumed on a new '
+    'connection',
+)
+_parser.add_argument(
+    '--session-secret',
+    help='sets the key signing the session resumption tokens (default '
+    'random on every start)',
+)
+_parser.add_argument(
+    '--keepalive-idle',
+    type=int,
+    help='sets the seconds of silence after which TCP keepalive probes '
+    'are sent',
+)
+_parser.add_argument(
+    '--keepalive-interval',
+    type=int,
+    help='sets the seconds between TCP keepalive probes',
+)
+_parser.add_argument(
+    '--keepalive-count',
+    type=int,
+    help='sets the number of unanswered TCP keepalive probes after which '
+    'the connection is dropped',
+)
+_parser.add_argument(
+    '--stats-interval',
+    type=int,
+    help='sets the interval in seconds of logging statistics (default never)',
+)
 _parser.add_argument(
     '--loglevel',
     help='set the logging level (default INFO)',
@@ -42,15 +249,222 @@ DEFAULT_PORT = 9999
 PORT = _args.port or os.getenv('PLAINSYNC_PORT') or DEFAULT_PORT
 PORT = int(PORT)
 
+DEFAULT_ENGINE = 'threads'
+ENGINE = _args.engine or os.getenv('PLAINSYNC_ENGINE') or DEFAULT_ENGINE
+
+DEFAULT_WORKERS = 1
+WORKERS = _args.workers or os.getenv('PLAINSYNC_WORKERS') or DEFAULT_WORKERS
+WORKERS = int(WORKERS)
+
 DEFAULT_STORAGE = os.getcwd() + os.sep + 'data'
 STORAGE = _args.storage or os.getenv('PLAINSYNC_STORAGE') or DEFAULT_STORAGE
 # Create the path if it does not exist
 os.makedirs(STORAGE, exist_ok=True)
 
+DEFAULT_STORE = 'sqlite'
+STORE = _args.store or os.getenv('PLAINSYNC_STORE') or DEFAULT_STORE
+
+DEFAULT_MEMORY_USERS = ''
+MEMORY_USERS = _args.memory_users or os.getenv(
+    'PLAINSYNC_MEMORY_USERS') or DEFAULT_MEMORY_USERS
+MEMORY_USERS = dict(
+    item.strip().split(':', 1) for item in MEMORY_USERS.split(',')
+    if item.strip())
+
 DEFAULT_DATABASE = STORAGE + os.sep + 'plainsync.sqlite'
 DATABASE = _args.database or os.getenv(
     'PLAINSYNC_DATABASE') or DEFAULT_DATABASE
 
+DEFAULT_DB_READERS = 8
+DB_READERS = _args.db_readers or os.getenv(
+    'PLAINSYNC_DB_READERS') or DEFAULT_DB_READERS
+DB_READERS = int(DB_READERS)
+
+DEFAULT_DB_SYNCHRONOUS = 'NORMAL'
+DB_SYNCHRONOUS = _args.db_synchronous or os.getenv(
+    'PLAINSYNC_DB_SYNCHRONOUS') or DEFAULT_DB_SYNCHRONOUS
+
+DEFAULT_DB_CACHE_SIZE = -16384    # 16 MiB
+DB_CACHE_SIZE = _args.db_cache_size or os.getenv(
+    'PLAINSYNC_DB_CACHE_SIZE') or DEFAULT_DB_CACHE_SIZE
+DB_CACHE_SIZE = int(DB_CACHE_SIZE)
+
+DEFAULT_DB_MMAP_SIZE = 0    # Disabled
+DB_MMAP_SIZE = _args.db_mmap_size or os.getenv(
+    'PLAINSYNC_DB_MMAP_SIZE') or DEFAULT_DB_MMAP_SIZE
+DB_MMAP_SIZE = int(DB_MMAP_SIZE)
+
+DEFAULT_DB_BUSY_TIMEOUT = 5000
+DB_BUSY_TIMEOUT = _args.db_busy_timeout or os.getenv(
+    'PLAINSYNC_DB_BUSY_TIMEOUT') or DEFAULT_DB_BUSY_TIMEOUT
+DB_BUSY_TIMEOUT = int(DB_BUSY_TIMEOUT)
+
+DEFAULT_STORAGE_DEPTH = 0    # Flat
+STORAGE_DEPTH = _args.storage_depth or os.getenv(
+    'PLAINSYNC_STORAGE_DEPTH') or DEFAULT_STORAGE_DEPTH
+STORAGE_DEPTH = int(STORAGE_DEPTH)
+
+DEFAULT_DURABILITY = 'none'
+DURABILITY = _args.durability or os.getenv(
+    'PLAINSYNC_DURABILITY') or DEFAULT_DURABILITY
+
+DEFAULT_DEDUP = 'off'
+DEDUP = _args.dedup or os.getenv('PLAINSYNC_DEDUP') or DEFAULT_DEDUP
+DEDUP = DEDUP == 'on'
+
+DEFAULT_BLOB_GRACE = 60
+BLOB_GRACE = _args.blob_grace or os.getenv(
+    'PLAINSYNC_BLOB_GRACE') or DEFAULT_BLOB_GRACE
+BLOB_GRACE = int(BLOB_GRACE)
+
+DEFAULT_ACCESS_CACHE_SIZE = 65536
+ACCESS_CACHE_SIZE = _args.access_cache_size or os.getenv(
+    'PLAINSYNC_ACCESS_CACHE_SIZE') or DEFAULT_ACCESS_CACHE_SIZE
+ACCESS_CACHE_SIZE = int(ACCESS_CACHE_SIZE)
+
+DEFAULT_CONTENT_CACHE_SIZE = 64 * 1024 * 1024
+# Compared with None, as 0 disables the cache
+CONTENT_CACHE_SIZE = _args.content_cache_size
+if CONTENT_CACHE_SIZE is None:
+    CONTENT_CACHE_SIZE = os.getenv(
+        'PLAINSYNC_CONTENT_CACHE_SIZE') or DEFAULT_CONTENT_CACHE_SIZE
+CONTENT_CACHE_SIZE = int(CONTENT_CACHE_SIZE)
+
+DEFAULT_GROUP_COMMIT_WINDOW = 0    # Disabled
+GROUP_COMMIT_WINDOW = _args.group_commit_window or os.getenv(
+    'PLAINSYNC_GROUP_COMMIT_WINDOW') or DEFAULT_GROUP_COMMIT_WINDOW
+GROUP_COMMIT_WINDOW = int(GROUP_COMMIT_WINDOW)
+
+DEFAULT_GROUP_COMMIT_SIZE = 64
+GROUP_COMMIT_SIZE = _args.group_commit_size or os.getenv(
+    'PLAINSYNC_GROUP_COMMIT_SIZE') or DEFAULT_GROUP_COMMIT_SIZE
+GROUP_COMMIT_SIZE = int(GROUP_COMMIT_SIZE)
+
+DEFAULT_MAX_FRAME = 64 * 1024 * 1024
+MAX_FRAME = _args.max_frame or os.getenv(
+    'PLAINSYNC_MAX_FRAME') or DEFAULT_MAX_FRAME
+MAX_FRAME = int(MAX_FRAME)
+
+DEFAULT_MAX_BATCH = 1000
+MAX_BATCH = _args.max_batch or os.getenv(
+    'PLAINSYNC_MAX_BATCH') or DEFAULT_MAX_BATCH
+MAX_BATCH = int(MAX_BATCH)
+
+DEFAULT_COMPRESSION = 'zlib,lzma,bz2'
+COMPRESSION = _args.compression or os.getenv(
+    'PLAINSYNC_COMPRESSION') or DEFAULT_COMPRESSION
+COMPRESSION = [
+    codec.strip() for codec in COMPRESSION.split(',')
+    if codec.strip() and codec.strip() != 'none'
+]
+
+DEFAULT_COMPRESS_THRESHOLD = 1024
+COMPRESS_THRESHOLD = _args.compress_threshold or os.getenv(
+    'PLAINSYNC_COMPRESS_THRESHOLD') or DEFAULT_COMPRESS_THRESHOLD
+COMPRESS_THRESHOLD = int(COMPRESS_THRESHOLD)
+
+DEFAULT_WORKER_THREADS = 16
+WORKER_THREADS = _args.worker_threads or os.getenv(
+    'PLAINSYNC_WORKER_THREADS') or DEFAULT_WORKER_THREADS
+WORKER_THREADS = int(WORKER_THREADS)
+
+DEFAULT_PRIORITIES = ('PING:0,PULL:0,PUSH:0,'
+                      'AUTH:1,NEW_FILE:1,DELETE_FILE:1,NEW_SHARE:1,DELETE_SHARE:1,'
+                      'LIST_FILES:2,BATCH:2')
+PRIORITIES = _args.priorities or os.getenv(
+    'PLAINSYNC_PRIORITIES') or DEFAULT_PRIORITIES
+PRIORITIES = {
+    msgType.strip().upper(): int(klass)
+    for msgType, klass in (
+        item.split(':') for item in PRIORITIES.split(',') if item.strip())
+}
+
+DEFAULT_USER_WEIGHTS = ''
+USER_WEIGHTS = _args.user_weights or os.getenv(
+    'PLAINSYNC_USER_WEIGHTS') or DEFAULT_USER_WEIGHTS
+USER_WEIGHTS = {
+    user.strip(): float(weight)
+    for user, weight in (
+        item.split(':') for item in USER_WEIGHTS.split(',') if item.strip())
+}
+
+DEFAULT_PIPELINE_DEPTH = 32
+PIPELINE_DEPTH = _args.pipeline_depth or os.getenv(
+    'PLAINSYNC_PIPELINE_DEPTH') or DEFAULT_PIPELINE_DEPTH
+PIPELINE_DEPTH = int(PIPELINE_DEPTH)
+
+DEFAULT_MAX_CONNECTIONS = 0    # No limit
+MAX_CONNECTIONS = _args.max_connections or os.getenv(
+    'PLAINSYNC_MAX_CONNECTIONS') or DEFAULT_MAX_CONNECTIONS
+MAX_CONNECTIONS = int(MAX_CONNECTIONS)
+
+DEFAULT_MAX_USER_CONNECTIONS = 0    # No limit
+MAX_USER_CONNECTIONS = _args.max_user_connections or os.getenv(
+    'PLAINSYNC_MAX_USER_CONNECTIONS') or DEFAULT_MAX_USER_CONNECTIONS
+MAX_USER_CONNECTIONS = int(MAX_USER_CONNECTIONS)
+
+DEFAULT_MAX_REQUESTS = 0    # No limit
+MAX_REQUESTS = _args.max_requests or os.getenv(
+    'PLAINSYNC_MAX_REQUESTS') or DEFAULT_MAX_REQUESTS
+MAX_REQUESTS = int(MAX_REQUESTS)
+
+DEFAULT_MAX_USER_REQUESTS = 0    # No limit
+MAX_USER_REQUESTS = _args.max_user_requests or os.getenv(
+    'PLAINSYNC_MAX_USER_REQUESTS') or DEFAULT_MAX_USER_REQUESTS
+MAX_USER_REQUESTS = int(MAX_USER_REQUESTS)
+
+DEFAULT_ACCEPT_QUEUE = 128
+ACCEPT_QUEUE = _args.accept_queue or os.getenv(
+    'PLAINSYNC_ACCEPT_QUEUE') or DEFAULT_ACCEPT_QUEUE
+ACCEPT_QUEUE = int(ACCEPT_QUEUE)
+
+DEFAULT_RETRY_AFTER = 1000
+RETRY_AFTER = _args.retry_after or os.getenv(
+    'PLAINSYNC_RETRY_AFTER') or DEFAULT_RETRY_AFTER
+RETRY_AFTER = int(RETRY_AFTER)
+
+DEFAULT_IDLE_TIMEOUT = 0    # Never
+IDLE_TIMEOUT = _args.idle_timeout or os.getenv(
+    'PLAINSYNC_IDLE_TIMEOUT') or DEFAULT_IDLE_TIMEOUT
+IDLE_TIMEOUT = int(IDLE_TIMEOUT)
+
+DEFAULT_SEND_TIMEOUT = 60
+# Compared with None, as 0 disables the timeout
+SEND_TIMEOUT = _args.send_timeout
+if SEND_TIMEOUT is None:
+    SEND_TIMEOUT = os.getenv('PLAINSYNC_SEND_TIMEOUT') or DEFAULT_SEND_TIMEOUT
+SEND_TIMEOUT = int(SEND_TIMEOUT)
+
+DEFAULT_SESSION_TTL = 300
+SESSION_TTL = _args.session_ttl or os.getenv(
+    'PLAINSYNC_SESSION_TTL') or DEFAULT_SESSION_TTL
+SESSION_TTL = int(SESSION_TTL)
+
+# Generated before the worker processes are forked, so they all share it
+DEFAULT_SESSION_SECRET = secrets.token_hex(32)
+SESSION_SECRET = _args.session_secret or os.getenv(
+    'PLAINSYNC_SESSION_SECRET') or DEFAULT_SESSION_SECRET
+
+DEFAULT_KEEPALIVE_IDLE = 60
+KEEPALIVE_IDLE = _args.keepalive_idle or os.getenv(
+    'PLAINSYNC_KEEPALIVE_IDLE') or DEFAULT_KEEPALIVE_IDLE
+KEEPALIVE_IDLE = int(KEEPALIVE_IDLE)
+
+DEFAULT_KEEPALIVE_INTERVAL = 10
+KEEPALIVE_INTERVAL = _args.keepalive_interval or os.getenv(
+    'PLAINSYNC_KEEPALIVE_INTERVAL') or DEFAULT_KEEPALIVE_INTERVAL
+KEEPALIVE_INTERVAL = int(KEEPALIVE_INTERVAL)
+
+DEFAULT_KEEPALIVE_COUNT = 5
+KEEPALIVE_COUNT = _args.keepalive_count or os.getenv(
+    'PLAINSYNC_KEEPALIVE_COUNT') or DEFAULT_KEEPALIVE_COUNT
+KEEPALIVE_COUNT = int(KEEPALIVE_COUNT)
+
+DEFAULT_STATS_INTERVAL = 0    # Never
+STATS_INTERVAL = _args.stats_interval or os.getenv(
+    'PLAINSYNC_STATS_INTERVAL') or DEFAULT_STATS_INTERVAL
+STATS_INTERVAL = int(STATS_INTERVAL)
+
 DEFAULT_LOGLEVEL = 'INFO'
 LOGLEVEL = _args.loglevel or os.getenv(
     'PLAINSYNC_LOGLEVEL') or DEFAULT_LOGLEVEL
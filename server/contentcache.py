@@ -0,0 +1,154 @@
+"""Content cache module.
+
+Caches the contents of pulled files and their encoded forms, so that popular
+files are not read from the disk, escaped into JSON and compressed again for
+every pull.
+
+Entries are keyed by tuples starting with the file ID and the content hash of
+the cached contents, so an entry never outlives the contents it was made from,
+even if they are pushed by another worker process. Contents read while being
+replaced may not match the hash read just before, so they are hashed before
+being cached. Pushing and deleting a file drop its entries right away, so that
+they do not take up the budget.
+
+The number of hits and misses, the hit rate, the bytes held and the number of
+evictions and invalidations are exposed in the 'content' statistics.
+"""
+import hashlib
+import threading
+
+from common import stats
+from server import config
+
+_stats = stats.counters('content')
+# Hits between publishing the statistics, which are counted without a lock
+_PUBLISH_HITS = 64
+
+
+class ContentCache:
+    """Cache of values holding at most a budget of bytes with CLOCK eviction.
+
+    Lookups take no lock, they only mark the entry as referenced. Adding an
+    entry evicts the entries the hand of the clock finds unreferenced, clearing
+    the mark of the referenced ones it passes, which approximates evicting the
+    least recently used entries.
+
+    Args:
+        budget: the maximum total size of the values in bytes, 0 disables the
+            cache.
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self._lock = threading.Lock()
+        # Key -> [value, size, referenced]
+        self._entries = dict()
+        # Keys of every file ID
+        self._files = dict()
+        # Keys in the order the hand passes them, possibly no longer cached
+        self._ring = list()
+        self._hand = 0
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        """Returns the cached value of a key or None."""
+        if not self.budget:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            self._publish()
+            return None
+        entry[2] = True
+        self._hits += 1
+        if self._hits % _PUBLISH_HITS == 0:
+            self._publish()
+        return entry[0]
+
+    def put(self, key, value, size, source):
+        """Cache the value of a key, unless larger than a quarter of the budget.
+
+        Args:
+            key: tuple starting with the file ID and the content hash.
+            value: the cached value.
+            size: the size of the value in bytes.
+            source: the contents the value has been made from as bytes, which
+                are not cached unless they match the content hash.
+        """
+        if not self.budget or size > self.budget // 4:
+            return
+        if hashlib.sha1(source).hexdigest() != key[1]:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            while self._bytes + size > self.budget:
+                self._evict()
+            # Referenced, so that it survives the next pass of the hand
+            self._entries[key] = [value, size, True]
+            self._files.setdefault(key[0], set()).add(key)
+            self._ring.append(key)
+            self._bytes += size
+            self._publish()
+
+    def _evict(self):
+        """Evict the next unreferenced entry, must hold the lock."""
+        while True:
+            if self._hand >= len(self._ring):
+                self._hand = 0
+            key = self._ring[self._hand]
+            entry = self._entries.get(key)
+            if entry is not None and entry[2]:
+                entry[2] = False
+                self._hand += 1
+                continue
+            # Moving the last key into the slot keeps the ring dense
+            self._ring[self._hand] = self._ring[-1]
+            self._ring.pop()
+            if entry is not None:
+                self._drop(key)
+                self._evictions += 1
+                return
+
+    def _drop(self, key):
+        """Remove an entry, must hold the lock."""
+        self._bytes -= self._entries.pop(key)[1]
+        keys = self._files[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._files[key[0]]
+
+    def invalidate(self, fileID):
+        """Drop the entries of a file."""
+        if not self.budget:
+            return
+        with self._lock:
+            for key in list(self._files.get(fileID, ())):
+                self._drop(key)
+                self._invalidations += 1
+            # Forget the keys left in the ring once they outnumber the entries
+            if len(self._ring) > 2 * len(self._entries) + 64:
+                self._ring = list(
+                    dict.fromkeys(
+                        key for key in self._ring if key in self._entries))
+                self._hand = 0
+            self._publish()
+
+    def _publish(self):
+        lookups = self._hits + self._misses
+        _stats.set(
+            'cache',
+            hits=self._hits,
+            misses=self._misses,
+            hitRate=self._hits / lookups if lookups else 0,
+            bytes=self._bytes,
+            entries=len(self._entries),
+            evictions=self._evictions,
+            invalidations=self._invalidations,
+        )
+
+
+cache = ContentCache(config.CONTENT_CACHE_SIZE)
@@ -1,44 +1,153 @@
 """Database manager module.
 
-Processes request to read/write the database and/or the user files. Raises
-DatabaseException if things go wrong.
+Processes request to read/write the database and/or the user files, see
+store.Store. Raises DatabaseException if things go wrong.
 """
+import contextlib
+import functools
 import sqlite3
 import time
 import os
 import hashlib
 import sys
+import tempfile
+import threading
+import zlib
 from logging import error, info
+from common import delta
+from server import access
+from server import blobs
 from server import config
+from server import contentcache
+from server import dbpool
+from server import durability
+from server import layout
+from server import lineindex
+from server import migrations
+from server import store
+from server.store import ConflictException
+from server.store import DatabaseException
 
-# Initial database schema
 try:
-    with sqlite3.connect(config.DATABASE) as con:
-        con.execute(
-            '''
-            CREATE TABLE IF NOT EXISTS Files (
-                id TEXT,
-                name TEXT,
-                owner TEXT,
-                created TEXT,
-                last_edited TEXT,
-                last_edited_user TEXT
-            );
-            ''')
-        con.execute(
-            '''
-            CREATE TABLE IF NOT EXISTS Users (
-                username TEXT,
-                password TEXT
-            );
-            ''')
-        con.execute(
-            '''
-            CREATE TABLE IF NOT EXISTS Shares (
-                user TEXT,
-                file TEXT
-            );
-            ''')
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _replaceFile(sourcePath, indexPath, path):
+    """Move new contents, and their line index if any, into place."""
+    os.replace(sourcePath, path)
+    durability.syncDirectory(path)
+    if indexPath is None:
+        lineindex.remove(path)
+    else:
+        os.replace(indexPath, lineindex.indexPath(path))
+
+
+def _chain(first, second):
+    """Returns a callable calling first, unless None, and then second."""
+    def chained():
+        if first is not None:
+            first()
+        second()
+
+    return chained
+
+
+def _guarded(apply, failed):
+    """Returns a callable calling apply, passing its exception to failed."""
+    def guarded():
+        try:
+            apply()
+        except Exception as ex:    # pylint: disable=broad-except
+            failed(ex)
+
+    return guarded
+
+
+def _createFile(fileID):
+    """Create an empty stored file."""
+    path = layout.prepare(fileID)
+    open(path, 'w').close()
+    durability.syncDirectory(path)
+
+
+def _removeFile(path):
+    """Remove a stored file along with its line index."""
+    os.remove(path)
+    lineindex.remove(path)
+
+
+def hashFile(path):
+    """Hash the contents of a stored file, see delta.contentHash."""
+    with open(path, 'rb') as fHashed:
+        return _hashOpened(fHashed)
+
+
+def _hashOpened(fOpened):
+    """Hash the contents of an opened file from its current position."""
+    fileHash = hashlib.sha1()
+    for chunk in iter(functools.partial(fOpened.read, 1 << 16), b''):
+        fileHash.update(chunk)
+    return fileHash.hexdigest()
+
+
+def _finishReplacements(con):
+    """Move pushed contents whose commit survived a crash into place.
+
+    Contents stored by file ID are renamed into place only after their hash is
+    commited, see _recordContents, so a crash in between leaves the database
+    pointing at contents still held by a temporary file in the storage
+    directory. Such files are found by their hash and renamed into place, so
+    that layout.removeStale does not remove them. Run on startup.
+
+    Args:
+        con: connection to the database.
+
+    Returns:
+        The number of files moved into place.
+    """
+    recovered = 0
+    with os.scandir(config.STORAGE) as entries:
+        temporary = [
+            entry.path for entry in entries
+            if entry.name.endswith('.tmp') and entry.is_file()
+        ]
+    for sourcePath in temporary:
+        try:
+            fileHash = hashFile(sourcePath)
+        except OSError:
+            continue
+        for fileID, in con.execute(
+                'SELECT id FROM Files WHERE hash=? AND blob IS NULL;',
+            (fileHash, )).fetchall():
+            path = layout.locate(fileID)
+            if os.path.exists(path) and hashFile(path) == fileHash:
+                continue
+            indexPath = lineindex.indexPath(sourcePath)
+            durability.syncFile(sourcePath)
+            _replaceFile(
+                sourcePath,
+                indexPath if os.path.exists(indexPath) else None,
+                layout.prepare(fileID),
+            )
+            recovered += 1
+            break
+    return recovered
+
+
+# Create or upgrade the database schema and clean up the storage, once for all
+# worker processes
+try:
+    # Closed right away, connections must not be inherited by worker processes
+    with contextlib.closing(sqlite3.connect(config.DATABASE)) as con:
+        migrations.migrate(con)
+        # Persistent, readers and the writer no longer block each other
+        con.execute('PRAGMA journal_mode=WAL;')
+        _recovered = _finishReplacements(con)
+        # Blobs are only deleted holding the write lock, see blobs
+        con.execute('BEGIN IMMEDIATE;')
+        _removed = blobs.clean(con)
         con.commit()
 except (sqlite3.DatabaseError, sqlite3.OperationalError) as ex:
     error(f'Fatal error creating database at {config.DATABASE}: {ex}')
@@ -46,23 +155,251 @@ except (sqlite3.DatabaseError, sqlite3.OperationalError) as ex:
 else:
     info(f'Initialized database at {config.DATABASE}')
     info(f'File storage is at {config.STORAGE}')
+    if _recovered:
+        info(f'Moved {_recovered} pushed files into place after a crash')
+    _removed += layout.removeStale()
+    if _removed:
+        info(f'Removed {_removed} stale temporary and blob files')
+
+
+_local = threading.local()
+# Striped locks keeping pulls from opening a stored file between the commit of
+# its new contents and their move into place
+_fileLocks = [threading.Lock() for _ in range(64)]
+# File whose bytes extend the striped locks to other worker processes
+_lockFile = None
+_lockFileOpening = threading.Lock()
 
 
-class DatabaseException(Exception):
-    """Database exception class."""
+def _stripe(fileID):
+    """Returns the number of the striped lock of a file."""
+    return zlib.crc32(fileID.encode('utf-8')) % len(_fileLocks)
 
 
-class DatabaseManager:
+@contextlib.contextmanager
+def _holdStripes(stripes, exclusive):
+    """Hold the striped locks of given numbers in all server processes.
+
+    Pulls hold the stripe of a file, shared with other processes, only while
+    reading its hash and opening it. The writer holds the stripes of the
+    changed files exclusively only while commiting and moving the contents into
+    place. Neither waits for anything else while holding them.
+    """
+    global _lockFile    # pylint: disable=global-statement
+    stripes = sorted(stripes)
+    with contextlib.ExitStack() as stack:
+        for stripe in stripes:
+            stack.enter_context(_fileLocks[stripe])
+        if config.WORKERS == 1 or fcntl is None or not stripes:
+            yield
+            return
+        with _lockFileOpening:
+            if _lockFile is None:
+                # Opened after the fork, record locks belong to the process
+                _lockFile = open(config.STORAGE + os.sep + '.locks', 'a+b')
+        for stripe in stripes:
+            fcntl.lockf(
+                _lockFile,
+                fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH,
+                1,
+                stripe,
+            )
+            stack.callback(fcntl.lockf, _lockFile, fcntl.LOCK_UN, 1, stripe)
+        yield
+
+
+def threadManager():
+    """Returns the DatabaseManager of the calling thread, creating it if needed.
+
+    Managers hold a connection of the pool while reading, so worker threads
+    shared by many sessions keep one manager each.
+    """
+    if not hasattr(_local, 'manager'):
+        _local.manager = DatabaseManager()
+    return _local.manager
+
+
+def _reads(method):
+    """Run the decorated method on a connection of the read pool.
+
+    The connection the manager already holds, if any, is used instead.
+    """
+    @functools.wraps(method)
+    def reading(self, *args, **kwargs):
+        if self.dbConnection is not None:
+            return method(self, *args, **kwargs)
+        with dbpool.readers.checkout() as con:
+            self.dbConnection = con
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.dbConnection = None
+
+    return reading
+
+
+def _writes(method):
+    """Run the decorated method on the writer thread, see dbpool.Writer."""
+    @functools.wraps(method)
+    def writing(self, *args, **kwargs):
+        if self._writer:
+            return method(self, *args, **kwargs)
+        return _writer.run(lambda writer: method(writer, *args, **kwargs))
+
+    return writing
+
+
+class DatabaseManager(store.Store):
     """Database manager class.
 
-    Wraps an sqlite connection to provide database access to TCPHandler.
+    Store keeping users, files and shares in the sqlite database and the
+    contents of the files in the storage directory, see store.Store. Reads are
+    made on connections of the read pool and modifications are handed over to
+    the writer thread, see dbpool.
+
+    Args:
+        connection: the writer connection, given only on the writer thread.
     """
-    def __init__(self):
-        self.dbConnection = sqlite3.connect(config.DATABASE)
+    def __init__(self, connection=None):
+        self.dbConnection = connection
+        self._writer = connection is not None
+        # File operations deferred until the end of the current transaction
+        self._pending = None
+        # Stripes of the files whose contents the transaction changes
+        self._changed = None
+        # Paths of contents pushed in the transaction, not in place yet
+        self._staged = None
+
+    def write(self, function):
+        """Run a function on the writer thread and wait for its result.
+
+        Used to make several modifications in one transaction, which is only
+        possible on the writer thread.
+
+        Args:
+            function: callable taking the DatabaseManager of the writer.
+
+        Returns:
+            The result of the function.
+        """
+        if self._writer:
+            return function(self)
+        return _writer.run(function)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Group all modifications made within the block in one transaction.
+
+        The transaction is commited once at the end of the block or rolled
+        back if the block raises. Changes to the stored files are applied only
+        after the commit, so they are discarded along with the rollback.
+
+        Must be used on the writer thread, see write. Nested in another
+        transaction, for example of a group commit (see dbpool), the block
+        only gets a savepoint.
+        """
+        if self._pending is not None:
+            with self.savepoint():
+                yield
+            return
+        if self.dbConnection.in_transaction:
+            self.dbConnection.commit()
+        # Takes the write lock right away, a read transaction can not be
+        # upgraded once another worker process has commited
+        self.dbConnection.execute('BEGIN IMMEDIATE')
+        self._pending = list()
+        self._changed = set()
+        self._staged = dict()
+        try:
+            yield
+        except BaseException:
+            self.dbConnection.rollback()
+            pending, self._pending = self._pending, None
+            self._changed = self._staged = None
+            for _, discard in pending:
+                discard()
+            raise
+        with _holdStripes(self._changed, exclusive=True):
+            self.dbConnection.commit()
+            pending, self._pending = self._pending, None
+            self._changed = self._staged = None
+            for apply, _ in pending:
+                apply()
 
-    def __del__(self):
-        self.dbConnection.close()
+    @contextlib.contextmanager
+    def savepoint(self, applyFailed=None):
+        """Undo the modifications made within the block if it raises.
 
+        Must be used inside of a transaction block, which is not affected.
+
+        Args:
+            applyFailed: if given, the changes to the stored files made within
+                the block are applied on their own after the commit, and an
+                exception raised by them is passed to this callable instead
+                of failing the rest of the transaction, see dbpool.Writer.
+        """
+        mark = len(self._pending)
+        self.dbConnection.execute('SAVEPOINT item')
+        try:
+            yield
+        except BaseException:
+            self.dbConnection.execute('ROLLBACK TO item')
+            self.dbConnection.execute('RELEASE item')
+            for _, discard in self._pending[mark:]:
+                discard()
+            del self._pending[mark:]
+            raise
+        self.dbConnection.execute('RELEASE item')
+        if applyFailed is not None:
+            self._pending[mark:] = [
+                (_guarded(apply, applyFailed), discard)
+                for apply, discard in self._pending[mark:]
+            ]
+
+    def _commit(self,
+                apply=None,
+                discard=None,
+                accessChange=None,
+                contentChange=None):
+        """Commit the modifications, unless inside of a transaction block.
+
+        Args:
+            apply: callable applying changes to the stored files, run after
+                the commit.
+            discard: callable cleaning up after `apply` if it will never run.
+            accessChange: (file ID, user) pair if the modifications change
+                the access of the user, None for all users, to the file. The
+                change is recorded and the cached access dropped after the
+                commit, see access.
+            contentChange: ID of the file if the modifications change its
+                contents, which are then dropped from the content cache after
+                `apply`, see contentcache. The file is not opened by pulls
+                from the commit until after `apply`, see openFile.
+        """
+        stripes = set()
+        if contentChange is not None:
+            stripes.add(_stripe(contentChange))
+            apply = _chain(
+                apply,
+                functools.partial(contentcache.cache.invalidate, contentChange),
+            )
+        if accessChange is not None:
+            access.recordChange(self.dbConnection, *accessChange)
+            apply = _chain(
+                apply,
+                functools.partial(access.cache.invalidate, *accessChange),
+            )
+        if self._pending is not None:
+            self._changed |= stripes
+            if apply is not None:
+                self._pending.append((apply, discard or (lambda: None)))
+            return
+        with _holdStripes(stripes, exclusive=True):
+            self.dbConnection.commit()
+            if apply is not None:
+                apply()
+
+    @_reads
     def authenticate(self, user, passwd):
         """Authenticate the user.
 
@@ -81,6 +418,7 @@ class DatabaseManager:
         ).fetchone():
             raise DatabaseException('Invalid username or password')
 
+    @_reads
     def listFiles(self, username):
         """List files available for a given user.
 
@@ -90,59 +428,83 @@ class DatabaseManager:
         Returns:
             Dictionary of (file ID, (info)) pairs, where the ID is the unique
             ID assigned to every file and info is a dicitonary that contains
-            information about the owner, file name, last edited date and last
-            edited user.
+            information about the owner, file name, last edited date, last
+            edited user and the content hash (None if not known yet).
         Raises:
             DatabaseException if the user does not exist.
         """
         fileList = dict()
-        owned = self.dbConnection.execute(
+        # Owned files, then files shared to the user
+        rows = self.dbConnection.execute(
             '''
-            SELECT * FROM Files WHERE owner=?;
+            SELECT id, name, owner, created, last_edited, last_edited_user,
+            hash, 1 FROM Files WHERE owner=?
+            UNION ALL
+            SELECT id, name, owner, created, last_edited, last_edited_user,
+            hash, 0 FROM Shares
+            JOIN Files ON Files.id=Shares.file
+            WHERE Shares.user=?;
             ''',
-            (username, ),
-        ).fetchall()
-
-        sharedIDs = [
-            fileID[0] for fileID in self.dbConnection.execute(
-                '''
-            SELECT file FROM Shares WHERE user=?;
-            ''',
-                (username, ),
-            )
-        ]
-        borrowed = [
-            self.dbConnection.execute(
-                '''
-                SELECT * FROM Files WHERE id=?;
-                ''',
-                (fileID, ),
-            ).fetchone() for fileID in sharedIDs
-        ]
-        for row in owned:
-            fileList[row[0]] = dict()
-            fileList[row[0]]['name'] = row[1]
-            fileList[row[0]]['owner'] = row[2]
-            fileList[row[0]]['created'] = row[3]
-            fileList[row[0]]['last_edited'] = row[4]
-            fileList[row[0]]['last_edited_user'] = row[5]
-            fileList[row[0]]['shares'] = [
-                user[0] for user in self.dbConnection.execute(
-                    '''
-                SELECT user FROM Shares WHERE file=?;
-                ''',
-                    (row[0], ),
-                ).fetchall()
-            ]
-        for row in borrowed:
+            (username, username),
+        )
+        for row in rows:
             fileList[row[0]] = dict()
             fileList[row[0]]['name'] = row[1]
             fileList[row[0]]['owner'] = row[2]
             fileList[row[0]]['created'] = row[3]
             fileList[row[0]]['last_edited'] = row[4]
             fileList[row[0]]['last_edited_user'] = row[5]
+            fileList[row[0]]['hash'] = row[6]
+            if row[7]:
+                fileList[row[0]]['shares'] = list()
+        # Users the owned files are shared to
+        for fileID, user in self.dbConnection.execute(
+                '''
+            SELECT Shares.file, Shares.user FROM Files
+            JOIN Shares ON Shares.file=Files.id
+            WHERE Files.owner=?;
+            ''',
+            (username, ),
+        ):
+            fileList[fileID]['shares'].append(user)
         return fileList
 
+    def _hasAccess(self, username, fileID):
+        """Check if the user owns the file or has it shared.
+
+        The answer is cached, except on the writer, which also sees its own
+        modifications not commited yet, see access.
+        """
+        if self._writer:
+            return self._queryAccess(username, fileID)
+        if config.WORKERS > 1:
+            self._syncAccess()
+        allowed, generation = access.cache.get(username, fileID)
+        if allowed is None:
+            allowed = self._queryAccess(username, fileID)
+            access.cache.put(username, fileID, allowed, generation)
+        return allowed
+
+    @_reads
+    def _syncAccess(self):
+        """Drop cached access changed by other worker processes."""
+        access.cache.sync(self.dbConnection)
+
+    @_reads
+    def _queryAccess(self, username, fileID):
+        return bool(
+            self.dbConnection.execute(
+                '''
+            SELECT 1 FROM Files WHERE id=? AND owner=?;
+            ''',
+                (fileID, username),
+            ).fetchone() or self.dbConnection.execute(
+                '''
+            SELECT 1 FROM Shares WHERE file=? AND user=?;
+            ''',
+                (fileID, username),
+            ).fetchone())
+
     def pullFile(self, username, fileID):
         """Pull file contents from the server.
 
@@ -156,22 +518,146 @@ class DatabaseManager:
         Raises:
             DatabaseException if user has no access to specified file.
         """
-        if self.dbConnection.execute(
-                '''
-            SELECT 1 FROM Files WHERE id=? AND owner=?;
-            ''',
-            (fileID, username),
-        ).fetchone() or self.dbConnection.execute(
+        fContents, _ = self.openFile(username, fileID)
+        with fContents:
+            return str(fContents.read(), 'utf-8')
+
+    def openFile(self, username, fileID):
+        """Open the stored contents of a file along with their hash.
+
+        The hash is read together with opening the file, so it always matches
+        the opened contents, even if the file is pushed in the meantime.
+
+        Args:
+            username: the user requesting the file contents.
+            fileID: ID of the file to be pulled.
+
+        Returns:
+            Tuple of the contents opened as a binary file, to be closed by the
+            caller, and their hash, see delta.contentHash.
+
+        Raises:
+            DatabaseException if user has no access to specified file.
+        """
+        if not self._hasAccess(username, fileID):
+            raise DatabaseException(
+                f'User {username} has no access to file {fileID}')
+        fContents, fileHash = self._openStored(fileID)
+        if fileHash is None:
+            # Stored before content hashes were introduced
+            try:
+                fileHash = _hashOpened(fContents)
+                fContents.seek(0)
+                self._storeHash(fileID, fileHash)
+            except BaseException:
+                fContents.close()
+                raise
+        return fContents, fileHash
+
+    @_reads
+    def _openStored(self, fileID):
+        """Open the stored contents of a file and read their hash, which is
+        None if not known yet."""
+        with _holdStripes((_stripe(fileID), ), exclusive=False):
+            row = self.dbConnection.execute(
                 '''
-                SELECT 1 FROM Shares WHERE file=? AND user=?;
+                SELECT blob, hash FROM Files WHERE id=?;
                 ''',
-            (fileID, username),
-        ).fetchone():
-            with open(config.STORAGE + os.sep + fileID) as fRequested:
-                return fRequested.read()
-        raise DatabaseException(
-            f'User {username} has no access to file {fileID}')
+                (fileID, ),
+            ).fetchone()
+            if row is None:
+                raise DatabaseException(f'File {fileID} does not exist')
+            return open(self._storedPath(fileID, row[0]), 'rb'), row[1]
+
+    def _storedPath(self, fileID, blob):
+        """Returns the path holding the contents of a file.
+
+        Args:
+            fileID: ID of the file.
+            blob: content hash of the blob the file points at or None if
+                stored by its ID, see blobs.
+        """
+        if blob is not None:
+            return blobs.blobPath(blob)
+        if self._staged and fileID in self._staged:
+            # Pushed earlier in the current transaction
+            return self._staged[fileID]
+        return layout.locate(fileID)
+
+    def locateRange(self, fContents, byteRange=None, lineRange=None):
+        """Locate a range of contents opened with openFile.
+
+        Byte ranges are widened so that they do not split UTF-8 characters.
+
+        Args:
+            fContents: the contents opened by openFile.
+            byteRange: [start, end) byte offsets or None.
+            lineRange: [first, last) 0-based line numbers, used if byteRange
+                is None.
+
+        Returns:
+            Tuple of the start and end byte offsets of the range and the size
+            of the whole file.
+
+        Raises:
+            DatabaseException if the range is malformed.
+        """
+        first, last = store.checkRange(byteRange, lineRange)
+        size = os.fstat(fContents.fileno()).st_size
+        if byteRange:
+            start = store.alignUTF8(
+                fContents,
+                min(first, size),
+                size,
+                backward=True,
+            )
+            end = store.alignUTF8(fContents, min(last, size), size)
+        else:
+            start = lineindex.lineOffset(fContents, fContents.name, first)
+            end = lineindex.lineOffset(fContents, fContents.name, last)
+        return start, end, size
+
+    @_reads
+    def fileHash(self, fileID):
+        """Get the hash of the current contents of a file.
+
+        Hashes missing for files stored before content hashes were introduced
+        are computed and saved.
 
+        Args:
+            fileID: ID of the file.
+
+        Returns:
+            The content hash, see delta.contentHash.
+        """
+        row = self.dbConnection.execute(
+            '''
+            SELECT hash FROM Files WHERE id=?;
+            ''',
+            (fileID, ),
+        ).fetchone()
+        if row is None:
+            raise DatabaseException(f'File {fileID} does not exist')
+        if row[0] is not None:
+            return row[0]
+        fContents, _ = self._openStored(fileID)
+        with fContents:
+            fileHash = _hashOpened(fContents)
+        self._storeHash(fileID, fileHash)
+        return fileHash
+
+    @_writes
+    def _storeHash(self, fileID, fileHash):
+        """Save a hash computed by fileHash, unless pushed in the meantime."""
+        self.dbConnection.execute(
+            '''
+            UPDATE Files SET hash=? WHERE id=? AND hash IS NULL;
+            ''',
+            (fileHash, fileID),
+        )
+        self._commit()
+
+    @_writes
     def newFile(self, username, fileName):
         """Create new file for specified user.
 
@@ -192,60 +678,227 @@ class DatabaseManager:
                 f'User {username} already has a file named {fileName}')
         fileID = str(time.time()) + username + fileName
         fileID = hashlib.sha1(fileID.encode('utf-8')).hexdigest()
-        self.dbConnection.execute(
-            '''
-            INSERT INTO Files
-            (id, name, owner, created, last_edited, last_edited_user)
-            VALUES (?,?,?,?,?,?);
-        ''', (
-                fileID,
-                fileName,
-                username,
-                time.strftime(config.DATETIME_FMT),
-                time.strftime(config.DATETIME_FMT),
-                username,
-            ))
-        self.dbConnection.commit()
-        newFile = open(config.STORAGE + os.sep + fileID, 'w')
-        newFile.close()
+        blob = delta.contentHash('') if config.DEDUP else None
+        try:
+            self.dbConnection.execute(
+                '''
+                INSERT INTO Files
+                (id, name, owner, created, last_edited, last_edited_user,
+                hash, blob)
+                VALUES (?,?,?,?,?,?,?,?);
+            ''', (
+                    fileID,
+                    fileName,
+                    username,
+                    time.strftime(config.DATETIME_FMT),
+                    time.strftime(config.DATETIME_FMT),
+                    username,
+                    delta.contentHash(''),
+                    blob,
+                ))
+        except sqlite3.IntegrityError as ex:
+            # Created by another worker process since the check
+            raise DatabaseException(
+                f'User {username} already has a file named {fileName}') from ex
+        if blob is not None:
+            blobs.acquire(self.dbConnection, blob)
+            self._commit(accessChange=(fileID, None))
+            return
+        self._commit(
+            apply=functools.partial(_createFile, fileID),
+            accessChange=(fileID, None),
+            contentChange=fileID,
+        )
 
-    def pushFile(self, username, fileID, contents):
+    def pushFile(self,
+                 username,
+                 fileID,
+                 contents,
+                 sourcePath=None,
+                 baseHash=None):
         """Push file contents to the server.
 
+        The new contents replace the old ones atomically, so a concurrent pull
+        never observes a partially written file. With config.DEDUP, contents
+        which are already stored are not written again, see blobs.
+
         Args:
             username: the user requesting the modification.
             fileID: the file ID to be modified.
             contents: the file contents.
+            sourcePath: path of a file in the storage directory already holding
+                the new contents, used instead of `contents` if given. It is
+                moved into place.
+            baseHash: if given, the contents are only replaced if their hash
+                still matches it when the push is recorded.
 
         Raises:
-            DatabaseException if user has no access to specified file.
+            DatabaseException if user has no access to specified file,
+            ConflictException if the contents no longer match the base hash.
         """
-        # Check if the user owns the file
-        if self.dbConnection.execute(
-                '''
-            SELECT 1 FROM Files WHERE id=? AND owner=?;
+        if not self._hasAccess(username, fileID):
+            raise DatabaseException(
+                f'User {username} has no access to file {fileID}')
+        if sourcePath is not None:
+            fileHash = hashFile(sourcePath)
+        else:
+            fileHash = delta.contentHash(contents)
+            if config.DEDUP and blobs.exists(fileHash):
+                # Left to the writer, which writes them if the blob is gone
+                self._storeContents(username, fileID, fileHash, None, None,
+                                    baseHash, contents)
+                return
+            fd, sourcePath = tempfile.mkstemp(
+                dir=config.STORAGE, suffix='.tmp')
+            with open(fd, 'w', encoding='utf-8') as fNew:
+                fNew.write(contents)
+        # Flushed before the commit, see durability
+        durability.syncFile(sourcePath)
+        # Index the lines of large files for ranged pulls
+        indexPath = lineindex.build(sourcePath)
+        self._storeContents(username, fileID, fileHash, sourcePath, indexPath,
+                            baseHash)
+
+    @_writes
+    def _storeContents(self,
+                       username,
+                       fileID,
+                       fileHash,
+                       sourcePath,
+                       indexPath,
+                       baseHash=None,
+                       contents=''):
+        """Record contents prepared by pushFile and move them into place.
+
+        The base hash is compared with the current one in the same write
+        transaction, so no other push is recorded in between, not even by
+        another worker process.
+        """
+        with self.transaction():
+            self._recordContents(username, fileID, fileHash, sourcePath,
+                                 indexPath, baseHash, contents)
+
+    def _recordContents(self, username, fileID, fileHash, sourcePath,
+                        indexPath, baseHash, contents):
+        """Record pushed contents in a transaction, see _storeContents."""
+        row = self.dbConnection.execute(
+            '''
+            SELECT blob, hash FROM Files WHERE id=?;
             ''',
-            (fileID, username),
-        ).fetchone() or self.dbConnection.execute(
-        # Or the file has been shared with him
-                '''
-            SELECT 1 FROM Shares WHERE file=? AND user=?;
+            (fileID, ),
+        ).fetchone()
+        if row is None or (baseHash is not None and baseHash != (
+                row[1] or hashFile(self._storedPath(fileID, row[0])))):
+            if sourcePath is not None:
+                _removeFile(sourcePath)
+            if row is None:
+                raise DatabaseException(f'File {fileID} does not exist')
+            raise ConflictException(
+                f'File {fileID} has changed, pull it again')
+        oldBlob = row[0]
+        blob = fileHash if config.DEDUP else None
+        self.dbConnection.execute(
+            '''
+            UPDATE Files SET last_edited=?, last_edited_user=?, hash=?, blob=?
+            WHERE id=?;
             ''',
-            (fileID, username),
-        ).fetchone():
-            with open(config.STORAGE + os.sep + fileID, 'w') as fRequested:
-                fRequested.write(contents)
-            self.dbConnection.execute(
-                '''
-                UPDATE Files SET last_edited=?, last_edited_user=? WHERE id=?;
-                ''',
-                (time.strftime(config.DATETIME_FMT), username, fileID),
+            (
+                time.strftime(config.DATETIME_FMT),
+                username,
+                fileHash,
+                blob,
+                fileID,
+            ),
+        )
+        if blob is None and oldBlob is None:
+            self._commit(
+                apply=functools.partial(
+                    _replaceFile,
+                    sourcePath,
+                    indexPath,
+                    layout.prepare(fileID),
+                ),
+                discard=_chain(
+                    self._stage(fileID, sourcePath),
+                    functools.partial(_removeFile, sourcePath),
+                ),
+                contentChange=fileID,
             )
-            self.dbConnection.commit()
+            return
+        if blob is None:
+            # Not pulled until the file no longer points at the blob
+            _replaceFile(sourcePath, indexPath, layout.prepare(fileID))
+        elif blob == oldBlob:
+            # Same contents pushed again, only the metadata changes
+            blobs.drop(sourcePath, indexPath)
         else:
-            raise DatabaseException(
-                f'User {username} has no access to file {fileID}')
+            blobs.acquire(
+                self.dbConnection,
+                blob,
+                sourcePath,
+                indexPath,
+                contents,
+            )
+        if oldBlob is not None and oldBlob != blob:
+            blobs.release(self.dbConnection, oldBlob)
+        if oldBlob is None:
+            # Stored by file ID until now
+            self._commit(
+                apply=functools.partial(layout.remove, fileID),
+                contentChange=fileID,
+            )
+        else:
+            self._commit(contentChange=fileID)
+
+    def _stage(self, fileID, sourcePath):
+        """Pull contents pushed in the current transaction from their source
+        until they are moved into place, see _storedPath.
+
+        Returns:
+            Callable undoing the staging if the push is rolled back, or None
+            outside of a transaction.
+        """
+        if self._staged is None:
+            return None
+        previous = self._staged.get(fileID)
+        self._staged[fileID] = sourcePath
+
+        def unstage():
+            if self._staged is None:
+                return
+            if previous is None:
+                del self._staged[fileID]
+            else:
+                self._staged[fileID] = previous
 
+        return unstage
+
+    def pushDelta(self, username, fileID, baseHash, edits):
+        """Push changes of file contents to the server as an edit script.
+
+        Args:
+            username: the user requesting the modification.
+            fileID: the file ID to be modified.
+            baseHash: hash of the contents the edits have been created against.
+            edits: edit script obtained with delta.makeDelta.
+
+        Raises:
+            DatabaseException if user has no access to specified file or the
+            edit script does not fit the contents, ConflictException if they
+            no longer match the base hash.
+        """
+        base = self.pullFile(username, fileID)
+        if delta.contentHash(base) != baseHash:
+            raise ConflictException(
+                f'File {fileID} has changed, pull it again')
+        try:
+            contents = delta.applyDelta(base, edits)
+        except (ValueError, TypeError) as ex:
+            raise DatabaseException(f'Invalid edits: {ex}') from ex
+        # Refused if another push is recorded after the base has been read
+        self.pushFile(username, fileID, contents, baseHash=baseHash)
+
+    @_writes
     def deleteFile(self, username, fileID):
         """Delete the specified file.
 
@@ -265,12 +918,13 @@ class DatabaseManager:
             DatabaseException if user has no acces to specified file.
         """
         # Check if the user owns the file -> delete it and all the shares
-        if self.dbConnection.execute(
-                '''
-            SELECT 1 FROM Files WHERE id=? AND owner=?;
+        owned = self.dbConnection.execute(
+            '''
+            SELECT blob FROM Files WHERE id=? AND owner=?;
             ''',
             (fileID, username),
-        ).fetchone():
+        ).fetchone()
+        if owned:
             self.dbConnection.execute(
                 '''
                 DELETE FROM Files WHERE id=?;
@@ -283,8 +937,18 @@ class DatabaseManager:
                 ''',
                 (fileID, ),
             )
-            os.remove(config.STORAGE + os.sep + fileID)
-            self.dbConnection.commit()
+            if owned[0] is not None:
+                blobs.release(self.dbConnection, owned[0])
+                self._commit(
+                    accessChange=(fileID, None),
+                    contentChange=fileID,
+                )
+                return "owned"
+            self._commit(
+                apply=functools.partial(layout.remove, fileID),
+                accessChange=(fileID, None),
+                contentChange=fileID,
+            )
             return "owned"
         # Check if the user has the file shared -> delete the share
         if self.dbConnection.execute(
@@ -299,12 +963,13 @@ class DatabaseManager:
                 ''',
                 (fileID, username),
             )
-            self.dbConnection.commit()
+            self._commit(accessChange=(fileID, username))
             return "shared"
         # The does not own the file and has not shared it
         raise DatabaseException(
             f'User {username} has no access to file {fileID}')
 
+    @_writes
     def newShare(self, fileID, username, userToShare):
         """Creates a new share of given file to specified user.
 
@@ -344,14 +1009,21 @@ class DatabaseManager:
             raise DatabaseException(
                 f'User {userToShare} already has access to file {fileID}')
         # All possible errors handled -> proceed to creating a share
-        self.dbConnection.execute(
-            '''
-            INSERT INTO Shares (file, user) VALUES (?, ?)
-            ''',
-            (fileID, userToShare),
-        )
-        self.dbConnection.commit()
+        try:
+            self.dbConnection.execute(
+                '''
+                INSERT INTO Shares (file, user) VALUES (?, ?)
+                ''',
+                (fileID, userToShare),
+            )
+        except sqlite3.IntegrityError as ex:
+            # Shared by another worker process since the check
+            raise DatabaseException(
+                f'User {userToShare} already has access to file {fileID}'
+            ) from ex
+        self._commit(accessChange=(fileID, userToShare))
 
+    @_writes
     def deleteShare(self, fileID, username, userToUnshare):
         """Deletes a share of given file to specified user.
 
@@ -385,10 +1057,13 @@ class DatabaseManager:
                     ''',
                     (fileID, userToUnshare),
                 )
-                self.dbConnection.commit()
+                self._commit(accessChange=(fileID, userToUnshare))
             else:
                 raise DatabaseException(
                     f'File {fileID} is not shared to {userToUnshare}')
         else:
             raise DatabaseException(
                 f'Can\'t unshare file {fileID} from user {userToUnshare}')
+
+
+_writer = dbpool.Writer(DatabaseManager)
@@ -0,0 +1,243 @@
+"""Database pool module.
+
+Shares the sqlite connections of a server process among the threads processing
+requests. The database is kept in WAL mode, in which reading does not block
+writing and vice versa, so reads are spread over a pool of read-only
+connections. Sqlite allows a single writer at a time anyway, so all
+modifications are made on one connection by a dedicated writer thread, fed by
+a queue, instead of many connections contending for the database lock.
+
+With config.GROUP_COMMIT_WINDOW set, the writer collects the modifications of
+many sessions for up to that many milliseconds, or config.GROUP_COMMIT_SIZE
+of them, and commits them in one transaction, so that concurrent writers share
+the cost of syncing the commit to the disk. Every modification is undone on
+its own if it fails, and all of them are answered only after the commit. The
+changes to the stored files which follow the commit are applied for every
+modification on its own as well, so one failing does not fail the others.
+
+The time spent waiting for a connection of the pool and for the writer is
+exposed in the 'database' statistics.
+"""
+import contextlib
+import functools
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from common import stats
+from server import config
+
+_stats = stats.counters('database')
+
+
+def connect(readOnly=False):
+    """Open a connection to the database with the configured pragmas.
+
+    The connection may be used by any thread, but only by one at a time.
+
+    Args:
+        readOnly: refuse modifications made on the connection.
+    """
+    con = sqlite3.connect(
+        config.DATABASE,
+        timeout=config.DB_BUSY_TIMEOUT / 1000,
+        check_same_thread=False,
+    )
+    con.execute(f'PRAGMA synchronous={config.DB_SYNCHRONOUS};')
+    con.execute(f'PRAGMA cache_size={config.DB_CACHE_SIZE};')
+    con.execute(f'PRAGMA mmap_size={config.DB_MMAP_SIZE};')
+    con.execute(f'PRAGMA busy_timeout={config.DB_BUSY_TIMEOUT};')
+    if readOnly:
+        con.execute('PRAGMA query_only=1;')
+    return con
+
+
+class Pool:
+    """Pool of read-only connections, opened as needed up to a limit.
+
+    Args:
+        size: the maximum number of connections.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = list()
+        self._opened = 0
+        self._maxWait = 0
+
+    @contextlib.contextmanager
+    def checkout(self):
+        """Hold a connection of the pool within the block.
+
+        Waits for a connection to be returned if all of them are in use.
+        """
+        queued = time.monotonic()
+        con = None
+        with self._lock:
+            while not self._idle and self._opened >= self.size:
+                self._available.wait()
+            if self._idle:
+                con = self._idle.pop()
+            else:
+                self._opened += 1
+        waited = time.monotonic() - queued
+        if con is None:
+            try:
+                con = connect(readOnly=True)
+            except BaseException:
+                with self._lock:
+                    self._opened -= 1
+                    self._available.notify()
+                raise
+        with self._lock:
+            self._maxWait = max(self._maxWait, waited)
+            _stats.set(
+                'readers',
+                opened=self._opened,
+                maxWaitTime=self._maxWait,
+            )
+        _stats.add('readers', checkouts=1, waitTime=waited)
+        try:
+            yield con
+        finally:
+            if con.in_transaction:
+                con.rollback()
+            with self._lock:
+                self._idle.append(con)
+                self._available.notify()
+
+
+class Writer:
+    """Thread making all modifications of the database on its own connection.
+
+    The thread is started with the first job, so that the writer may be
+    created before the server forks its workers.
+
+    Args:
+        target: callable creating the object the jobs are run with from the
+            writer connection. It provides transaction and savepoint context
+            managers, the latter taking applyFailed, see
+            dbmanager.DatabaseManager.
+    """
+    def __init__(self, target):
+        self._target = target
+        self._lock = threading.Lock()
+        self._jobs = queue.SimpleQueue()
+        self._thread = None
+        self._connection = None
+        self._writer = None
+        self._maxWait = 0
+
+    def run(self, function):
+        """Run a function on the writer thread and wait for its result.
+
+        Args:
+            function: callable taking the target of the writer connection.
+                Called right away if already on the writer thread.
+
+        Returns:
+            The result of the function.
+        """
+        if threading.current_thread() is self._thread:
+            return function(self._writer)
+        with self._lock:
+            if self._thread is None:
+                self._start()
+        future = Future()
+        self._jobs.put((future, function, time.monotonic()))
+        return future.result()
+
+    def _start(self):
+        # Opened here, so that failing to open it is raised to the caller
+        self._connection = connect()
+        self._writer = self._target(self._connection)
+        self._thread = threading.Thread(
+            target=self._work,
+            name='plainsync-writer',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _next(self, timeout=None):
+        """Wait for and remove the next job to run, None on timeout."""
+        try:
+            future, function, queued = self._jobs.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        waited = time.monotonic() - queued
+        self._maxWait = max(self._maxWait, waited)
+        _stats.add('writer', jobs=1, waitTime=waited)
+        _stats.set(
+            'writer',
+            depth=self._jobs.qsize(),
+            maxWaitTime=self._maxWait,
+        )
+        if not future.set_running_or_notify_cancel():
+            return self._next(timeout)
+        return future, function
+
+    def _work(self):
+        while True:
+            job = self._next()
+            if config.GROUP_COMMIT_WINDOW > 0:
+                self._runGroup(job)
+                continue
+            future, function = job
+            try:
+                result = function(self._writer)
+            except BaseException as ex:    # pylint: disable=broad-except
+                # Failed jobs must not leave modifications for the next one
+                if self._connection.in_transaction:
+                    self._connection.rollback()
+                future.set_exception(ex)
+            else:
+                future.set_result(result)
+
+    def _runSaved(self, function, applyFailed):
+        """Run a job in a savepoint, returns its result or exception.
+
+        Args:
+            function: the job.
+            applyFailed: callable taking the exception raised by the changes
+                to the stored files of the job, applied after the commit.
+        """
+        try:
+            with self._writer.savepoint(applyFailed=applyFailed):
+                return function(self._writer)
+        except BaseException as ex:    # pylint: disable=broad-except
+            return ex
+
+    def _runGroup(self, job):
+        """Run the given job and the ones following it in one transaction."""
+        deadline = time.monotonic() + config.GROUP_COMMIT_WINDOW / 1000
+        # [future, result or exception] of every job
+        outcomes = list()
+        try:
+            with self._writer.transaction():
+                while job is not None:
+                    future, function = job
+                    outcome = [future, None]
+                    # Failing to apply a job after the commit fails it alone
+                    outcome[1] = self._runSaved(
+                        function,
+                        functools.partial(outcome.__setitem__, 1),
+                    )
+                    outcomes.append(outcome)
+                    if len(outcomes) >= config.GROUP_COMMIT_SIZE:
+                        break
+                    job = self._next(max(deadline - time.monotonic(), 0))
+        except BaseException as ex:    # pylint: disable=broad-except
+            # The commit failed, so did all of the jobs
+            outcomes = [(future, ex) for future, _ in outcomes]
+        _stats.add('writer', groups=1, groupedJobs=len(outcomes))
+        for future, outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+
+readers = Pool(config.DB_READERS)
@@ -0,0 +1,58 @@
+"""Durability module.
+
+Flushes the stored files to the disk as selected with config.DURABILITY:
+
+- 'none': nothing is flushed, the operating system writes the files back
+  whenever it likes. A crash of the machine may lose or truncate the contents
+  of recent pushes, but never leaves a partially written file in place, as
+  the contents are always written aside and renamed into place.
+- 'fdatasync': the contents of pushed files are flushed before their
+  modification is commited, so the database never records contents which may
+  be lost. The rename into place may still be lost, leaving the previous
+  contents.
+- 'fsync': the contents and metadata of pushed files are flushed before the
+  commit, and the directory holding them is flushed after they are renamed
+  into place, before the push is answered, so answered pushes survive a crash
+  of the machine. The commit itself is only as durable as
+  config.DB_SYNCHRONOUS makes it.
+
+The number of flushes and the time spent in them are exposed in the
+'durability' statistics.
+"""
+import os
+import time
+
+from common import stats
+from server import config
+
+_stats = stats.counters('durability')
+
+
+def syncFile(path):
+    """Flush the contents of a file written aside, before it is commited."""
+    if config.DURABILITY == 'none':
+        return
+    started = time.perf_counter()
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if config.DURABILITY == 'fdatasync' and hasattr(os, 'fdatasync'):
+            os.fdatasync(fd)
+        else:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+    _stats.add('files', syncs=1, syncTime=time.perf_counter() - started)
+
+
+def syncDirectory(path):
+    """Flush the directory holding a file renamed or created in it."""
+    # Directories can not be opened for flushing on Windows
+    if config.DURABILITY != 'fsync' or os.name == 'nt':
+        return
+    started = time.perf_counter()
+    fd = os.open(os.path.dirname(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    _stats.add('directories', syncs=1, syncTime=time.perf_counter() - started)
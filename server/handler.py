@@ -2,19 +2,65 @@
 
 Contains the handler and associated functions.
 """
+import os
+import queue
+import socket
+import struct
+import threading
 import time
 import hashlib
+import functools
 import logging as log
 from socketserver import BaseRequestHandler
 from json import JSONDecodeError
 
 from common import request
 from common import response
+from common import stats
 from common import transfer
 from common.message import MessageType
 
-from server.dbmanager import DatabaseException
-from server import dbmanager
+from server.store import ConflictException
+from server.store import DatabaseException
+from server import admission
+from server import config
+from server import contentcache
+from server import pipeline
+from server import resumption
+from server.scheduler import scheduler
+
+if config.STORE == 'memory':
+    from server.memstore import threadManager
+else:
+    from server.dbmanager import threadManager
+
+# Timeout of a socket which should block for as long as it takes, in seconds
+FOREVER = 365 * 24 * 3600
+
+# Statistics of the open sessions keyed by session ID
+_sessionStats = stats.counters('sessions')
+
+
+def _tcpRTT(sock):
+    """Returns the round trip time of a connection estimated by the kernel.
+
+    Returns:
+        The smoothed round trip time in milliseconds or None if unavailable.
+    """
+    if not hasattr(socket, 'TCP_INFO'):
+        return None
+    try:
+        # Linux struct tcp_info, tcpi_rtt is the 16th u32 after 8 bytes, in us
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 104)
+        return struct.unpack_from('I', info, 68)[0] / 1000
+    except (OSError, struct.error):
+        return None
+
+
+def _removeSpooled(bodyPath):
+    """Remove a spooled body which has not been moved into place."""
+    if bodyPath is not None and os.path.exists(bodyPath):
+        os.remove(bodyPath)
 
 
 class TCPHandler(BaseRequestHandler):
@@ -23,35 +69,125 @@ class TCPHandler(BaseRequestHandler):
 
     This is instantiated once per connection to the server and handles the
     communication with the client.
+
+    Requests are processed on the threads of the scheduler, which only compute
+    the responses. Responses of requests without a requestID are sent by the
+    thread receiving the requests, all others by a sender thread started for
+    the session when first needed, so that slow clients hold up only their own
+    threads.
     """
     def __init__(self, *args, **kwargs):
         self.sessionID = None
         self.username = None
-        self.dataBase = dbmanager.DatabaseManager()
+        self.channel = None
+        self.pipeline = None
+        self._outbox = None
+        self._sender = None
+        self._senderStarting = threading.Lock()
+        self._sendFailed = False
         super().__init__(*args, **kwargs)
 
     def setup(self):
+        self.openChannel()
         # Try to authenticate
         try:
-            data = transfer.recieve(self.request)
+            data = self.channel.recieve()
+        except (
+                ConnectionAbortedError,
+                UnicodeDecodeError,
+                ConnectionResetError,
+                socket.timeout,
+                transfer.FrameTooLarge,
+        ):
+            return
+        self.authenticate(data)
+
+    def openChannel(self):
+        """Open the channel of the connection for the handshake."""
+        # The handshake itself is always framed in legacy mode
+        self.channel = transfer.Channel(
+            self.request,
+            maxFrame=config.MAX_FRAME,
+            spoolDir=config.STORAGE,
+        )
+        self.channel.bodyCache = contentcache.cache
+        # Sending gets a timeout of its own, receiving waits for idle sessions.
+        # Both duplicates share the non-blocking flag of the descriptor, so
+        # neither may block without a timeout while the other one has one.
+        self.channel.sendSock = self.request.dup()
+        self.channel.sendSock.settimeout(config.SEND_TIMEOUT or None)
+        if self.request.gettimeout() is None and config.SEND_TIMEOUT:
+            self.request.settimeout(FOREVER)
+        elif self.request.gettimeout() is not None and not config.SEND_TIMEOUT:
+            self.channel.sendSock.settimeout(FOREVER)
+
+    def authenticate(self, data):
+        """Authenticate the user with the received request and answer it.
+
+        Sets sessionID and username if the session has been opened.
+
+        Args:
+            data: the received AuthRequest, see transfer.Channel.recieve.
+        """
+        protocol = transfer.PROTOCOL_LEGACY
+        codec = None
+        try:
             req = request.AuthRequest.fromJSON(data)
             if req.type != MessageType.AUTH:
                 raise DatabaseException('Authenticate first')
-            # Authenticate
-            user = req.user
-            passwd = req.passwd
-            self.dataBase.authenticate(user, passwd)
-            # Save the username and the session ID hash
-            sessionID = str(time.time()) + user + self.client_address[0]
-            sessionID = hashlib.sha1(sessionID.encode('utf-8'))
-            self.sessionID = sessionID.hexdigest()[:12]
+            if req.resumeToken is not None:
+                # Resume the session as negotiated, without the database
+                session = resumption.resume(req.resumeToken)
+                if session is None:
+                    raise DatabaseException('Invalid or expired session token')
+                user = session['user']
+                sessionID = session['sessionID']
+                protocol = session['protocol']
+                codec = session['codec']
+            else:
+                # Authenticate
+                user = req.user
+                passwd = req.passwd
+                # Database connections are only held by the scheduler threads
+                scheduler.run(
+                    lambda: threadManager().authenticate(
+                        user, passwd),
+                    MessageType.AUTH,
+                    user,
+                )
+                # Generate the session ID hash
+                sessionID = str(time.time()) + user + self.client_address[0]
+                sessionID = hashlib.sha1(
+                    sessionID.encode('utf-8')).hexdigest()[:12]
+                protocol = transfer.negotiate(getattr(req, 'protocol', None))
+                codec = transfer.negotiateCodec(
+                    getattr(req, 'codecs', None),
+                    config.COMPRESSION,
+                    protocol,
+                )
+            admission.connections.acquireUser(user)
+            # Save the username and the session ID
+            self.sessionID = sessionID
             self.username = user
+            self.pipeline = pipeline.Pipeline(user, self.deliverPipelined)
             resp = response.AuthResponse(
                 sessionID=self.sessionID,
                 user=user,
+                protocol=protocol,
+                codec=codec,
+                compressThreshold=config.COMPRESS_THRESHOLD,
+                idleTimeout=config.IDLE_TIMEOUT or None,
+                resumeToken=resumption.issue(user, sessionID, protocol, codec),
+                resumed=req.resumeToken is not None or None,
             )
             log.info(
-                'New session %s of user %s', self.sessionID, self.username)
+                '%s session %s of user %s (protocol %s, compression %s)',
+                'Resumed' if resp.resumed else 'New',
+                self.sessionID,
+                self.username,
+                protocol,
+                codec,
+            )
         except (JSONDecodeError, TypeError, AttributeError) as ex:
             resp = response.ErrResponse(err=f'Could not parse request: {ex}')
             log.warning(
@@ -66,109 +202,514 @@ class TCPHandler(BaseRequestHandler):
                 self.client_address[0],
                 resp.description,
             )
-        except (
-                ConnectionAbortedError,
-                UnicodeDecodeError,
-                ConnectionResetError,
-        ):
-            return
-        transfer.send(self.request, resp)
+        except admission.Busy as ex:
+            resp = admission.busyResponse(ex)
+            log.warning(
+                'Refused session of %s: %s',
+                self.client_address[0],
+                resp.description,
+            )
+        # A session the client did not hear of ends as soon as it is handled
+        self.send(resp)
+        self.channel.protocol = protocol
+        self.channel.codec = codec
+        self.channel.compressThreshold = config.COMPRESS_THRESHOLD
+
+    def finish(self):
+        # The socket of an open session is closed along with it
+        if self.sessionID is None and self.channel is not None:
+            self.channel.sendSock.close()
 
     def handle(self):
         if self.sessionID is None:
             return
+        try:
+            while self.handleRequest():
+                pass
+        finally:
+            self.closeSession()
+
+    def handleRequest(self):
+        """Receive a single request and respond to it or schedule it.
+
+        Returns:
+            False if the session should end.
+        """
+        try:
+            data = self.channel.recieve()
+        except (OSError, transfer.FrameTooLarge) as ex:
+            self.logFailedReceive(ex)
+            return False
+        return self.dispatch(data)
+
+    def dispatch(self, data):
+        """Respond to a received request or schedule it.
+
+        Args:
+            data: the received request, see transfer.Channel.recieve.
+
+        Returns:
+            False if the session should end.
+        """
+        try:
+            req = request.Request.fromJSON(data)
+        except (JSONDecodeError, TypeError, AttributeError) as ex:
+            log.error(
+                'Session %s of user %s: Malformed request: %s',
+                self.sessionID,
+                self.username,
+                ex,
+            )
+            _removeSpooled(data.bodyPath)
+            return False
+        if data.bodyError is not None:
+            self.refuse(req, DatabaseException(data.bodyError))
+            return True
+        try:
+            admission.requests.acquire(self.username)
+        except admission.Busy as ex:
+            self.refuse(req, ex)
+            return True
+        if req.requestID is None:
+            resp, proceed = scheduler.run(
+                functools.partial(self.respond, req),
+                req.type,
+                self.username,
+            )
+            return proceed and self.send(resp)
+        # Pipelined requests are answered as soon as they are done
+        self.pipeline.submit(
+            pipeline.requestKey(req),
+            functools.partial(self.respond, req),
+            req.type,
+            fallback=functools.partial(self.fail, req),
+        )
+        return True
+
+    def refuse(self, req, ex):
+        """Answer a request without processing it.
+
+        Args:
+            req: the received request.
+            ex: admission.Busy answered with a busy response, or the
+                DatabaseException answered with an error.
+        """
+        _removeSpooled(getattr(req, 'bodyPath', None))
+        if isinstance(ex, admission.Busy):
+            resp = admission.busyResponse(ex)
+        else:
+            resp = response.ErrResponse(err=f'{ex}')
+        resp.requestID = req.requestID
+        log.warning(
+            'Session %s of user %s: Request:%s Response:%s',
+            self.sessionID,
+            self.username,
+            req,
+            resp,
+        )
+        self.deliver(resp)
+
+    def send(self, resp):
+        """Send a response, or an error if it is too large to be sent.
+
+        Once a response could not be sent in time, the connection is shut down
+        and the responses which follow are dropped.
+
+        Returns:
+            False if the response could not be sent.
+        """
+        if self._sendFailed:
+            return False
+        try:
+            try:
+                self.channel.send(resp)
+            except transfer.FrameTooLarge as ex:
+                err = response.ErrResponse(err=ex)
+                err.requestID = resp.requestID
+                self.channel.send(err)
+        except OSError as ex:
+            self._sendFailed = True
+            log.warning(
+                'Session %s of user %s: Unable to send response: %s',
+                self.sessionID,
+                self.username,
+                ex,
+            )
+            try:
+                self.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def deliver(self, resp, sent=None):
+        """Hand a response over to the sender thread of the session.
+
+        Args:
+            resp: the response.
+            sent: callable called once the response has been sent, if any.
+        """
+        with self._senderStarting:
+            if self._sender is None:
+                self._outbox = queue.SimpleQueue()
+                self._sender = threading.Thread(
+                    target=self._sendDelivered,
+                    name=f'plainsync-sender_{self.sessionID}',
+                    daemon=True,
+                )
+                self._sender.start()
+        self._outbox.put((resp, sent))
+
+    def deliverPipelined(self, result, done):
+        """Deliver the response of a pipelined request, see respond."""
+        self.deliver(result[0], done)
+
+    def _sendDelivered(self):
+        """Send the delivered responses until stopSending."""
         while True:
-            # Handle incoming requests
+            resp, sent = self._outbox.get()
+            if resp is None:
+                return
             try:
-                data = transfer.recieve(self.request)
-                req = request.Request.fromJSON(data)
-                if req.type == MessageType.LIST_FILES:
-                    req = request.FileListRequest.fromJSON(data)
-                    resp = response.FileListResponse(
-                        files=self.dataBase.listFiles(self.username),
-                        user=self.username,
-                    )
-                elif req.type == MessageType.PULL:
-                    req = request.PullRequest.fromJSON(data)
-                    resp = response.PullResponse(
-                        fileID=req.fileID,
-                        content=self.dataBase.pullFile(
-                            self.username,
-                            req.fileID,
-                        ),
-                    )
-                elif req.type == MessageType.PUSH:
-                    req = request.PushRequest.fromJSON(data)
-                    self.dataBase.pushFile(
-                        self.username,
-                        req.fileID,
-                        req.content,
-                    )
-                    resp = response.OkResponse(
-                        action=f'Push file {req.fileID}')
-                elif req.type == MessageType.NEW_FILE:
-                    req = request.NewFileRequest.fromJSON(data)
-                    self.dataBase.newFile(
-                        self.username,
-                        req.fileName,
-                    )
-                    resp = response.OkResponse(
-                        action=f'Create new file {req.fileName}')
-                elif req.type == MessageType.DELETE_FILE:
-                    req = request.DeleteFileRequest.fromJSON(data)
-                    ownedOrShared = self.dataBase.deleteFile(
-                        self.username,
-                        req.fileID,
-                    )
-                    resp = response.OkResponse(
-                        action=f'Delete {ownedOrShared} file { req.fileID }')
-                elif req.type == MessageType.NEW_SHARE:
-                    req = request.NewShareRequest.fromJSON(data)
-                    self.dataBase.newShare(
-                        req.fileID,
-                        self.username,
-                        req.user,
-                    )
-                    resp = response.OkResponse(
-                        action=f'Share file {req.fileID} to {req.user}')
-                elif req.type == MessageType.DELETE_SHARE:
-                    req = request.DeleteShareRequest.fromJSON(data)
-                    self.dataBase.deleteShare(
-                        req.fileID,
-                        self.username,
-                        req.user,
-                    )
-                    resp = response.OkResponse(
-                        action=f'Unshare file {req.fileID} from {req.user}')
-                else:
-                    raise DatabaseException(f'Unknown action: {req.type}')
-            except DatabaseException as ex:
-                resp = response.ErrResponse(err=f'{ex}')
-                log.error(
-                    'Session %s of user %s: Request:%s Response:%s',
+                self.send(resp)
+            except Exception:    # pylint: disable=broad-except
+                log.exception(
+                    'Session %s of user %s: Unable to send response',
                     self.sessionID,
                     self.username,
-                    req,
-                    resp,
                 )
-            except (JSONDecodeError, TypeError, AttributeError) as ex:
-                resp = response.ErrResponse(err=f'Malformed request: {ex}')
-                log.error(
-                    'Session %s of user %s: %s',
-                    self.sessionID,
-                    self.username,
-                    resp.description,
+            finally:
+                if sent is not None:
+                    sent()
+
+    def stopSending(self):
+        """Wait until the delivered responses are sent and stop the sender."""
+        with self._senderStarting:
+            sender, self._sender = self._sender, None
+        if sender is not None:
+            self._outbox.put((None, None))
+            sender.join()
+
+    def logFailedReceive(self, ex):
+        """Log the end of a session whose request could not be received."""
+        if isinstance(ex, transfer.FrameTooLarge):
+            log.error(
+                'Session %s of user %s: %s',
+                self.sessionID,
+                self.username,
+                ex,
+            )
+        elif isinstance(ex, socket.timeout):
+            self.logTimeout()
+
+    def logTimeout(self):
+        """Log the end of a session which has not sent anything in time."""
+        log.info(
+            'Session %s of user %s: timed out',
+            self.sessionID,
+            self.username,
+        )
+
+    def closeSession(self):
+        """Wait for the pipelined requests and close the session."""
+        self.pipeline.join()
+        self.stopSending()
+        self.channel.sendSock.close()
+        admission.connections.releaseUser(self.username)
+        _sessionStats.remove(self.sessionID)
+        log.info('Closed session %s of user %s', self.sessionID, self.username)
+
+    def respond(self, req):
+        """Process a request into its response.
+
+        Runs on the threads of the scheduler, with the store of the
+        calling thread. The response is sent by the caller.
+
+        Args:
+            req: the received request.
+
+        Returns:
+            Tuple of the response and False if the request was malformed and
+            the session should end, True otherwise.
+        """
+        proceed = True
+        try:
+            resp = self.process(req, threadManager())
+        except DatabaseException as ex:
+            resp = response.ErrResponse(
+                err=f'{ex}',
+                conflict=isinstance(ex, ConflictException) or None,
+            )
+            log.error(
+                'Session %s of user %s: Request:%s Response:%s',
+                self.sessionID,
+                self.username,
+                req,
+                resp,
+            )
+        except (JSONDecodeError, TypeError, AttributeError) as ex:
+            resp = response.ErrResponse(err=f'Malformed request: {ex}')
+            log.error(
+                'Session %s of user %s: %s',
+                self.sessionID,
+                self.username,
+                resp.description,
+            )
+            proceed = req.requestID is not None
+        except Exception as ex:    # pylint: disable=broad-except
+            resp = response.ErrResponse(err=f'Internal error: {ex!r}')
+            log.exception(
+                'Session %s of user %s: Request:%s Response:%s',
+                self.sessionID,
+                self.username,
+                req,
+                resp,
+            )
+        else:
+            log.info(
+                'Session %s of user %s: Request:%s Response:%s',
+                self.sessionID,
+                self.username,
+                req,
+                resp,
+            )
+        finally:
+            admission.requests.release(self.username)
+            # Remove a spooled body which has not been moved into place
+            _removeSpooled(getattr(req, 'bodyPath', None))
+        resp.requestID = req.requestID
+        return resp, proceed
+
+    @staticmethod
+    def fail(req, ex):
+        """Answer a pipelined request which could not be processed at all.
+
+        Args:
+            req: the received request.
+            ex: the exception raised instead of responding, see respond.
+
+        Returns:
+            Tuple of the error response and True, like respond.
+        """
+        resp = response.ErrResponse(err=f'Internal error: {ex!r}')
+        resp.requestID = req.requestID
+        return resp, True
+
+    def process(self, req, dataBase, inline=False):
+        """Process a request.
+
+        The request is dispatched to the handler registered for its type in
+        HANDLERS.
+
+        Args:
+            req: the request.
+            dataBase: the store to use, see store.Store.
+            inline: whether pulled contents must be held in the response
+                instead of being sent from the storage file.
+
+        Returns:
+            The response to send.
+
+        Raises:
+            DatabaseException if the request could not be fulfilled.
+        """
+        handler = self.HANDLERS.get(req.type)
+        if handler is None or (inline and req.type == MessageType.BATCH):
+            raise DatabaseException(f'Unknown action: {req.type}')
+        return handler(self, req, dataBase, inline)
+
+    def processListFiles(self, req, dataBase, inline):
+        """Handle a FileListRequest."""
+        # pylint: disable=unused-argument
+        return response.FileListResponse(
+            files=dataBase.listFiles(self.username),
+            user=self.username,
+        )
+
+    def processPull(self, req, dataBase, inline):
+        """Handle a PullRequest."""
+        # Checks the access before revealing anything about the file, the
+        # hash always belongs to the opened contents
+        fContents, fileHash = dataBase.openFile(self.username, req.fileID)
+        try:
+            if req.knownHash is not None and fileHash == req.knownHash:
+                return response.NotModifiedResponse(
+                    fileID=req.fileID,
+                    fileHash=fileHash,
                 )
-                break
-            except (ConnectionAbortedError, ConnectionResetError):
-                break
-            else:
-                log.info(
-                    'Session %s of user %s: Request:%s Response:%s',
-                    self.sessionID,
-                    self.username,
-                    req,
-                    resp,
+            resp = response.PullResponse(fileID=req.fileID, fileHash=fileHash)
+            if req.byteRange is not None or req.lineRange is not None:
+                start, end, resp.size = dataBase.locateRange(
+                    fContents,
+                    byteRange=req.byteRange,
+                    lineRange=req.lineRange,
                 )
-            transfer.send(self.request, resp)
-        log.info('Closed session %s of user %s', self.sessionID, self.username)
+                resp.range = resp.bodyRange = [start, end]
+            if inline:
+                key = (req.fileID, fileHash, 'text')
+                content = None
+                if resp.bodyRange is None:
+                    content = contentcache.cache.get(key)
+                if content is None:
+                    start, end = resp.bodyRange or (0, None)
+                    fContents.seek(start)
+                    data = fContents.read(None if end is None else end - start)
+                    content = str(data, 'utf-8')
+                    if resp.bodyRange is None:
+                        contentcache.cache.put(key, content, len(data), data)
+                resp.content = content
+            else:
+                # The contents are sent straight from the opened file, which
+                # the channel closes
+                resp.bodyFile, fContents = fContents, None
+                if resp.bodyRange is None:
+                    # Their encoded forms are cached by the channel
+                    resp.bodyKey = (req.fileID, fileHash)
+            return resp
+        finally:
+            if fContents is not None:
+                fContents.close()
+
+    def processPush(self, req, dataBase, inline):
+        """Handle a PushRequest."""
+        # pylint: disable=unused-argument
+        if req.edits is not None:
+            dataBase.pushDelta(
+                self.username,
+                req.fileID,
+                req.baseHash,
+                req.edits,
+            )
+        else:
+            dataBase.pushFile(
+                self.username,
+                req.fileID,
+                req.content,
+                sourcePath=req.bodyPath,
+            )
+        return response.OkResponse(action=f'Push file {req.fileID}')
+
+    def processNewFile(self, req, dataBase, inline):
+        """Handle a NewFileRequest."""
+        # pylint: disable=unused-argument
+        dataBase.newFile(
+            self.username,
+            req.fileName,
+        )
+        return response.OkResponse(action=f'Create new file {req.fileName}')
+
+    def processDeleteFile(self, req, dataBase, inline):
+        """Handle a DeleteFileRequest."""
+        # pylint: disable=unused-argument
+        ownedOrShared = dataBase.deleteFile(
+            self.username,
+            req.fileID,
+        )
+        return response.OkResponse(
+            action=f'Delete {ownedOrShared} file { req.fileID }')
+
+    def processNewShare(self, req, dataBase, inline):
+        """Handle a NewShareRequest."""
+        # pylint: disable=unused-argument
+        dataBase.newShare(
+            req.fileID,
+            self.username,
+            req.user,
+        )
+        return response.OkResponse(
+            action=f'Share file {req.fileID} to {req.user}')
+
+    def processDeleteShare(self, req, dataBase, inline):
+        """Handle a DeleteShareRequest."""
+        # pylint: disable=unused-argument
+        dataBase.deleteShare(
+            req.fileID,
+            self.username,
+            req.user,
+        )
+        return response.OkResponse(
+            action=f'Unshare file {req.fileID} from {req.user}')
+
+    def processPing(self, req, dataBase, inline):
+        """Handle a PingRequest, recording the round trip times."""
+        # pylint: disable=unused-argument
+        _sessionStats.set(
+            self.sessionID,
+            user=self.username,
+            rtt=req.rtt,
+            tcpRTT=_tcpRTT(self.request),
+        )
+        _sessionStats.add(self.sessionID, pings=1)
+        return response.PongResponse(resumeToken=resumption.issue(
+            self.username,
+            self.sessionID,
+            self.channel.protocol,
+            self.channel.codec,
+        ))
+
+    def processBatch(self, req, dataBase, inline=False):
+        """Process all requests of a batch within a single transaction.
+
+        Args:
+            req: the BatchRequest.
+            dataBase: the store to use, see store.Store.
+            inline: unused, batches can not be nested.
+
+        Returns:
+            BatchResponse with a response for every request, or ErrResponse if
+            an atomic batch failed.
+
+        Raises:
+            DatabaseException if the batch is too large or malformed.
+        """
+        if len(req.requests) > config.MAX_BATCH:
+            raise DatabaseException(
+                f'Batch of {len(req.requests)} exceeds limit of '
+                f'{config.MAX_BATCH}')
+        # Transactions are only possible on the writer thread
+        return dataBase.write(functools.partial(self._processBatchItems, req))
+
+    def _processBatchItems(self, req, dataBase):
+        """Process the requests of a batch on the writer, see processBatch."""
+        responses = list()
+        try:
+            with dataBase.transaction():
+                for index, item in enumerate(req.requests):
+                    itemReq = request.Request.fromDict(item)
+                    if itemReq.type in (MessageType.AUTH, MessageType.BATCH):
+                        raise DatabaseException(
+                            f'Action not allowed in batch: {itemReq.type}')
+                    try:
+                        with dataBase.savepoint():
+                            itemResp = self.process(
+                                itemReq,
+                                dataBase,
+                                inline=True,
+                            )
+                    except DatabaseException as ex:
+                        if req.atomic:
+                            raise DatabaseException(
+                                f'Batch request {index} failed: {ex}') from ex
+                        itemResp = response.ErrResponse(
+                            err=f'{ex}',
+                            conflict=isinstance(ex, ConflictException) or
+                            None,
+                        )
+                    responses.append(itemResp.toDict())
+        except (KeyError, TypeError, AttributeError) as ex:
+            raise DatabaseException(f'Malformed batch request: {ex}') from ex
+        return response.BatchResponse(responses=responses)
+
+    # Handlers of the request types, called with the handler, the request, the
+    # store and the inline flag (see process)
+    HANDLERS = {
+        MessageType.LIST_FILES: processListFiles,
+        MessageType.PULL: processPull,
+        MessageType.PUSH: processPush,
+        MessageType.NEW_FILE: processNewFile,
+        MessageType.DELETE_FILE: processDeleteFile,
+        MessageType.NEW_SHARE: processNewShare,
+        MessageType.DELETE_SHARE: processDeleteShare,
+        MessageType.BATCH: processBatch,
+        MessageType.PING: processPing,
+    }
@@ -0,0 +1,179 @@
+"""Layout module.
+
+Places the files stored by their ID, see dbmanager, in the storage directory.
+With config.STORAGE_DEPTH above 0 they are fanned out into that many levels of
+directories named by the leading characters of their IDs, WIDTH per level, so
+that with depth 2 the file `abcdef...` is stored as `ab/cd/abcdef...`. Its line
+index is kept next to it, see lineindex. The content addressed blobs have a
+layout of their own, see blobs.
+
+Files stored directly in the storage directory by earlier versions, or with
+depth 0, are found there until they are moved by migrate, which is run by the
+ps_migrate.py tool while the server keeps serving.
+"""
+import collections
+import os
+import time
+from logging import info
+
+from server import config
+from server import durability
+from server import lineindex
+
+# Characters of the file ID naming the directory of every level
+WIDTH = 2
+# Files linked by migrate at once
+MIGRATION_CHUNK = 10000
+
+
+def flatPath(fileID):
+    """Returns the path of a file stored directly in the storage directory."""
+    return config.STORAGE + os.sep + fileID
+
+
+def path(fileID):
+    """Returns the path of a file in the configured layout."""
+    levels = [
+        fileID[WIDTH * level:WIDTH * (level + 1)]
+        for level in range(config.STORAGE_DEPTH)
+    ]
+    return os.sep.join([config.STORAGE, *levels, fileID])
+
+
+def locate(fileID):
+    """Returns the path of a stored file, falling back to the flat layout."""
+    target = path(fileID)
+    if config.STORAGE_DEPTH == 0 or os.path.exists(target):
+        return target
+    flat = flatPath(fileID)
+    return flat if os.path.exists(flat) else target
+
+
+def prepare(fileID):
+    """Returns the path of a file in the configured layout, creating its
+    directory if needed."""
+    target = path(fileID)
+    directory = os.path.dirname(target)
+    if config.STORAGE_DEPTH and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+        # Flush the entries of the new directories in their parents
+        for _ in range(config.STORAGE_DEPTH):
+            durability.syncDirectory(directory)
+            directory = os.path.dirname(directory)
+    return target
+
+
+def remove(fileID):
+    """Remove a stored file and its line index from both layouts, if there.
+
+    The flat copy goes first, so that a concurrent migrate does not link it
+    into the configured layout after that one has been removed.
+    """
+    for candidate in dict.fromkeys((flatPath(fileID), path(fileID))):
+        try:
+            os.remove(candidate)
+        except FileNotFoundError:
+            pass
+        lineindex.remove(candidate)
+
+
+def removeStale():
+    """Remove temporary files left in the storage tree.
+
+    Pushed contents, spooled bodies and line indexes are written to `*.tmp`
+    files before they are moved into place, pushed contents directly in the
+    storage directory along with their line index, line indexes of stored
+    files and blobs next to them. The ones of a server which did not shut down
+    cleanly stay behind. Run on startup, after the pushed contents which have
+    already been commited are moved into place, see dbmanager. Files modified
+    within config.BLOB_GRACE seconds are kept, they may still be written by
+    another server sharing the storage.
+
+    Returns:
+        The number of removed files.
+    """
+    removed = 0
+    cutoff = time.time() - config.BLOB_GRACE
+    suffixes = ('.tmp', lineindex.indexPath('.tmp'))
+    for directory, _, names in os.walk(config.STORAGE):
+        for name in names:
+            if not name.endswith(suffixes):
+                continue
+            stale = os.path.join(directory, name)
+            try:
+                if os.stat(stale).st_mtime < cutoff:
+                    os.remove(stale)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def _link(source, target):
+    """Hard link a file, unless gone or the target exists."""
+    try:
+        os.link(source, target)
+    except (FileNotFoundError, FileExistsError):
+        pass
+
+
+def _unlink(fileIDs):
+    """Remove the flat copies of files linked into the configured layout."""
+    # The links must be on the disk before the old names go
+    if hasattr(os, 'sync'):
+        os.sync()
+    for fileID in fileIDs:
+        flat = flatPath(fileID)
+        try:
+            os.remove(flat)
+        except FileNotFoundError:
+            pass
+        lineindex.remove(flat)
+
+
+def migrate(fileIDs):
+    """Move the given files from the flat layout into the configured one.
+
+    Safe while servers are serving the files, provided they already use the
+    configured layout, falling back to the flat one. Every file is hard linked
+    into place, unless pushed there in the meantime, and its flat name is only
+    removed config.BLOB_GRACE seconds later, so that pulls which located it
+    there just before still find it. Files pushed during the migration are
+    stored in the configured layout by the servers, leaving the flat copy
+    stale, and deleted ones are removed from both layouts.
+
+    Args:
+        fileIDs: iterable of the IDs of the stored files.
+
+    Returns:
+        The number of migrated files.
+    """
+    if config.STORAGE_DEPTH == 0:
+        raise ValueError('The configured layout is flat')
+    migrated = 0
+    # (time after which the flat names may go, file IDs) pairs
+    linked = collections.deque()
+    chunk = list()
+    for fileID in fileIDs:
+        flat = flatPath(fileID)
+        if not os.path.exists(flat):
+            continue
+        target = prepare(fileID)
+        _link(flat, target)
+        _link(lineindex.indexPath(flat), lineindex.indexPath(target))
+        chunk.append(fileID)
+        if len(chunk) >= MIGRATION_CHUNK:
+            linked.append((time.monotonic() + config.BLOB_GRACE, chunk))
+            migrated += len(chunk)
+            info('Linked %s files into the new layout', migrated)
+            chunk = list()
+        while linked and linked[0][0] <= time.monotonic():
+            _unlink(linked.popleft()[1])
+    if chunk:
+        linked.append((time.monotonic() + config.BLOB_GRACE, chunk))
+        migrated += len(chunk)
+    while linked:
+        deadline, chunk = linked.popleft()
+        time.sleep(max(deadline - time.monotonic(), 0))
+        _unlink(chunk)
+    return migrated
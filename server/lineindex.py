@@ -0,0 +1,119 @@
+"""Line index module.
+
+Keeps sparse indexes of line offsets of large stored files, so that a range of
+lines can be located without scanning the file from the start.
+
+The index of a file is stored next to it with the `.lines` suffix. It holds the
+size and modification time of the indexed file, which are checked before use,
+followed by the byte offset of every STEP-th line.
+"""
+import itertools
+import os
+import tempfile
+from array import array
+
+# Number of lines between indexed offsets
+STEP = 1024
+# Files smaller than this are scanned directly and never indexed
+THRESHOLD = 1 << 20
+# Size of the chunks in which files are scanned
+CHUNK = 1 << 16
+
+
+def indexPath(path):
+    """Returns the path of the index of the file at given path."""
+    return path + '.lines'
+
+
+def build(path):
+    """Build the index of the file at given path, if it is large enough.
+
+    Returns:
+        Path of the written index or None if the file is too small.
+    """
+    fileStat = os.stat(path)
+    if fileStat.st_size < THRESHOLD:
+        return None
+    offsets = array('Q', [fileStat.st_size, fileStat.st_mtime_ns])
+    line = 0
+    position = 0
+    with open(path, 'rb') as fIndexed:
+        for chunk in iter(lambda: fIndexed.read(CHUNK), b''):
+            # Offsets following every newline in the chunk
+            ends = list(
+                itertools.accumulate(
+                    len(part) + 1 for part in chunk.split(b'\n')))[:-1]
+            offsets.extend(
+                position + end
+                for end in ends[STEP - 1 - line % STEP::STEP])
+            line += len(ends)
+            position += len(chunk)
+    fd, tmpPath = tempfile.mkstemp(
+        dir=os.path.dirname(path) or None, suffix='.tmp')
+    with open(fd, 'wb') as fIndex:
+        offsets.tofile(fIndex)
+    os.replace(tmpPath, indexPath(path))
+    return indexPath(path)
+
+
+def remove(path):
+    """Remove the index of the file at given path, if there is one."""
+    try:
+        os.remove(indexPath(path))
+    except FileNotFoundError:
+        pass
+
+
+def _load(path, fileStat):
+    """Load the index of a file if it is up to date with the file."""
+    offsets = array('Q')
+    try:
+        with open(indexPath(path), 'rb') as fIndex:
+            offsets.frombytes(fIndex.read())
+    except (FileNotFoundError, ValueError):
+        return None
+    if offsets[:2] != array('Q', [fileStat.st_size, fileStat.st_mtime_ns]):
+        return None
+    return offsets[2:]
+
+
+def lineOffset(fContent, path, line):
+    """Find the byte offset at which a line starts.
+
+    Args:
+        fContent: the file opened in binary mode.
+        path: the path of the file.
+        line: the 0-based line number.
+
+    Returns:
+        The byte offset of the line or the file size if the file has fewer
+        lines.
+    """
+    fileStat = os.fstat(fContent.fileno())
+    offsets = None
+    if fileStat.st_size >= THRESHOLD:
+        offsets = _load(path, fileStat)
+        if offsets is None and build(path):
+            offsets = _load(path, fileStat)
+    position = 0
+    remaining = line
+    if offsets and line >= STEP:
+        known = min(line // STEP, len(offsets))
+        position = offsets[known - 1]
+        remaining = line - known * STEP
+    fContent.seek(position)
+    while remaining:
+        chunk = fContent.read(CHUNK)
+        if not chunk:
+            return fileStat.st_size
+        newline = -1
+        while remaining:
+            newline = chunk.find(b'\n', newline + 1)
+            if newline == -1:
+                break
+            remaining -= 1
+        if remaining:
+            position += len(chunk)
+        else:
+            position += newline + 1
+    return position
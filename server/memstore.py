@@ -0,0 +1,295 @@
+"""Memory store module.
+
+Store keeping users, files and shares in memory, see store.Store. Everything is
+lost when the server exits, so it is meant for load tests of the protocol layer
+and for ephemeral deployments. The users are given in config.MEMORY_USERS and
+every worker process has a store of its own.
+"""
+import contextlib
+import hashlib
+import io
+import os
+import threading
+import time
+from logging import info
+from common import delta
+from server import config
+from server import layout
+from server import store
+from server.store import ConflictException
+from server.store import DatabaseException
+
+
+def _lineOffset(data, line):
+    """Find the byte offset at which a 0-based line starts, see lineindex."""
+    position = 0
+    for _ in range(line):
+        newline = data.find(b'\n', position)
+        if newline == -1:
+            return len(data)
+        position = newline + 1
+    return position
+
+
+def threadManager():
+    """Returns the store, which is shared by all threads."""
+    return _store
+
+
+class MemoryStore(store.Store):
+    """Store keeping everything in memory.
+
+    Every operation holds a single lock, so the thread holding it is the
+    writer. Modifications made in a transaction are undone by functions
+    recorded along with them. Values of the tables are never modified in
+    place, but replaced, so that they may be restored.
+
+    Args:
+        users: dictionary of the passwords of the users.
+    """
+    def __init__(self, users):
+        self._lock = threading.RLock()
+        self._users = dict(users)
+        self._files = dict()
+        self._contents = dict()
+        # Users every file is shared to
+        self._shares = dict()
+        # Files owned by and shared to every user
+        self._owned = dict()
+        self._shared = dict()
+        # Functions undoing the modifications of the current transaction
+        self._undo = None
+
+    def _set(self, table, key, value):
+        """Set an item of a table, recording how to undo it."""
+        if self._undo is not None:
+            if key in table:
+                old = table[key]
+                self._undo.append(lambda: table.__setitem__(key, old))
+            else:
+                self._undo.append(lambda: table.pop(key))
+        table[key] = value
+
+    def _pop(self, table, key):
+        """Remove an item of a table, recording how to undo it."""
+        value = table.pop(key)
+        if self._undo is not None:
+            self._undo.append(lambda: table.__setitem__(key, value))
+        return value
+
+    def _add(self, table, key, item):
+        """Add an item to a set in a table."""
+        self._set(table, key, table.get(key, frozenset()) | {item})
+
+    def _remove(self, table, key, item):
+        """Remove an item from a set in a table."""
+        self._set(table, key, table.get(key, frozenset()) - {item})
+
+    def _rollback(self, mark):
+        """Undo the modifications recorded after the mark."""
+        while len(self._undo) > mark:
+            self._undo.pop()()
+
+    def write(self, function):
+        with self._lock:
+            return function(self)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._undo is not None:
+                with self.savepoint():
+                    yield
+                return
+            self._undo = list()
+            try:
+                yield
+            except BaseException:
+                self._rollback(0)
+                raise
+            finally:
+                self._undo = None
+
+    @contextlib.contextmanager
+    def savepoint(self):
+        mark = len(self._undo)
+        try:
+            yield
+        except BaseException:
+            self._rollback(mark)
+            raise
+
+    def authenticate(self, user, passwd):
+        if user not in self._users or self._users[user] != passwd:
+            raise DatabaseException('Invalid username or password')
+
+    def listFiles(self, username):
+        fileList = dict()
+        with self._lock:
+            for fileID in self._owned.get(username, ()):
+                fileList[fileID] = dict(self._files[fileID])
+                fileList[fileID]['shares'] = list(
+                    self._shares.get(fileID, ()))
+            for fileID in self._shared.get(username, ()):
+                fileList[fileID] = dict(self._files[fileID])
+        return fileList
+
+    def _hasAccess(self, username, fileID):
+        """Check if the user owns the file or has it shared."""
+        info = self._files.get(fileID)
+        if info is None:
+            return False
+        return (info['owner'] == username
+                or fileID in self._shared.get(username, ()))
+
+    def _checkAccess(self, username, fileID):
+        if not self._hasAccess(username, fileID):
+            raise DatabaseException(
+                f'User {username} has no access to file {fileID}')
+
+    def pullFile(self, username, fileID):
+        with self._lock:
+            self._checkAccess(username, fileID)
+            return str(self._contents[fileID], 'utf-8')
+
+    def openFile(self, username, fileID):
+        with self._lock:
+            self._checkAccess(username, fileID)
+            return (
+                io.BytesIO(self._contents[fileID]),
+                self._files[fileID]['hash'],
+            )
+
+    def locateRange(self, fContents, byteRange=None, lineRange=None):
+        data = fContents.getvalue()
+        first, last = store.checkRange(byteRange, lineRange)
+        size = len(data)
+        if byteRange:
+            start = store.alignUTF8(
+                fContents,
+                min(first, size),
+                size,
+                backward=True,
+            )
+            end = store.alignUTF8(fContents, min(last, size), size)
+        else:
+            start = _lineOffset(data, first)
+            end = _lineOffset(data, last)
+        return start, end, size
+
+    def fileHash(self, fileID):
+        info = self._files.get(fileID)
+        if info is None:
+            raise DatabaseException(f'File {fileID} does not exist')
+        return info['hash']
+
+    def newFile(self, username, fileName):
+        with self._lock:
+            for fileID in self._owned.get(username, ()):
+                if self._files[fileID]['name'] == fileName:
+                    raise DatabaseException(
+                        f'User {username} already has a file named {fileName}'
+                    )
+            fileID = str(time.time()) + username + fileName
+            fileID = hashlib.sha1(fileID.encode('utf-8')).hexdigest()
+            self._set(
+                self._files, fileID, {
+                    'name': fileName,
+                    'owner': username,
+                    'created': time.strftime(config.DATETIME_FMT),
+                    'last_edited': time.strftime(config.DATETIME_FMT),
+                    'last_edited_user': username,
+                    'hash': delta.contentHash(''),
+                })
+            self._set(self._contents, fileID, b'')
+            self._add(self._owned, username, fileID)
+
+    def pushFile(self,
+                 username,
+                 fileID,
+                 contents,
+                 sourcePath=None,
+                 baseHash=None):
+        with self._lock:
+            self._checkAccess(username, fileID)
+            if baseHash is not None and self.fileHash(fileID) != baseHash:
+                if sourcePath is not None:
+                    os.remove(sourcePath)
+                raise ConflictException(
+                    f'File {fileID} has changed, pull it again')
+            if sourcePath is None:
+                data = contents.encode('utf-8')
+            else:
+                with open(sourcePath, 'rb') as fSource:
+                    data = fSource.read()
+                os.remove(sourcePath)
+            info = dict(self._files[fileID])
+            info['last_edited'] = time.strftime(config.DATETIME_FMT)
+            info['last_edited_user'] = username
+            info['hash'] = hashlib.sha1(data).hexdigest()
+            self._set(self._files, fileID, info)
+            self._set(self._contents, fileID, data)
+
+    def pushDelta(self, username, fileID, baseHash, edits):
+        with self._lock:
+            base = self.pullFile(username, fileID)
+            if delta.contentHash(base) != baseHash:
+                raise ConflictException(
+                    f'File {fileID} has changed, pull it again')
+            try:
+                contents = delta.applyDelta(base, edits)
+            except (ValueError, TypeError) as ex:
+                raise DatabaseException(f'Invalid edits: {ex}') from ex
+            self.pushFile(username, fileID, contents, baseHash=baseHash)
+
+    def deleteFile(self, username, fileID):
+        with self._lock:
+            info = self._files.get(fileID)
+            if info is not None and info['owner'] == username:
+                for user in self._shares.get(fileID, ()):
+                    self._remove(self._shared, user, fileID)
+                if fileID in self._shares:
+                    self._pop(self._shares, fileID)
+                self._pop(self._files, fileID)
+                self._pop(self._contents, fileID)
+                self._remove(self._owned, username, fileID)
+                return "owned"
+            if fileID in self._shared.get(username, ()):
+                self._remove(self._shares, fileID, username)
+                self._remove(self._shared, username, fileID)
+                return "shared"
+            raise DatabaseException(
+                f'User {username} has no access to file {fileID}')
+
+    def newShare(self, fileID, username, userToShare):
+        with self._lock:
+            if userToShare == username:
+                raise DatabaseException('Cannot share to yourself')
+            if fileID not in self._owned.get(username, ()):
+                raise DatabaseException(
+                    f'User {username} does not own {fileID}')
+            if userToShare not in self._users:
+                raise DatabaseException(f'User {userToShare} does not exist')
+            if userToShare in self._shares.get(fileID, ()):
+                raise DatabaseException(
+                    f'User {userToShare} already has access to file {fileID}')
+            self._add(self._shares, fileID, userToShare)
+            self._add(self._shared, userToShare, fileID)
+
+    def deleteShare(self, fileID, username, userToUnshare):
+        with self._lock:
+            if (fileID not in self._owned.get(username, ())
+                    and username != userToUnshare):
+                raise DatabaseException(
+                    f'Can\'t unshare file {fileID} from user {userToUnshare}')
+            if userToUnshare not in self._shares.get(fileID, ()):
+                raise DatabaseException(
+                    f'File {fileID} is not shared to {userToUnshare}')
+            self._remove(self._shares, fileID, userToUnshare)
+            self._remove(self._shared, userToUnshare, fileID)
+
+
+# Bodies are still spooled to the storage directory, see layout.removeStale
+if layout.removeStale():
+    info(f'Removed stale temporary files from {config.STORAGE}')
+_store = MemoryStore(config.MEMORY_USERS)
@@ -0,0 +1,182 @@
+"""Migrations module.
+
+Creates the database schema and upgrades databases created by earlier versions
+of the server in place.
+
+The version of the schema is kept in the database as `PRAGMA user_version`,
+the number of migrations applied so far. Every migration is a function of the
+connection, appended to MIGRATIONS, and is never changed once released.
+"""
+import sqlite3
+import time
+from logging import info
+
+
+def _initial(con):
+    """Create the original tables."""
+    con.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS Files (
+            id TEXT,
+            name TEXT,
+            owner TEXT,
+            created TEXT,
+            last_edited TEXT,
+            last_edited_user TEXT,
+            hash TEXT
+        );
+        ''')
+    # Databases created before content hashes lack the column
+    if 'hash' not in [
+            column[1] for column in con.execute('PRAGMA table_info(Files);')
+    ]:
+        con.execute('ALTER TABLE Files ADD COLUMN hash TEXT;')
+    con.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS Users (
+            username TEXT,
+            password TEXT
+        );
+        ''')
+    con.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS Shares (
+            user TEXT,
+            file TEXT
+        );
+        ''')
+
+
+def _rebuild(con, table, schema, columns):
+    """Move the rows of a table into a new one with the given schema.
+
+    Rows violating the keys of the new table are dropped, keeping the oldest
+    ones.
+    """
+    con.execute(f'CREATE TABLE {table}_new ({schema}) WITHOUT ROWID;')
+    before = con.execute(f'SELECT count(*) FROM {table};').fetchone()[0]
+    con.execute(f'''
+        INSERT OR IGNORE INTO {table}_new ({columns})
+        SELECT {columns} FROM {table} ORDER BY rowid;
+        ''')
+    after = con.execute(f'SELECT count(*) FROM {table}_new;').fetchone()[0]
+    con.execute(f'DROP TABLE {table};')
+    con.execute(f'ALTER TABLE {table}_new RENAME TO {table};')
+    if before != after:
+        info('Dropped %s duplicate rows of %s', before - after, table)
+
+
+def _keys(con):
+    """Add primary keys, unique constraints and indexes."""
+    _rebuild(
+        con,
+        'Users',
+        'username TEXT PRIMARY KEY, password TEXT',
+        'username, password',
+    )
+    _rebuild(
+        con,
+        'Files',
+        '''
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        owner TEXT,
+        created TEXT,
+        last_edited TEXT,
+        last_edited_user TEXT,
+        hash TEXT,
+        UNIQUE (owner, name)
+        ''',
+        'id, name, owner, created, last_edited, last_edited_user, hash',
+    )
+    _rebuild(
+        con,
+        'Shares',
+        'user TEXT, file TEXT, PRIMARY KEY (user, file)',
+        'user, file',
+    )
+    # Also holds the users, which are part of the primary key
+    con.execute('CREATE INDEX SharesByFile ON Shares (file);')
+
+
+def _accessChanges(con):
+    """Add the log of changes of access to files."""
+    # Read by the other worker processes to invalidate their access caches
+    con.execute(
+        '''
+        CREATE TABLE AccessChanges (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            file TEXT,
+            user TEXT
+        );
+        ''')
+
+
+def _blobs(con):
+    """Add the content addressed blobs."""
+    # Content hash of the blob holding the contents, NULL if stored by file ID
+    con.execute('ALTER TABLE Files ADD COLUMN blob TEXT;')
+    # Released is the time the last reference was dropped
+    con.execute(
+        '''
+        CREATE TABLE Blobs (
+            hash TEXT PRIMARY KEY,
+            refs INTEGER NOT NULL,
+            released REAL
+        ) WITHOUT ROWID;
+        ''')
+    con.execute(
+        'CREATE INDEX UnreferencedBlobs ON Blobs (released) WHERE refs=0;')
+
+
+MIGRATIONS = (
+    _initial,
+    _keys,
+    _accessChanges,
+    _blobs,
+)
+
+
+def migrate(con):
+    """Upgrade the database to the latest schema version.
+
+    All pending migrations are applied in a single transaction, which also
+    keeps other servers starting at the same time from migrating twice.
+
+    Args:
+        con: sqlite connection to the database.
+
+    Raises:
+        sqlite3.DatabaseError if the migration fails or the database has been
+        created by a newer version of the server.
+    """
+    con.isolation_level = None
+    con.execute('BEGIN IMMEDIATE;')
+    try:
+        version = con.execute('PRAGMA user_version;').fetchone()[0]
+        if version > len(MIGRATIONS):
+            raise sqlite3.DatabaseError(
+                f'Unknown schema version {version}, '
+                f'expected at most {len(MIGRATIONS)}')
+        started = time.perf_counter()
+        for number in range(version, len(MIGRATIONS)):
+            migrationStart = time.perf_counter()
+            MIGRATIONS[number](con)
+            con.execute(f'PRAGMA user_version = {number + 1};')
+            info(
+                'Migrated database to version %s (%s) in %.3f s',
+                number + 1,
+                MIGRATIONS[number].__doc__.rstrip('.'),
+                time.perf_counter() - migrationStart,
+            )
+        con.execute('COMMIT;')
+    except BaseException:
+        con.execute('ROLLBACK;')
+        raise
+    if version < len(MIGRATIONS):
+        info(
+            'Migrated database from version %s to %s in %.3f s',
+            version,
+            len(MIGRATIONS),
+            time.perf_counter() - started,
+        )
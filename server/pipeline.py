@@ -0,0 +1,120 @@
+"""Pipeline module.
+
+Runs pipelined requests of a session concurrently on the scheduler shared by
+the whole server, while keeping the requests concerning the same file in the
+order in which they have been received. The responses are handed over to be
+sent by another thread, so the threads of the scheduler never wait for slow
+clients.
+"""
+import functools
+import threading
+from collections import deque
+from logging import exception
+
+from server import config
+from server.scheduler import scheduler
+
+
+def requestKey(req):
+    """Returns the key of the lane a request must be processed in.
+
+    Requests with the same key are processed one after another, requests
+    without a key (None) may run in any order.
+    """
+    return getattr(req, 'fileID', None) or getattr(req, 'fileName', None)
+
+
+class Pipeline:
+    """Pipeline of requests of a single session.
+
+    Requests are grouped in lanes by key. Only the first request of a lane is
+    queued in the scheduler at a time, the next one once it is done, different
+    lanes run concurrently. A request stays in flight until its response has
+    been delivered, so a client which does not read its responses has at most
+    `depth` of them waiting.
+
+    Args:
+        user: the user of the session, see scheduler.Scheduler.submit.
+        deliver: callable taking the result of a request and a callable to
+            call once the result has been delivered. It must not block.
+
+    Items:
+        depth: the maximum number of requests in flight.
+    """
+    def __init__(self, user=None, deliver=None, depth=None):
+        self.user = user
+        self.deliver = deliver or (lambda result, done: done())
+        self.depth = depth or config.PIPELINE_DEPTH
+        self._slots = threading.BoundedSemaphore(self.depth)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._lanes = dict()
+        self._inFlight = 0
+
+    def submit(self, key, function, msgType=None, fallback=None):
+        """Schedule a function to run in the lane of given key.
+
+        Blocks while `depth` requests are already in flight.
+
+        Args:
+            key: the lane key, see requestKey.
+            function: callable without arguments processing the request.
+            msgType: the MessageType of the request.
+            fallback: callable taking the exception raised by the function
+                and returning the result to deliver instead, so that the
+                client still gets an answer. Nothing is delivered if None.
+        """
+        self._slots.acquire()
+        with self._lock:
+            self._inFlight += 1
+            if key in self._lanes:
+                self._lanes[key].append((function, msgType, fallback))
+            else:
+                if key is not None:
+                    self._lanes[key] = deque()
+                self._schedule(key, function, msgType, fallback)
+
+    def _schedule(self, key, function, msgType, fallback):
+        scheduler.submit(
+            functools.partial(self._run, key, function, fallback),
+            msgType,
+            self.user,
+        )
+
+    def _run(self, key, function, fallback):
+        try:
+            try:
+                result = function()
+            except Exception as ex:    # pylint: disable=broad-except
+                exception('Unhandled error in pipelined request')
+                if fallback is None:
+                    self._done()
+                    return
+                result = fallback(ex)
+        except Exception:    # pylint: disable=broad-except
+            exception('Unable to answer failed pipelined request')
+            self._done()
+        else:
+            self.deliver(result, self._done)
+        finally:
+            with self._lock:
+                if key is not None:
+                    lane = self._lanes[key]
+                    if lane:
+                        self._schedule(key, *lane.popleft())
+                    else:
+                        del self._lanes[key]
+
+    def _done(self):
+        """Free the slot of a request whose result has been delivered."""
+        with self._lock:
+            self._inFlight -= 1
+            if self._inFlight == 0:
+                self._idle.notify_all()
+        self._slots.release()
+
+    def join(self):
+        """Wait until the results of all submitted requests are delivered."""
+        with self._idle:
+            while self._inFlight:
+                self._idle.wait()
@@ -0,0 +1,84 @@
+"""Resumption module.
+
+Issues the tokens with which a client which lost its connection resumes its
+session on a new one, instead of authenticating again.
+
+A token holds the user, the session ID and the negotiated framing of the
+session, signed with config.SESSION_SECRET, and is valid for
+config.SESSION_TTL seconds. The server keeps no state of the tokens, so every
+worker process accepts the tokens issued by the others, and resuming a session
+costs no database query.
+
+The number of issued tokens and of resumed and refused sessions are exposed in
+the 'resumption' statistics.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from common import stats
+from server import config
+
+_stats = stats.counters('resumption')
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload):
+    return hmac.new(
+        config.SESSION_SECRET.encode('utf-8'),
+        payload,
+        hashlib.sha256,
+    ).digest()
+
+
+def issue(user, sessionID, protocol, codec):
+    """Issue a token resuming a session.
+
+    Args:
+        user: the user of the session.
+        sessionID: ID of the session.
+        protocol: the framing protocol version of the session.
+        codec: the compression codec of the session or None.
+
+    Returns:
+        The token as a string.
+    """
+    payload = json.dumps({
+        'user': user,
+        'sessionID': sessionID,
+        'protocol': protocol,
+        'codec': codec,
+        'expires': time.time() + config.SESSION_TTL,
+    }).encode('utf-8')
+    _stats.add('tokens', issued=1)
+    return _encode(payload) + '.' + _encode(_sign(payload))
+
+
+def resume(token):
+    """Verify a token issued with issue.
+
+    Returns:
+        Dictionary of the user, sessionID, protocol and codec of the session,
+        or None if the token is malformed, forged or expired.
+    """
+    try:
+        payload, signature = (_decode(part) for part in token.split('.'))
+        if not hmac.compare_digest(signature, _sign(payload)):
+            raise ValueError('Invalid signature')
+        session = json.loads(payload)
+        if session['expires'] < time.time():
+            raise ValueError('Expired')
+    except (AttributeError, TypeError, ValueError, KeyError):
+        _stats.add('tokens', refused=1)
+        return None
+    _stats.add('tokens', resumed=1)
+    return session
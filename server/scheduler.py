@@ -0,0 +1,159 @@
+"""Scheduler module.
+
+Runs the processing of all requests of all sessions on a bounded pool of worker
+threads, which therefore also bounds the number of concurrent database
+operations.
+
+Requests are queued in priority classes, configured per MessageType in
+config.PRIORITIES. Waiting requests of a class with a lower number always go
+first. Within a class the users are served fairly, in proportion to their
+weights in config.USER_WEIGHTS, so that a single user sending many requests
+does not hold back the others.
+
+The depth of the queue of every class, along with the time requests waited in
+it, is exposed in the 'scheduler' statistics.
+"""
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from common import stats
+from server import config
+
+_stats = stats.counters('scheduler')
+
+
+def priority(msgType):
+    """Returns the priority class of requests of given type.
+
+    Types missing in config.PRIORITIES get the lowest configured priority.
+    """
+    return config.PRIORITIES.get(
+        getattr(msgType, 'value', msgType),
+        max(config.PRIORITIES.values(), default=0),
+    )
+
+
+class _FairQueue:
+    """Queue serving users fairly in proportion to their weights.
+
+    Every item is tagged with the virtual time at which it would finish if
+    each user had a share of the service proportional to its weight, and items
+    are served in the order of their tags (start-time fair queuing with a unit
+    cost per request).
+    """
+    def __init__(self):
+        self._heap = list()
+        self._virtual = 0.0
+        self._finish = dict()
+        self._order = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, user, item):
+        """Queue an item of a user."""
+        weight = config.USER_WEIGHTS.get(user, 1)
+        finish = max(self._virtual, self._finish.get(user, 0.0)) + 1 / weight
+        self._finish[user] = finish
+        heapq.heappush(self._heap, (finish, next(self._order), item))
+
+    def pop(self):
+        """Remove and return the next item to serve."""
+        self._virtual, _, item = heapq.heappop(self._heap)
+        if not self._heap:
+            # Users without queued items start afresh
+            self._finish.clear()
+        return item
+
+
+class Scheduler:
+    """Pool of worker threads serving prioritized, fair queues.
+
+    The threads are started with the first submitted function, so that the
+    scheduler may be created before the server forks its workers.
+
+    Args:
+        threads: the number of worker threads.
+    """
+    def __init__(self, threads):
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._queues = dict()
+        self._maxWait = dict()
+        self._workers = list()
+
+    def submit(self, function, msgType=None, user=None):
+        """Queue a function for the worker threads.
+
+        Args:
+            function: callable without arguments.
+            msgType: the MessageType of the processed request, which
+                determines the priority class.
+            user: the user on whose behalf the function runs.
+
+        Returns:
+            Future of the result of the function.
+        """
+        future = Future()
+        klass = priority(msgType)
+        with self._lock:
+            if not self._workers:
+                self._start()
+            queue = self._queues.get(klass)
+            if queue is None:
+                queue = self._queues[klass] = _FairQueue()
+            queue.push(user, (future, function, time.monotonic()))
+            _stats.set(klass, depth=len(queue))
+            self._ready.notify()
+        return future
+
+    def run(self, function, msgType=None, user=None):
+        """Queue a function and wait for its result, see submit."""
+        return self.submit(function, msgType, user).result()
+
+    def _start(self):
+        for number in range(self.threads):
+            worker = threading.Thread(
+                target=self._work,
+                name=f'plainsync-worker_{number}',
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _next(self):
+        """Wait for and remove the next function to run."""
+        with self._lock:
+            while not any(self._queues.values()):
+                self._ready.wait()
+            klass = min(key for key, queue in self._queues.items() if queue)
+            queue = self._queues[klass]
+            future, function, queued = queue.pop()
+            waited = time.monotonic() - queued
+            self._maxWait[klass] = max(self._maxWait.get(klass, 0), waited)
+            _stats.set(
+                klass,
+                depth=len(queue),
+                maxWaitTime=self._maxWait[klass],
+            )
+        _stats.add(klass, requests=1, waitTime=waited)
+        return future, function
+
+    def _work(self):
+        while True:
+            future, function = self._next()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = function()
+            except BaseException as ex:    # pylint: disable=broad-except
+                future.set_exception(ex)
+            else:
+                future.set_result(result)
+
+
+scheduler = Scheduler(config.WORKER_THREADS)
@@ -0,0 +1,244 @@
+"""Store module.
+
+Defines the interface of the stores of users, files and shares used by
+TCPHandler, implemented by dbmanager.DatabaseManager, which keeps them in an
+sqlite database and the storage directory, and by memstore.MemoryStore, which
+keeps them in memory. The store is selected with config.STORE.
+
+Both modules provide a threadManager function returning the store to be used
+by the calling thread.
+"""
+
+
+class DatabaseException(Exception):
+    """Database exception class.
+
+    Raised by the stores if a request can not be fulfilled.
+    """
+
+
+class ConflictException(DatabaseException):
+    """Conflict exception class.
+
+    Raised by the stores if a push is refused because the contents of the file
+    no longer match its base hash.
+    """
+
+
+def checkRange(byteRange, lineRange):
+    """Validate the range of a ranged pull, see Store.locateRange.
+
+    Returns:
+        The first and last offset or line of the range as integers.
+
+    Raises:
+        DatabaseException if the range is malformed.
+    """
+    try:
+        first, last = byteRange or lineRange
+        # Booleans are integers and floats such as 1e400 do not fit any
+        for value in (first, last):
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise TypeError
+        if not 0 <= first <= last:
+            raise ValueError
+    except (TypeError, ValueError) as ex:
+        raise DatabaseException(
+            f'Invalid range: {byteRange or lineRange}') from ex
+    return first, last
+
+
+def alignUTF8(fOpened, offset, size, backward=False):
+    """Move a byte offset to the start of a UTF-8 character.
+
+    Args:
+        fOpened: the binary file object of the contents.
+        offset: the byte offset, at most `size`.
+        size: the size of the contents.
+        backward: whether to move back to the start of the character the
+            offset is within instead of forward to the next character.
+    """
+    # Skip continuation bytes of the form 0b10xxxxxx
+    if backward:
+        start = max(0, offset - 3)
+        fOpened.seek(start)
+        data = fOpened.read(offset - start + 1)
+        index = offset - start
+        while 0 < index < len(data) and data[index] & 0xC0 == 0x80:
+            index -= 1
+        return start + index
+    fOpened.seek(offset)
+    for byte in fOpened.read(3):
+        if byte & 0xC0 != 0x80:
+            break
+        offset += 1
+    return min(offset, size)
+
+
+class Store:
+    """Interface of the stores.
+
+    Modifications are made on the writer of the store, which runs the
+    functions given to write one at a time.
+    """
+    def write(self, function):
+        """Run a function on the writer and wait for its result.
+
+        Used to make several modifications in one transaction, which is only
+        possible on the writer.
+
+        Args:
+            function: callable taking the store of the writer.
+
+        Returns:
+            The result of the function.
+        """
+        raise NotImplementedError
+
+    def transaction(self):
+        """Context manager grouping all modifications made within the block.
+
+        The modifications are undone if the block raises. Must be used on the
+        writer, see write.
+        """
+        raise NotImplementedError
+
+    def savepoint(self):
+        """Context manager undoing the modifications made within the block if
+        it raises.
+
+        Must be used inside of a transaction block, which is not affected.
+        """
+        raise NotImplementedError
+
+    def authenticate(self, user, passwd):
+        """Authenticate the user.
+
+        Raises:
+            DatabaseException if not authenticated.
+        """
+        raise NotImplementedError
+
+    def listFiles(self, username):
+        """List files available for a given user.
+
+        Returns:
+            Dictionary of (file ID, info) pairs, see FileListResponse.
+        """
+        raise NotImplementedError
+
+    def pullFile(self, username, fileID):
+        """Returns the contents of a file.
+
+        Raises:
+            DatabaseException if user has no access to specified file.
+        """
+        raise NotImplementedError
+
+    def openFile(self, username, fileID):
+        """Open the contents of a file along with their hash.
+
+        Returns:
+            Tuple of the contents as a binary file object, to be closed by the
+            caller, and the hash of exactly these contents, see
+            delta.contentHash.
+
+        Raises:
+            DatabaseException if user has no access to specified file.
+        """
+        raise NotImplementedError
+
+    def locateRange(self, fContents, byteRange=None, lineRange=None):
+        """Locate a range of contents opened with openFile.
+
+        Byte ranges are widened so that they do not split UTF-8 characters.
+
+        Args:
+            fContents: the contents opened by openFile.
+            byteRange: [start, end) byte offsets or None.
+            lineRange: [first, last) 0-based line numbers, used if byteRange
+                is None.
+
+        Returns:
+            Tuple of the start and end byte offsets of the range and the size
+            of the whole file.
+
+        Raises:
+            DatabaseException if the range is malformed.
+        """
+        raise NotImplementedError
+
+    def fileHash(self, fileID):
+        """Returns the hash of the current contents of a file.
+
+        See delta.contentHash.
+        """
+        raise NotImplementedError
+
+    def newFile(self, username, fileName):
+        """Create new file for specified user.
+
+        Raises:
+            DatabaseException if the user already has a file of that name.
+        """
+        raise NotImplementedError
+
+    def pushFile(self,
+                 username,
+                 fileID,
+                 contents,
+                 sourcePath=None,
+                 baseHash=None):
+        """Replace the contents of a file.
+
+        Args:
+            sourcePath: path of a file in the storage directory holding the
+                new contents, used instead of `contents` if given. It is
+                moved into the store.
+            baseHash: if given, the contents are only replaced if their hash
+                still matches it, checked atomically with the replacement.
+
+        Raises:
+            DatabaseException if user has no access to specified file,
+            ConflictException if the contents no longer match the base hash.
+        """
+        raise NotImplementedError
+
+    def pushDelta(self, username, fileID, baseHash, edits):
+        """Change the contents of a file with an edit script.
+
+        Raises:
+            DatabaseException if user has no access to specified file or the
+            edit script does not fit the contents, ConflictException if they
+            no longer match the base hash.
+        """
+        raise NotImplementedError
+
+    def deleteFile(self, username, fileID):
+        """Delete a file owned by the user or its share to the user.
+
+        Returns:
+            String "owned" if the file was owned by the user, "shared" if it
+            was shared.
+
+        Raises:
+            DatabaseException if user has no acces to specified file.
+        """
+        raise NotImplementedError
+
+    def newShare(self, fileID, username, userToShare):
+        """Share a file owned by the user to another user.
+
+        Raises:
+            DatabaseException if the share is not possible.
+        """
+        raise NotImplementedError
+
+    def deleteShare(self, fileID, username, userToUnshare):
+        """Delete a share of a file owned by the user or shared to them.
+
+        Raises:
+            DatabaseException if the share does not exist or may not be
+            deleted by the user.
+        """
+        raise NotImplementedError
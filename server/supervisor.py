@@ -0,0 +1,87 @@
+"""Supervisor module.
+
+Runs the server in several worker processes to use more than one core. Every
+worker binds the same host and port with SO_REUSEPORT, so the kernel spreads
+the incoming connections among them. Workers share the database, which sqlite
+locks between processes, and the storage directory, in which files are only
+ever replaced atomically.
+"""
+import os
+import signal
+import sys
+import time
+from logging import error, info
+
+# Seconds to wait before restarting a worker, limiting restart loops
+RESTART_DELAY = 1
+
+
+def _spawn(serve, number):
+    """Fork a worker process running the server.
+
+    Returns:
+        The process ID of the worker.
+    """
+    pid = os.fork()
+    if pid:
+        info('Started worker %s (pid %s)', number, pid)
+        return pid
+    code = 0
+    try:
+        # Stop gracefully, running the cleanup of the server
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        serve()
+    except SystemExit as ex:
+        code = ex.code or 0
+    except BaseException:    # pylint: disable=broad-except
+        error('Worker %s crashed', number, exc_info=True)
+        code = 1
+    finally:
+        # Never return into the code of the supervisor
+        os._exit(code)    # pylint: disable=protected-access
+
+
+def supervise(serve, workers):
+    """Run the server in worker processes until interrupted.
+
+    Workers which exit are restarted.
+
+    Args:
+        serve: callable running the server until interrupted.
+        workers: the number of worker processes.
+    """
+    children = dict()
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    for number in range(workers):
+        children[_spawn(serve, number)] = number
+    while children:
+        try:
+            pid, status = os.wait()
+        except KeyboardInterrupt:
+            stop()
+            continue
+        except ChildProcessError:
+            break
+        number = children.pop(pid, None)
+        if number is None or stopping:
+            continue
+        error(
+            'Worker %s (pid %s) exited with status %s, restarting',
+            number,
+            pid,
+            os.waitstatus_to_exitcode(status),
+        )
+        time.sleep(RESTART_DELAY)
+        children[_spawn(serve, number)] = number
+    info('Stopped all workers')
@@ -1,29 +1,95 @@
 """TCP server module.
 """
 import socket
+import threading
 from logging import info
 from socketserver import ThreadingTCPServer
+from common import stats
+from server import admission
 from server import handler
 from server import config
 
 
+def keepalive(sock):
+    """Enable TCP keepalive on a connection as configured.
+
+    Connections of clients which vanished without closing them, for example
+    of suspended laptops, are then dropped once the probes go unanswered.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (
+        ('TCP_KEEPIDLE', config.KEEPALIVE_IDLE),
+        ('TCP_KEEPINTVL', config.KEEPALIVE_INTERVAL),
+        ('TCP_KEEPCNT', config.KEEPALIVE_COUNT),
+    ):
+        # Not available on every platform
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+def logStats():
+    """Log a snapshot of all runtime statistics."""
+    for name, table in stats.snapshot().items():
+        for key, values in table.items():
+            info('Stats %s %s: %s', name, key, values)
+
+
 class TCPServer(ThreadingTCPServer):
     """TCP server class.
 
     Listens on the socket defined in config.HOST and config.PORT, handling
     the requests with handler.TCPHandler.
     """
+    request_queue_size = config.ACCEPT_QUEUE
+
     def __init__(self):
         super().__init__((config.HOST, config.PORT), handler.TCPHandler)
+        self._statsStop = threading.Event()
         info('Created plainsync server on %s:%s', config.HOST, config.PORT)
 
+    def _logStatsPeriodically(self):
+        while not self._statsStop.wait(config.STATS_INTERVAL):
+            logStats()
+
     def server_bind(self):
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if config.WORKERS > 1:
+            # Worker processes share the port, see supervisor
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.socket.bind(self.server_address)
 
+    def get_request(self):
+        request, clientAddress = super().get_request()
+        keepalive(request)
+        # Idle sessions end when receiving times out, see TCPHandler
+        request.settimeout(config.IDLE_TIMEOUT or None)
+        return request, clientAddress
+
+    def verify_request(self, request, client_address):
+        try:
+            admission.connections.acquire()
+        except admission.Busy as ex:
+            info('Refused connection of %s: %s', client_address[0], ex)
+            admission.reject(request, ex)
+            return False
+        return True
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            admission.connections.release()
+
     def serve_forever(self, poll_interval=0.5):
         info('Started plainsync server on %s:%s', config.HOST, config.PORT)
+        if config.STATS_INTERVAL > 0:
+            threading.Thread(
+                target=self._logStatsPeriodically,
+                daemon=True,
+            ).start()
         super().serve_forever(poll_interval)
 
     def server_close(self):
+        self._statsStop.set()
+        logStats()
         info('Shut down plainsync server on %s:%s', config.HOST, config.PORT)
@@ -0,0 +1,114 @@
+"""Fixtures of the tests.
+
+The server configuration is read from the command line and the environment
+when server.config is first imported, so both are set up here, before any test
+module imports the server.
+"""
+import itertools
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+
+import pytest
+
+STORAGE = tempfile.mkdtemp(prefix='plainsync-tests-')
+os.environ['PLAINSYNC_STORAGE'] = STORAGE
+os.environ.pop('PLAINSYNC_DATABASE', None)
+os.environ.pop('PLAINSYNC_STORE', None)
+sys.argv = sys.argv[:1]
+
+# pylint: disable=wrong-import-position
+from common import request
+from common import response
+from common import transfer
+from common.message import MessageType
+from server import config
+
+PASSWORD = 'secret'
+# Every test gets users of its own, the sqlite database is shared
+_userNumbers = itertools.count()
+
+
+def pytest_unconfigure():
+    shutil.rmtree(STORAGE, ignore_errors=True)
+
+
+@pytest.fixture
+def users():
+    """Names of three users, unique to the test."""
+    number = next(_userNumbers)
+    return tuple(f'{name}{number}' for name in ('alice', 'bob', 'carol'))
+
+
+@pytest.fixture(params=['sqlite', 'sqlite-dedup', 'memory'])
+def store(request, users, monkeypatch):
+    """A store of every kind knowing the users, see server.store.Store."""
+    if request.param == 'memory':
+        from server import memstore
+        return memstore.MemoryStore({user: PASSWORD for user in users})
+    from server import dbmanager
+    monkeypatch.setattr(config, 'DEDUP', request.param == 'sqlite-dedup')
+    _addUsers(users)
+    return dbmanager.DatabaseManager()
+
+
+def _addUsers(users):
+    with sqlite3.connect(config.DATABASE) as con:
+        con.executemany(
+            'INSERT INTO Users (username, password) VALUES (?, ?);',
+            [(user, PASSWORD) for user in users],
+        )
+    con.close()
+
+
+@pytest.fixture
+def server(users, monkeypatch):
+    """A threaded server on a free port, with the sqlite store.
+
+    Returns:
+        The address of the server.
+    """
+    from server import tcpserver
+    _addUsers(users)
+    monkeypatch.setattr(config, 'PORT', 0)
+    tcpServer = tcpserver.TCPServer()
+    # Sessions left open by a failed test do not hold up the next one
+    tcpServer.daemon_threads = True
+    thread = threading.Thread(
+        target=tcpServer.serve_forever,
+        args=(0.05, ),
+        daemon=True,
+    )
+    thread.start()
+    yield tcpServer.socket.getsockname()
+    tcpServer.shutdown()
+    tcpServer.server_close()
+    thread.join()
+
+
+def login(address, user, protocol=transfer.PROTOCOL_VERSION, codecs=None):
+    """Open a session on the server.
+
+    Returns:
+        Tuple of the Channel of the session and the AuthResponse.
+    """
+    sock = socket.create_connection(address, timeout=10)
+    channel = transfer.Channel(sock)
+    channel.send(
+        request.AuthRequest(user=user, passwd=PASSWORD, protocol=protocol,
+                            codecs=codecs))
+    resp = response.Response.fromJSON(channel.recieve())
+    assert resp.type == MessageType.AUTH, resp.description
+    channel.protocol = resp.protocol or transfer.PROTOCOL_LEGACY
+    channel.codec = resp.codec
+    return channel, resp
+
+
+def roundTrip(channel, req):
+    """Send a request and receive its response."""
+    channel.send(req)
+    return response.Response.fromJSON(channel.recieve())
@@ -0,0 +1,79 @@
+"""Clean up of the storage on startup, see dbmanager and layout."""
+import contextlib
+import os
+import sqlite3
+import tempfile
+import time
+
+from common import delta
+from server import config
+from server import dbmanager
+from server import layout
+from server import lineindex
+
+
+def _crashedPush(fileID, contents):
+    """Commit the hash of pushed contents left in a temporary file."""
+    fd, sourcePath = tempfile.mkstemp(dir=config.STORAGE, suffix='.tmp')
+    with open(fd, 'w', encoding='utf-8') as fSource:
+        fSource.write(contents)
+    with contextlib.closing(sqlite3.connect(config.DATABASE)) as con:
+        with con:
+            con.execute('UPDATE Files SET hash=? WHERE id=?;',
+                        (delta.contentHash(contents), fileID))
+    return sourcePath
+
+
+def _age(path):
+    past = time.time() - 2 * config.BLOB_GRACE - 1
+    os.utime(path, (past, past))
+
+
+def test_finish_replacements(users, monkeypatch):
+    monkeypatch.setattr(config, 'DEDUP', False)
+    alice = users[0]
+    store = dbmanager.DatabaseManager()
+    with contextlib.closing(sqlite3.connect(config.DATABASE)) as con:
+        with con:
+            con.execute(
+                'INSERT INTO Users (username, password) VALUES (?, ?);',
+                (alice, 'secret'))
+    store.newFile(alice, 'notes.txt')
+    fileID, = store.listFiles(alice)
+    store.pushFile(alice, fileID, 'old\n')
+    sourcePath = _crashedPush(fileID, 'committed\n')
+    unrelated = _crashedPush(fileID, 'never committed\n')
+    _age(unrelated)
+    with contextlib.closing(sqlite3.connect(config.DATABASE)) as con:
+        with con:
+            con.execute('UPDATE Files SET hash=? WHERE id=?;',
+                        (delta.contentHash('committed\n'), fileID))
+    with contextlib.closing(sqlite3.connect(config.DATABASE)) as con:
+        assert dbmanager._finishReplacements(con) == 1
+        # Already in place
+        assert dbmanager._finishReplacements(con) == 0
+    assert not os.path.exists(sourcePath)
+    with open(layout.locate(fileID), encoding='utf-8') as fStored:
+        assert fStored.read() == 'committed\n'
+    layout.removeStale()
+    assert not os.path.exists(unrelated)
+
+
+def test_remove_stale_in_shards(monkeypatch):
+    monkeypatch.setattr(config, 'STORAGE_DEPTH', 2)
+    target = layout.prepare('abcdef0123')
+    stale, fresh = (tempfile.mkstemp(dir=os.path.dirname(target),
+                                     suffix='.tmp')[1] for _ in range(2))
+    abandoned = tempfile.mkstemp(dir=config.STORAGE, suffix='.tmp')[1]
+    staleIndex = lineindex.indexPath(abandoned)
+    open(staleIndex, 'wb').close()
+    kept = target + '.lines'
+    open(kept, 'wb').close()
+    for path in (stale, abandoned, staleIndex, kept):
+        _age(path)
+    layout.removeStale()
+    assert not os.path.exists(stale)
+    assert not os.path.exists(abandoned)
+    assert not os.path.exists(staleIndex)
+    assert os.path.exists(fresh)
+    assert os.path.exists(kept)
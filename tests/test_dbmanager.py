@@ -0,0 +1,57 @@
+"""Behaviour specific to the sqlite store, see server.dbmanager."""
+import contextlib
+import sqlite3
+
+import pytest
+
+from server import config
+from server import dbmanager
+from server.store import DatabaseException
+from tests.conftest import PASSWORD
+
+
+class _RacingConnection:
+    """Connection on which the checks for duplicates find nothing, as if
+    another worker process made the duplicate right after them."""
+    CHECKS = ('SELECT * FROM Files WHERE owner=? AND name=?',
+              'SELECT 1 FROM Shares WHERE file=? AND user=?')
+
+    def __init__(self, con):
+        self._con = con
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+    def execute(self, sql, *args):
+        if any(check in sql for check in self.CHECKS):
+            return self._con.execute('SELECT 1 WHERE 0;')
+        return self._con.execute(sql, *args)
+
+
+@pytest.fixture
+def racing(users):
+    with contextlib.closing(sqlite3.connect(config.DATABASE)) as con:
+        with con:
+            con.executemany(
+                'INSERT INTO Users (username, password) VALUES (?, ?);',
+                [(user, PASSWORD) for user in users],
+            )
+        yield dbmanager.DatabaseManager(_RacingConnection(con))
+
+
+def test_new_file_race(racing, users):
+    alice = users[0]
+    racing.newFile(alice, 'notes.txt')
+    with pytest.raises(DatabaseException, match='already has a file'):
+        racing.newFile(alice, 'notes.txt')
+    assert len(racing.listFiles(alice)) == 1
+
+
+def test_new_share_race(racing, users):
+    alice, bob, _ = users
+    racing.newFile(alice, 'notes.txt')
+    fileID, = racing.listFiles(alice)
+    racing.newShare(fileID, alice, bob)
+    with pytest.raises(DatabaseException, match='already has access'):
+        racing.newShare(fileID, alice, bob)
+    assert racing.listFiles(alice)[fileID]['shares'] == [bob]
@@ -0,0 +1,101 @@
+"""Writer of the sqlite store, see server.dbpool."""
+import contextlib
+import sqlite3
+import threading
+
+import pytest
+
+from server import config
+from server import dbmanager
+from server import dbpool
+from tests.conftest import PASSWORD
+
+
+@pytest.fixture
+def writer(users, monkeypatch):
+    """A writer grouping the jobs of half a second into one commit."""
+    monkeypatch.setattr(config, 'GROUP_COMMIT_WINDOW', 500)
+    monkeypatch.setattr(config, 'GROUP_COMMIT_SIZE', 2)
+    with contextlib.closing(sqlite3.connect(config.DATABASE)) as con:
+        with con:
+            con.executemany(
+                'INSERT INTO Users (username, password) VALUES (?, ?);',
+                [(user, PASSWORD) for user in users],
+            )
+    return dbpool.Writer(dbmanager.DatabaseManager)
+
+
+def _runAll(writer, functions):
+    """Run the functions on the writer at once.
+
+    Returns:
+        List of their results or exceptions.
+    """
+    outcomes = [None] * len(functions)
+
+    def run(index):
+        try:
+            outcomes[index] = writer.run(functions[index])
+        except Exception as ex:    # pylint: disable=broad-except
+            outcomes[index] = ex
+
+    threads = [
+        threading.Thread(target=run, args=(index, ))
+        for index in range(len(functions))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def test_group_commit(writer, users):
+    alice, bob, _ = users
+    _runAll(writer, [
+        lambda manager: manager.newFile(alice, 'first.txt'),
+        lambda manager: manager.newFile(bob, 'second.txt'),
+    ])
+    store = dbmanager.DatabaseManager()
+    assert len(store.listFiles(alice)) == len(store.listFiles(bob)) == 1
+
+
+def test_group_failing_apply_fails_its_job_only(writer, users):
+    alice, bob, _ = users
+
+    def failingApply(manager):
+        manager.newFile(alice, 'failing.txt')
+
+        def apply():
+            raise OSError('Disk on fire')
+
+        # pylint: disable=protected-access
+        manager._commit(apply=apply)
+
+    failed, created = _runAll(writer, [
+        failingApply,
+        lambda manager: manager.newFile(bob, 'notes.txt'),
+    ])
+    assert isinstance(failed, OSError)
+    assert created is None
+    store = dbmanager.DatabaseManager()
+    # Both have been commited
+    assert len(store.listFiles(alice)) == len(store.listFiles(bob)) == 1
+
+
+def test_group_failing_job_is_undone(writer, users):
+    alice, bob, _ = users
+
+    def failing(manager):
+        manager.newFile(alice, 'failing.txt')
+        raise ValueError('Failed')
+
+    failed, created = _runAll(writer, [
+        failing,
+        lambda manager: manager.newFile(bob, 'notes.txt'),
+    ])
+    assert isinstance(failed, ValueError)
+    assert created is None
+    store = dbmanager.DatabaseManager()
+    assert not store.listFiles(alice)
+    assert len(store.listFiles(bob)) == 1
@@ -0,0 +1,46 @@
+"""Edit scripts of delta pushes, see common.delta."""
+import pytest
+
+from common import delta
+
+
+@pytest.mark.parametrize('base, contents', [
+    ('', ''),
+    ('', 'new\n'),
+    ('old\n', ''),
+    ('one\ntwo\nthree\n', 'one\n2\nthree\nfour\n'),
+    ('no newline', 'no newline at the end'),
+    ('žluťoučký\nkůň\n', 'žluťoučký\n🐎\nkůň\n'),
+    ('a\r\nb\r\n', 'a\nb\r\n'),
+])
+def test_round_trip(base, contents):
+    edits = delta.makeDelta(base, contents)
+    assert delta.applyDelta(base, edits) == contents
+
+
+def test_unchanged_lines_are_not_sent():
+    base = ''.join(f'line {number}\n' for number in range(1000))
+    contents = base.replace('line 500\n', 'changed\n')
+    assert delta.makeDelta(base, contents) == [[
+        base.index('line 500\n'),
+        base.index('line 501\n'),
+        'changed\n',
+    ]]
+
+
+@pytest.mark.parametrize('edits', [
+    [[0, 100, '']],
+    [[3, 2, '']],
+    [[2, 3, ''], [0, 1, '']],
+    [['0', 1, '']],
+    [[0, 1, None]],
+    [[0, 1]],
+])
+def test_invalid_edits(edits):
+    with pytest.raises(ValueError):
+        delta.applyDelta('base\n', edits)
+
+
+def test_content_hash():
+    assert delta.contentHash('') == 'da39a3ee5e6b4b0d3255bfef95601890afd80709'
+    assert delta.contentHash('ž') != delta.contentHash('z')
@@ -0,0 +1,92 @@
+"""Encoding and decoding of messages, see common.message."""
+import json
+
+import pytest
+
+from benchmarks.messages import REQUESTS
+from benchmarks.messages import RESPONSES
+from common import request
+from common import response
+from common import transfer
+from common.message import MessageType
+
+
+@pytest.mark.parametrize('family, samples', [
+    (request.Request, REQUESTS),
+    (response.Response, RESPONSES),
+])
+def test_every_type_has_a_sample(family, samples):
+    assert set(family.REGISTRY) == set(samples)
+
+
+@pytest.mark.parametrize('family, factory', [
+    *((request.Request, factory) for factory in REQUESTS.values()),
+    *((response.Response, factory) for factory in RESPONSES.values()),
+])
+def test_round_trip(family, factory):
+    message = factory()
+    decoded = family.fromJSON(message.toJSON())
+    assert type(decoded) is type(message)
+    assert decoded.toDict() == message.toDict()
+
+
+def test_none_is_omitted():
+    message = request.PullRequest(fileID='abc')
+    assert json.loads(message.toJSON()) == {'type': 'PULL', 'fileID': 'abc'}
+    decoded = request.Request.fromJSON(message.toJSON())
+    assert decoded.knownHash is None and decoded.requestID is None
+
+
+def test_local_attributes_are_not_transmitted():
+    message = request.PushRequest(fileID='abc', content='text')
+    message.bodyPath = '/tmp/body.tmp'
+    assert 'bodyPath' not in message.toDict()
+
+
+@pytest.mark.parametrize('family, data', [
+    (request.Request, {'type': 'PULL', 'fileID': 'abc', 'extra': 1}),
+    (request.Request, {'type': 'PULL', 'content': 'not a pull field'}),
+    (request.Request, {'type': 'NO_SUCH_TYPE'}),
+    (request.Request, {'fileID': 'abc'}),
+    (request.Request, {'type': 'PONG'}),
+    (response.Response, {'type': 'LIST_FILES', 'files': {}, 'passwd': 'x'}),
+    (response.Response, {'type': 'NEW_FILE', 'fileName': 'notes.txt'}),
+])
+def test_refused(family, data):
+    with pytest.raises(TypeError):
+        family.fromJSON(json.dumps(data))
+
+
+def test_framing_keys_are_accepted():
+    frame = transfer.Frame(
+        json.dumps({
+            'type': 'PUSH',
+            'fileID': 'abc',
+            'bodyField': 'content',
+            'bodyLength': 4,
+        }))
+    frame.body = b'text'
+    decoded = request.Request.fromJSON(frame)
+    assert decoded.content == 'text'
+    assert decoded.bodyPath is None
+
+
+def test_unexpected_body_field_is_refused():
+    frame = transfer.Frame(
+        json.dumps({
+            'type': 'PUSH',
+            'fileID': 'abc',
+            'bodyField': 'fileID',
+            'bodyLength': 4,
+        }))
+    with pytest.raises(TypeError):
+        request.Request.fromJSON(frame)
+
+
+def test_family_decodes_into_registered_class():
+    decoded = response.Response.fromJSON(
+        response.ErrResponse(err='Failed', conflict=True).toJSON())
+    assert isinstance(decoded, response.ErrResponse)
+    assert decoded.type == MessageType.ERR
+    assert decoded.description == 'Error: Failed.'
+    assert decoded.conflict is True
@@ -0,0 +1,153 @@
+"""Pipelined requests, see server.pipeline and transfer.exchange."""
+import threading
+import time
+
+from common import request
+from common import response
+from common import transfer
+from common.message import MessageType
+from server import pipeline
+from server.handler import TCPHandler
+from tests.conftest import login
+from tests.conftest import roundTrip
+
+
+def _responses(channel, requests):
+    return [
+        response.Response.fromJSON(data)
+        for data in transfer.exchange(channel, requests)
+    ]
+
+
+def test_failing_request_is_answered(server, users, monkeypatch):
+    def failing(handler, req, dataBase, inline):
+        raise RuntimeError('Broken handler')
+
+    monkeypatch.setitem(TCPHandler.HANDLERS, MessageType.PING, failing)
+    channel, _ = login(server, users[0])
+    first, second = _responses(channel, [
+        request.PingRequest(rtt=1.0),
+        request.FileListRequest(),
+    ])
+    assert first.type == MessageType.ERR
+    assert 'Broken handler' in first.description
+    assert first.requestID == 0
+    assert second.type == MessageType.LIST_FILES
+    # Without a requestID the session goes on as well
+    assert roundTrip(channel, request.PingRequest(rtt=1.0)).type == (
+        MessageType.ERR)
+    assert roundTrip(channel,
+                     request.FileListRequest()).type == MessageType.LIST_FILES
+
+
+def test_malformed_range_is_answered(server, users):
+    channel, _ = login(server, users[0])
+    roundTrip(channel, request.NewFileRequest(fileName='notes.txt'))
+    fileID, = roundTrip(channel, request.FileListRequest()).files
+    resp, = _responses(channel, [
+        request.PullRequest(fileID=fileID, lineRange=[0, 1e400]),
+    ])
+    assert resp.type == MessageType.ERR
+    assert resp.requestID == 0
+    resp = roundTrip(channel,
+                     request.PullRequest(fileID=fileID, byteRange=[0, 1e400]))
+    assert resp.type == MessageType.ERR
+
+
+def test_fallback_is_delivered():
+    delivered = list()
+    lanes = pipeline.Pipeline('alice', lambda result, done:
+                              (delivered.append(result), done()))
+
+    def failing():
+        raise RuntimeError('Broken')
+
+    lanes.submit('key', failing, fallback=lambda ex: f'failed: {ex}')
+    lanes.submit(None, failing)
+    lanes.join()
+    assert delivered == ['failed: Broken']
+
+
+def test_lane_keeps_order():
+    order = list()
+    lanes = pipeline.Pipeline('alice')
+
+    def step(number):
+        # Later steps would overtake the earlier ones if run concurrently
+        time.sleep(0.01 * (5 - number))
+        order.append(number)
+
+    for number in range(5):
+        lanes.submit('file', lambda number=number: step(number))
+    lanes.join()
+    assert order == list(range(5))
+
+
+def test_lanes_run_concurrently():
+    barrier = threading.Barrier(2, timeout=10)
+    lanes = pipeline.Pipeline('alice')
+    results = list()
+    for key in ('first', 'second'):
+        lanes.submit(key, lambda: results.append(barrier.wait()))
+    lanes.join()
+    assert sorted(results) == [0, 1]
+
+
+def test_depth_limits_requests_in_flight():
+    held = list()
+    lanes = pipeline.Pipeline(
+        'alice', lambda result, done: held.append(done), depth=2)
+    for _ in range(2):
+        lanes.submit(None, lambda: None)
+    submitted = threading.Event()
+    thread = threading.Thread(
+        target=lambda: (lanes.submit(None, lambda: None), submitted.set()))
+    thread.start()
+    assert not submitted.wait(0.2)
+    # Delivering a result frees a slot
+    while not held:
+        time.sleep(0.01)
+    held.pop(0)()
+    assert submitted.wait(10)
+    thread.join()
+    while len(held) < 2:
+        time.sleep(0.01)
+    for done in held:
+        done()
+    lanes.join()
+
+
+def test_requestKey():
+    assert pipeline.requestKey(request.PullRequest(fileID='abc')) == 'abc'
+    assert pipeline.requestKey(
+        request.NewFileRequest(fileName='notes.txt')) == 'notes.txt'
+    assert pipeline.requestKey(request.FileListRequest()) is None
+
+
+def test_exchange_in_order(server, users):
+    channel, _ = login(server, users[0])
+    roundTrip(channel, request.NewFileRequest(fileName='notes.txt'))
+    fileID, = roundTrip(channel, request.FileListRequest()).files
+    requests = [
+        request.PushRequest(fileID=fileID, content=f'version {number}\n')
+        for number in range(10)
+    ] + [request.PullRequest(fileID=fileID), request.PingRequest(rtt=1.0)]
+    responses = _responses(channel, requests)
+    assert [resp.requestID for resp in responses] == list(range(12))
+    assert all(resp.type == MessageType.OK for resp in responses[:10])
+    # Requests of the same file are processed in order
+    assert responses[10].content == 'version 9\n'
+    assert responses[11].type == MessageType.PONG
+
+
+def test_pipelined_and_ordered_requests_mix(server, users):
+    channel, _ = login(server, users[0])
+    roundTrip(channel, request.NewFileRequest(fileName='notes.txt'))
+    fileID, = roundTrip(channel, request.FileListRequest()).files
+    push = request.PushRequest(fileID=fileID, content='pipelined\n')
+    push.requestID = 1
+    channel.send(push)
+    resp = response.Response.fromJSON(channel.recieve())
+    assert (resp.type, resp.requestID) == (MessageType.OK, 1)
+    assert roundTrip(channel, request.PullRequest(
+        fileID=fileID)).content == 'pipelined\n'
@@ -0,0 +1,94 @@
+"""Whole and delta pushes through the server, see handler.processPush."""
+from common import delta
+from common import request
+from common.message import MessageType
+from tests.conftest import login
+from tests.conftest import roundTrip
+
+
+def _newFile(channel, fileName='notes.txt'):
+    roundTrip(channel, request.NewFileRequest(fileName=fileName))
+    return next(fileID for fileID, info in roundTrip(
+        channel, request.FileListRequest()).files.items()
+                if info['name'] == fileName)
+
+
+def _pull(channel, fileID):
+    return roundTrip(channel, request.PullRequest(fileID=fileID)).content
+
+
+def _pushDelta(channel, fileID, base, new):
+    return roundTrip(
+        channel,
+        request.PushRequest(
+            fileID=fileID,
+            content=None,
+            baseHash=delta.contentHash(base),
+            edits=delta.makeDelta(base, new),
+        ))
+
+
+def test_push_whole_contents(server, users):
+    channel, _ = login(server, users[0])
+    fileID = _newFile(channel)
+    contents = 'žluťoučký kůň\n' * 1000
+    resp = roundTrip(channel,
+                     request.PushRequest(fileID=fileID, content=contents))
+    assert resp.type == MessageType.OK
+    assert _pull(channel, fileID) == contents
+
+
+def test_push_delta(server, users):
+    channel, _ = login(server, users[0])
+    fileID = _newFile(channel)
+    base = 'one\ntwo\nthree\n'
+    roundTrip(channel, request.PushRequest(fileID=fileID, content=base))
+    new = 'one\n2\nthree\nfour\n'
+    assert _pushDelta(channel, fileID, base, new).type == MessageType.OK
+    assert _pull(channel, fileID) == new
+
+
+def test_push_delta_conflict(server, users):
+    alice, bob, _ = users
+    aliceChannel, _ = login(server, alice)
+    bobChannel, _ = login(server, bob)
+    fileID = _newFile(aliceChannel)
+    roundTrip(aliceChannel, request.NewShareRequest(fileID=fileID, user=bob))
+    base = 'one\ntwo\n'
+    roundTrip(aliceChannel, request.PushRequest(fileID=fileID, content=base))
+    roundTrip(bobChannel,
+              request.PushRequest(fileID=fileID, content='from bob\n'))
+    resp = _pushDelta(aliceChannel, fileID, base, 'from alice\n')
+    assert resp.type == MessageType.ERR
+    assert resp.conflict
+    assert _pull(aliceChannel, fileID) == 'from bob\n'
+
+
+def test_push_delta_invalid_edits(server, users):
+    channel, _ = login(server, users[0])
+    fileID = _newFile(channel)
+    base = 'one\n'
+    roundTrip(channel, request.PushRequest(fileID=fileID, content=base))
+    resp = roundTrip(
+        channel,
+        request.PushRequest(
+            fileID=fileID,
+            content=None,
+            baseHash=delta.contentHash(base),
+            edits=[[5, 9, 'beyond the end\n']],
+        ))
+    assert resp.type == MessageType.ERR
+    assert not resp.conflict
+    assert _pull(channel, fileID) == base
+
+
+def test_push_without_access(server, users):
+    alice, bob, _ = users
+    aliceChannel, _ = login(server, alice)
+    bobChannel, _ = login(server, bob)
+    fileID = _newFile(aliceChannel)
+    resp = roundTrip(bobChannel,
+                     request.PushRequest(fileID=fileID, content='mine\n'))
+    assert resp.type == MessageType.ERR
+    assert not resp.conflict
+    assert _pull(aliceChannel, fileID) == ''
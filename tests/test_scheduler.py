@@ -0,0 +1,92 @@
+"""Priority classes and fairness of the scheduler, see server.scheduler."""
+import threading
+
+import pytest
+
+from common.message import MessageType
+from server import config
+from server import scheduler
+
+
+def _drain(queue):
+    return [queue.pop() for _ in range(len(queue))]
+
+
+def test_users_are_served_fairly():
+    queue = scheduler._FairQueue()    # pylint: disable=protected-access
+    for number in range(10):
+        queue.push('alice', f'alice{number}')
+    queue.push('bob', 'bob0')
+    queue.push('bob', 'bob1')
+    served = _drain(queue)
+    assert served.index('bob0') <= 1
+    assert served.index('bob1') <= 3
+    # Every user in order of arrival
+    assert [item for item in served if item.startswith('alice')
+            ] == [f'alice{number}' for number in range(10)]
+
+
+def test_users_are_served_by_weight(monkeypatch):
+    monkeypatch.setattr(config, 'USER_WEIGHTS', {'alice': 2})
+    queue = scheduler._FairQueue()    # pylint: disable=protected-access
+    for number in range(6):
+        queue.push('alice', 'alice')
+        queue.push('bob', 'bob')
+    assert _drain(queue)[:6].count('alice') == 4
+
+
+@pytest.mark.parametrize('msgType, klass', [
+    (MessageType.PULL, 0),
+    (MessageType.AUTH, 1),
+    (MessageType.LIST_FILES, 2),
+    (None, 2),
+])
+def test_priority(msgType, klass):
+    assert scheduler.priority(msgType) == klass
+
+
+def _blocked(pool):
+    """Occupy the only thread of the pool until the returned event is set."""
+    release = threading.Event()
+    started = threading.Event()
+    pool.submit(lambda: (started.set(), release.wait(10)))
+    assert started.wait(10)
+    return release
+
+
+def test_priority_classes_go_first():
+    pool = scheduler.Scheduler(1)
+    release = _blocked(pool)
+    order = list()
+    futures = [
+        pool.submit(lambda: order.append('list'), MessageType.LIST_FILES),
+        pool.submit(lambda: order.append('share'), MessageType.NEW_SHARE),
+        pool.submit(lambda: order.append('pull'), MessageType.PULL),
+    ]
+    release.set()
+    for future in futures:
+        future.result(10)
+    assert order == ['pull', 'share', 'list']
+
+
+def test_scheduler_is_fair():
+    pool = scheduler.Scheduler(1)
+    release = _blocked(pool)
+    order = list()
+    futures = [
+        pool.submit(lambda: order.append('alice'), MessageType.PULL, 'alice')
+        for _ in range(5)
+    ]
+    futures.append(
+        pool.submit(lambda: order.append('bob'), MessageType.PULL, 'bob'))
+    release.set()
+    for future in futures:
+        future.result(10)
+    assert order.index('bob') <= 1
+
+
+def test_failing_function():
+    pool = scheduler.Scheduler(1)
+    with pytest.raises(ValueError):
+        pool.run(lambda: int('not a number'))
+    assert pool.run(lambda: 42) == 42
@@ -0,0 +1,139 @@
+"""Sessions of clients with the server, see server.handler."""
+import os
+import socket
+import time
+
+import pytest
+
+from common import request
+from common import response
+from common import transfer
+from common.message import MessageType
+from server import config
+from tests.conftest import login
+from tests.conftest import roundTrip
+from tests.test_transfer import _rawPush
+
+
+def _newFile(channel, fileName='notes.txt'):
+    roundTrip(channel, request.NewFileRequest(fileName=fileName))
+    return next(fileID for fileID, info in roundTrip(
+        channel, request.FileListRequest()).files.items()
+                if info['name'] == fileName)
+
+
+def _spooled():
+    return [name for name in os.listdir(config.STORAGE) if name.endswith('.tmp')]
+
+
+def test_wrong_password(server, users):
+    sock = socket.create_connection(server, timeout=10)
+    with sock:
+        transfer.send(sock, request.AuthRequest(user=users[0], passwd='wrong'))
+        resp = response.Response.fromJSON(transfer.recieve(sock))
+    assert resp.type == MessageType.ERR
+
+
+def test_first_request_must_authenticate(server):
+    sock = socket.create_connection(server, timeout=10)
+    with sock:
+        transfer.send(sock, request.FileListRequest())
+        resp = response.Response.fromJSON(transfer.recieve(sock))
+    assert resp.type == MessageType.ERR
+
+
+@pytest.mark.parametrize('protocol', [
+    None,
+    transfer.PROTOCOL_LEGACY,
+    transfer.PROTOCOL_WIDE,
+    transfer.PROTOCOL_BODY,
+])
+def test_protocols(server, users, protocol):
+    channel, auth = login(server, users[0], protocol=protocol)
+    assert channel.protocol == transfer.negotiate(protocol)
+    assert (auth.protocol or transfer.PROTOCOL_LEGACY) == channel.protocol
+    fileID = _newFile(channel)
+    contents = 'žluťoučký kůň\n' * 100
+    assert roundTrip(channel, request.PushRequest(
+        fileID=fileID, content=contents)).type == MessageType.OK
+    assert roundTrip(channel,
+                     request.PullRequest(fileID=fileID)).content == contents
+
+
+@pytest.mark.parametrize('codec', sorted(transfer.CODECS))
+def test_compression(server, users, codec):
+    channel, auth = login(server, users[0], codecs=[codec])
+    assert auth.codec == codec
+    fileID = _newFile(channel)
+    contents = 'compressible line\n' * 10000
+    roundTrip(channel, request.PushRequest(fileID=fileID, content=contents))
+    assert roundTrip(channel,
+                     request.PullRequest(fileID=fileID)).content == contents
+
+
+def test_no_compression_in_legacy_protocol(server, users):
+    _, auth = login(server, users[0], protocol=transfer.PROTOCOL_LEGACY,
+                    codecs=['zlib'])
+    assert auth.codec is None
+
+
+def test_invalid_utf8_push(server, users):
+    channel, _ = login(server, users[0])
+    fileID = _newFile(channel)
+    roundTrip(channel, request.PushRequest(fileID=fileID, content='kept\n'))
+    spooled = _spooled()
+    _rawPush(channel.sock, b'\xff\xfe')
+    resp = response.Response.fromJSON(channel.recieve())
+    assert resp.type == MessageType.ERR
+    assert 'UTF-8' in resp.description
+    assert _spooled() == spooled
+    # The session goes on
+    assert roundTrip(channel,
+                     request.PullRequest(fileID=fileID)).content == 'kept\n'
+
+
+def test_malformed_request_ends_session(server, users):
+    channel, _ = login(server, users[0])
+    channel.sock.sendall(b'\x00\x00\x00\x00\x00\x00\x00\x07{"a": 1')
+    with pytest.raises((ConnectionAbortedError, ConnectionResetError)):
+        channel.recieve()
+
+
+def test_unknown_field_ends_session(server, users):
+    channel, _ = login(server, users[0])
+    payload = b'{"type": "LIST_FILES", "extra": 1}'
+    channel.sock.sendall(len(payload).to_bytes(8, 'big') + payload)
+    with pytest.raises((ConnectionAbortedError, ConnectionResetError)):
+        channel.recieve()
+
+
+def test_frame_too_large_ends_session(server, users):
+    channel, _ = login(server, users[0])
+    channel.sock.sendall((config.MAX_FRAME + 1).to_bytes(8, 'big'))
+    with pytest.raises((ConnectionAbortedError, ConnectionResetError)):
+        channel.recieve()
+
+
+def test_slow_reader_does_not_hold_others(server, users, monkeypatch):
+    monkeypatch.setattr(config, 'SEND_TIMEOUT', 2)
+    alice, bob, _ = users
+    channel, _ = login(server, alice)
+    fileID = _newFile(channel)
+    roundTrip(channel,
+              request.PushRequest(fileID=fileID, content='x' * (4 << 20)))
+    # Pipelined pulls which are never read
+    for requestID in range(config.PIPELINE_DEPTH):
+        pull = request.PullRequest(fileID=fileID)
+        pull.requestID = requestID
+        channel.send(pull)
+    started = time.monotonic()
+    other, _ = login(server, bob)
+    assert roundTrip(other, request.FileListRequest()).type == (
+        MessageType.LIST_FILES)
+    assert time.monotonic() - started < 1
+    # The slow session is closed once a response is not taken in time
+    time.sleep(config.SEND_TIMEOUT + 1)
+    with pytest.raises((ConnectionAbortedError, ConnectionResetError)):
+        for _ in range(config.PIPELINE_DEPTH):
+            channel.recieve()
+    channel.sock.close()
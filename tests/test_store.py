@@ -0,0 +1,320 @@
+"""Conformance of the stores to server.store.Store.
+
+Every test runs against every kind of store, see conftest.store.
+"""
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from common import delta
+from server import config
+from server.store import DatabaseException
+
+
+def _newFile(store, username, fileName):
+    """Create a file and return its ID."""
+    store.newFile(username, fileName)
+    return next(fileID
+                for fileID, info in store.listFiles(username).items()
+                if info['name'] == fileName and info['owner'] == username)
+
+
+def _read(store, username, fileID):
+    """Read the contents of a file through openFile."""
+    fContents, fileHash = store.openFile(username, fileID)
+    with fContents:
+        return str(fContents.read(), 'utf-8'), fileHash
+
+
+def test_authenticate(store, users):
+    alice = users[0]
+    store.authenticate(alice, 'secret')
+    with pytest.raises(DatabaseException):
+        store.authenticate(alice, 'wrong')
+    with pytest.raises(DatabaseException):
+        store.authenticate('nobody', 'secret')
+
+
+def test_new_file_is_empty(store, users):
+    alice = users[0]
+    fileID = _newFile(store, alice, 'notes.txt')
+    info = store.listFiles(alice)[fileID]
+    assert info['owner'] == alice
+    assert info['shares'] == []
+    assert info['hash'] == delta.contentHash('')
+    assert store.pullFile(alice, fileID) == ''
+    assert store.fileHash(fileID) == delta.contentHash('')
+
+
+def test_new_file_name_is_unique_per_user(store, users):
+    alice, bob, _ = users
+    _newFile(store, alice, 'notes.txt')
+    with pytest.raises(DatabaseException):
+        store.newFile(alice, 'notes.txt')
+    _newFile(store, bob, 'notes.txt')
+
+
+@pytest.mark.parametrize('contents', [
+    'plain text\n',
+    'žluťoučký kůň 🐎\nna dvou\rřádcích\r\n',
+    'x' * (1 << 20),
+])
+def test_push_pull(store, users, contents):
+    alice = users[0]
+    fileID = _newFile(store, alice, 'notes.txt')
+    store.pushFile(alice, fileID, contents)
+    assert store.pullFile(alice, fileID) == contents
+    assert _read(store, alice, fileID) == (contents,
+                                           delta.contentHash(contents))
+    assert store.fileHash(fileID) == delta.contentHash(contents)
+    info = store.listFiles(alice)[fileID]
+    assert info['hash'] == delta.contentHash(contents)
+    assert info['last_edited_user'] == alice
+
+
+def test_push_spooled_file(store, users):
+    alice = users[0]
+    fileID = _newFile(store, alice, 'notes.txt')
+    fd, sourcePath = tempfile.mkstemp(dir=config.STORAGE, suffix='.tmp')
+    with open(fd, 'w', encoding='utf-8') as fSource:
+        fSource.write('spooled ü\n')
+    store.pushFile(alice, fileID, None, sourcePath=sourcePath)
+    assert not os.path.exists(sourcePath)
+    assert store.pullFile(alice, fileID) == 'spooled ü\n'
+
+
+def test_push_base_hash(store, users):
+    alice = users[0]
+    fileID = _newFile(store, alice, 'notes.txt')
+    store.pushFile(alice, fileID, 'first\n')
+    store.pushFile(alice, fileID, 'second\n',
+                   baseHash=delta.contentHash('first\n'))
+    with pytest.raises(DatabaseException):
+        store.pushFile(alice, fileID, 'third\n',
+                       baseHash=delta.contentHash('first\n'))
+    assert store.pullFile(alice, fileID) == 'second\n'
+
+
+def test_push_delta(store, users):
+    alice = users[0]
+    fileID = _newFile(store, alice, 'notes.txt')
+    base = 'one\ntwo\nthree\n'
+    store.pushFile(alice, fileID, base)
+    new = 'one\n2\nthree\nfour\n'
+    store.pushDelta(alice, fileID, delta.contentHash(base),
+                    delta.makeDelta(base, new))
+    assert store.pullFile(alice, fileID) == new
+    assert store.fileHash(fileID) == delta.contentHash(new)
+    # The base is gone
+    with pytest.raises(DatabaseException):
+        store.pushDelta(alice, fileID, delta.contentHash(base),
+                        delta.makeDelta(base, 'other\n'))
+    assert store.pullFile(alice, fileID) == new
+
+
+def test_locate_range(store, users):
+    alice = users[0]
+    fileID = _newFile(store, alice, 'notes.txt')
+    contents = 'zero\none\ntwo\nthree\n'
+    store.pushFile(alice, fileID, contents)
+    fContents, _ = store.openFile(alice, fileID)
+    with fContents:
+        start, end, size = store.locateRange(fContents, lineRange=[1, 3])
+        assert contents.encode('utf-8')[start:end] == b'one\ntwo\n'
+        assert size == len(contents)
+        start, end, _ = store.locateRange(fContents, byteRange=[5, 8])
+        assert (start, end) == (5, 8)
+
+
+def test_locate_range_widens_byte_ranges(store, users):
+    alice = users[0]
+    fileID = _newFile(store, alice, 'notes.txt')
+    contents = 'až🐎b'
+    store.pushFile(alice, fileID, contents)
+    fContents, _ = store.openFile(alice, fileID)
+    with fContents:
+        # Both ends fall within characters
+        start, end, _ = store.locateRange(fContents, byteRange=[2, 5])
+    assert contents.encode('utf-8')[start:end] == 'ž🐎'.encode('utf-8')
+    assert (start, end) == (1, 7)
+
+
+@pytest.mark.parametrize('byteRange, lineRange', [
+    ([0, 1e400], None),
+    (None, [0, 1e400]),
+    (None, [0.5, 1]),
+    ([True, 2], None),
+    ([3, 1], None),
+    ([-1, 1], None),
+    (None, ['0', '1']),
+    (None, [0]),
+    (None, None),
+])
+def test_locate_range_refused(store, users, byteRange, lineRange):
+    alice = users[0]
+    fileID = _newFile(store, alice, 'notes.txt')
+    store.pushFile(alice, fileID, 'zero\none\n')
+    fContents, _ = store.openFile(alice, fileID)
+    with fContents:
+        with pytest.raises(DatabaseException):
+            store.locateRange(fContents, byteRange, lineRange)
+
+
+def test_no_access(store, users):
+    alice, bob, _ = users
+    fileID = _newFile(store, alice, 'notes.txt')
+    with pytest.raises(DatabaseException):
+        store.pullFile(bob, fileID)
+    with pytest.raises(DatabaseException):
+        store.openFile(bob, fileID)
+    with pytest.raises(DatabaseException):
+        store.pushFile(bob, fileID, 'mine\n')
+    with pytest.raises(DatabaseException):
+        store.deleteFile(bob, fileID)
+    assert fileID not in store.listFiles(bob)
+
+
+def test_share(store, users):
+    alice, bob, carol = users
+    fileID = _newFile(store, alice, 'notes.txt')
+    store.newShare(fileID, alice, bob)
+    assert store.listFiles(alice)[fileID]['shares'] == [bob]
+    assert store.listFiles(bob)[fileID]['owner'] == alice
+    assert 'shares' not in store.listFiles(bob)[fileID]
+    # Shared users may push and pull, but not share further
+    store.pushFile(bob, fileID, 'from bob\n')
+    assert store.pullFile(alice, fileID) == 'from bob\n'
+    assert store.listFiles(alice)[fileID]['last_edited_user'] == bob
+    with pytest.raises(DatabaseException):
+        store.newShare(fileID, bob, carol)
+    assert fileID not in store.listFiles(carol)
+
+
+@pytest.mark.parametrize('userToShare', ['alice', 'bob', 'nobody'])
+def test_share_refused(store, users, userToShare):
+    alice, bob, _ = users
+    fileID = _newFile(store, alice, 'notes.txt')
+    store.newShare(fileID, alice, bob)
+    # To the owner, twice to the same user and to a missing user
+    userToShare = {'alice': alice, 'bob': bob}.get(userToShare, userToShare)
+    with pytest.raises(DatabaseException):
+        store.newShare(fileID, alice, userToShare)
+
+
+def test_delete_share(store, users):
+    alice, bob, carol = users
+    fileID = _newFile(store, alice, 'notes.txt')
+    store.newShare(fileID, alice, bob)
+    store.newShare(fileID, alice, carol)
+    # By the owner and by the user it is shared to
+    store.deleteShare(fileID, alice, bob)
+    store.deleteShare(fileID, carol, carol)
+    assert store.listFiles(alice)[fileID]['shares'] == []
+    assert fileID not in store.listFiles(bob)
+    assert fileID not in store.listFiles(carol)
+    with pytest.raises(DatabaseException):
+        store.deleteShare(fileID, alice, bob)
+    with pytest.raises(DatabaseException):
+        store.pullFile(bob, fileID)
+
+
+def test_delete_file(store, users):
+    alice, bob, _ = users
+    fileID = _newFile(store, alice, 'notes.txt')
+    store.pushFile(alice, fileID, 'contents\n')
+    store.newShare(fileID, alice, bob)
+    # Deleting a shared file only deletes the share
+    assert store.deleteFile(bob, fileID) == 'shared'
+    assert store.pullFile(alice, fileID) == 'contents\n'
+    store.newShare(fileID, alice, bob)
+    assert store.deleteFile(alice, fileID) == 'owned'
+    assert fileID not in store.listFiles(alice)
+    assert fileID not in store.listFiles(bob)
+    with pytest.raises(DatabaseException):
+        store.pullFile(alice, fileID)
+    with pytest.raises(DatabaseException):
+        store.deleteFile(alice, fileID)
+    # The name is free again
+    _newFile(store, alice, 'notes.txt')
+
+
+def test_identical_contents(store, users):
+    alice, bob, _ = users
+    contents = 'the same\n' * 100
+    first = _newFile(store, alice, 'first.txt')
+    second = _newFile(store, bob, 'second.txt')
+    store.pushFile(alice, first, contents)
+    store.pushFile(bob, second, contents)
+    assert store.fileHash(first) == store.fileHash(second)
+    # Files with the same contents do not affect each other
+    store.pushFile(alice, first, 'changed\n')
+    assert store.pullFile(bob, second) == contents
+    store.pushFile(alice, first, contents)
+    store.deleteFile(alice, first)
+    assert store.pullFile(bob, second) == contents
+    store.pushFile(bob, second, '')
+    assert store.pullFile(bob, second) == ''
+
+
+def test_blob_refcounts(store, users):
+    if not config.DEDUP:
+        pytest.skip('only stores with deduplication keep blobs')
+    alice, bob, _ = users
+    contents = f'shared by {alice} and {bob}\n'
+    blobHash = delta.contentHash(contents)
+    first = _newFile(store, alice, 'first.txt')
+    second = _newFile(store, bob, 'second.txt')
+
+    def refs():
+        with sqlite3.connect(config.DATABASE) as con:
+            row = con.execute('SELECT refs FROM Blobs WHERE hash=?;',
+                              (blobHash, )).fetchone()
+        con.close()
+        return row and row[0]
+
+    store.pushFile(alice, first, contents)
+    assert refs() == 1
+    store.pushFile(bob, second, contents)
+    assert refs() == 2
+    store.pushFile(alice, first, 'changed\n')
+    assert refs() == 1
+    store.deleteFile(bob, second)
+    assert refs() == 0
+
+
+def test_transaction_rolls_back(store, users):
+    alice = users[0]
+    fileID = _newFile(store, alice, 'notes.txt')
+    store.pushFile(alice, fileID, 'before\n')
+
+    def failing(writer):
+        with writer.transaction():
+            writer.pushFile(alice, fileID, 'after\n')
+            writer.newFile(alice, 'other.txt')
+            raise DatabaseException('Failed')
+
+    with pytest.raises(DatabaseException):
+        store.write(failing)
+    assert store.pullFile(alice, fileID) == 'before\n'
+    assert [info['name'] for info in store.listFiles(alice).values()
+            ] == ['notes.txt']
+
+
+def test_savepoint_rolls_back(store, users):
+    alice = users[0]
+    fileID = _newFile(store, alice, 'notes.txt')
+
+    def partly(writer):
+        with writer.transaction():
+            writer.pushFile(alice, fileID, 'kept\n')
+            with pytest.raises(DatabaseException):
+                with writer.savepoint():
+                    writer.newFile(alice, 'other.txt')
+                    writer.pushFile(alice, fileID, 'undone\n')
+                    raise DatabaseException('Failed')
+
+    store.write(partly)
+    assert store.pullFile(alice, fileID) == 'kept\n'
+    assert len(store.listFiles(alice)) == 1
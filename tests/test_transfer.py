@@ -0,0 +1,212 @@
+"""Framing of messages, see common.transfer."""
+import json
+import socket
+import threading
+
+import pytest
+
+from common import request
+from common import transfer
+
+
+@pytest.fixture
+def channels():
+    """A pair of connected channels in the latest protocol version."""
+    left, right = socket.socketpair()
+    left.settimeout(10)
+    right.settimeout(10)
+    pair = (transfer.Channel(left, transfer.PROTOCOL_VERSION),
+            transfer.Channel(right, transfer.PROTOCOL_VERSION))
+    yield pair
+    left.close()
+    right.close()
+
+
+def _sendAside(channel, message):
+    """Send a message on another thread, so that large ones do not block."""
+    thread = threading.Thread(target=channel.send, args=(message, ))
+    thread.start()
+    return thread
+
+
+def test_receive_buffer_is_bounded(channels):
+    sender, receiver = channels
+    sender.compressThreshold = transfer.DEFAULT_MAX_FRAME
+    fileName = 'x' * (4 * transfer.MAX_RECV_BUFFER)
+    thread = _sendAside(sender, request.NewFileRequest(fileName=fileName))
+    received = request.Request.fromJSON(receiver.recieve())
+    thread.join()
+    assert received.fileName == fileName
+    # pylint: disable=protected-access
+    assert len(receiver._buffer) <= transfer.MAX_RECV_BUFFER
+    # Small frames still go through the reused buffer
+    sender.send(request.NewFileRequest(fileName='notes.txt'))
+    assert request.Request.fromJSON(
+        receiver.recieve()).fileName == 'notes.txt'
+    assert len(receiver._buffer) <= transfer.MAX_RECV_BUFFER
+
+
+@pytest.mark.parametrize('requested, negotiated', [
+    (None, transfer.PROTOCOL_LEGACY),
+    (0, transfer.PROTOCOL_LEGACY),
+    (1, transfer.PROTOCOL_LEGACY),
+    (2, transfer.PROTOCOL_WIDE),
+    (3, transfer.PROTOCOL_BODY),
+    (99, transfer.PROTOCOL_VERSION),
+])
+def test_negotiate(requested, negotiated):
+    assert transfer.negotiate(requested) == negotiated
+
+
+@pytest.mark.parametrize('requested, allowed, protocol, codec', [
+    (['lzma', 'zlib'], ['zlib', 'lzma'], 3, 'lzma'),
+    (['lzma', 'zlib'], ['zlib'], 3, 'zlib'),
+    (['brotli', 'bz2'], ['brotli', 'bz2'], 2, 'bz2'),
+    (['zlib'], ['zlib'], 1, None),
+    (['zlib'], [], 3, None),
+    (None, ['zlib'], 3, None),
+])
+def test_negotiate_codec(requested, allowed, protocol, codec):
+    assert transfer.negotiateCodec(requested, allowed, protocol) == codec
+
+
+@pytest.mark.parametrize('protocol', [
+    transfer.PROTOCOL_LEGACY,
+    transfer.PROTOCOL_WIDE,
+    transfer.PROTOCOL_BODY,
+])
+def test_round_trip(channels, protocol):
+    sender, receiver = channels
+    sender.protocol = receiver.protocol = protocol
+    content = 'žluťoučký kůň 🐎\n' * 100
+    sender.send(request.PushRequest(fileID='abc', content=content))
+    received = request.Request.fromJSON(receiver.recieve())
+    assert received.content == content
+    assert received.fileID == 'abc'
+
+
+def test_legacy_frame_limit(channels):
+    sender, _ = channels
+    sender.protocol = transfer.PROTOCOL_LEGACY
+    with pytest.raises(transfer.FrameTooLarge):
+        sender.send(request.NewFileRequest(fileName='x' * 70000))
+
+
+@pytest.mark.parametrize('codec', sorted(transfer.CODECS))
+def test_compressed_round_trip(channels, codec):
+    sender, receiver = channels
+    sender.codec = receiver.codec = codec
+    content = 'compressible line\n' * 10000
+    before = transfer.compressionStats.snapshot().get('PUSH', {})
+    sender.send(request.PushRequest(fileID='abc', content=content))
+    assert request.Request.fromJSON(receiver.recieve()).content == content
+    after = transfer.compressionStats.snapshot()['PUSH']
+    assert after['messages'] > before.get('messages', 0)
+
+
+def test_compressed_frame_without_codec(channels):
+    sender, receiver = channels
+    sender.codec = 'zlib'
+    sender.send(request.NewFileRequest(fileName='x' * 2000))
+    with pytest.raises(ValueError):
+        receiver.recieve()
+
+
+def test_frame_too_large(channels):
+    sender, receiver = channels
+    receiver.maxFrame = 1024
+    thread = _sendAside(sender, request.NewFileRequest(fileName='x' * 2000))
+    with pytest.raises(transfer.FrameTooLarge):
+        receiver.recieve()
+    thread.join()
+
+
+@pytest.mark.parametrize('codec', sorted(transfer.CODECS))
+@pytest.mark.parametrize('spooled', [False, True])
+def test_decompression_bomb(channels, tmp_path, codec, spooled):
+    sender, receiver = channels
+    sender.codec = receiver.codec = codec
+    receiver.maxFrame = 1 << 20
+    if spooled:
+        receiver.spoolDir = str(tmp_path)
+    # Compresses far below the limit, inflates far beyond it
+    thread = _sendAside(sender,
+                        request.PushRequest(fileID='abc',
+                                            content='\n' * (16 << 20)))
+    with pytest.raises(transfer.FrameTooLarge):
+        receiver.recieve()
+    thread.join()
+    assert not list(tmp_path.iterdir())
+
+
+def test_spooled_body(channels, tmp_path):
+    sender, receiver = channels
+    receiver.spoolDir = str(tmp_path)
+    content = 'spooled ü\n' * 10000
+    sender.codec = receiver.codec = 'zlib'
+    thread = _sendAside(sender, request.PushRequest(fileID='abc',
+                                                    content=content))
+    received = request.Request.fromJSON(receiver.recieve())
+    thread.join()
+    assert received.content is None
+    with open(received.bodyPath, encoding='utf-8') as fBody:
+        assert fBody.read() == content
+
+
+def _rawPush(sock, body):
+    """Send a push with a raw body frame in the latest protocol version."""
+    payload = json.dumps({
+        'type': 'PUSH',
+        'fileID': 'abc',
+        'bodyField': 'content',
+        'bodyLength': len(body),
+    }).encode('utf-8')
+    sock.sendall((len(payload) | transfer.FLAG_BODY).to_bytes(8, 'big') +
+                 payload + len(body).to_bytes(8, 'big') + body)
+
+
+@pytest.mark.parametrize('body', [b'\xff\xfe', b'valid, then cut \xc5'])
+def test_invalid_utf8_body(channels, tmp_path, body):
+    sender, receiver = channels
+    receiver.spoolDir = str(tmp_path)
+    _rawPush(sender.sock, body)
+    frame = receiver.recieve()
+    assert 'UTF-8' in frame.bodyError
+    assert frame.bodyPath is None
+    assert not list(tmp_path.iterdir())
+    # The channel is still usable
+    sender.send(request.NewFileRequest(fileName='notes.txt'))
+    assert request.Request.fromJSON(
+        receiver.recieve()).fileName == 'notes.txt'
+
+
+def test_closed_connection(channels):
+    sender, receiver = channels
+    sender.sock.shutdown(socket.SHUT_WR)
+    with pytest.raises(ConnectionAbortedError):
+        receiver.recieve()
+
+
+def test_zero_length_frame(channels):
+    sender, receiver = channels
+    sender.sock.sendall(bytes(8))
+    with pytest.raises(ConnectionAbortedError):
+        receiver.recieve()
+
+
+def test_partly_spooled_body_is_removed(channels, tmp_path):
+    sender, receiver = channels
+    receiver.spoolDir = str(tmp_path)
+    body = b'x' * (4 * transfer.SPOOL_CHUNK)
+    payload = json.dumps({
+        'type': 'PUSH',
+        'fileID': 'abc',
+        'bodyField': 'content',
+        'bodyLength': len(body),
+    }).encode('utf-8')
+    sender.sock.sendall((len(payload) | transfer.FLAG_BODY).to_bytes(
+        8, 'big') + payload + len(body).to_bytes(8, 'big') + body[:1000])
+    sender.sock.shutdown(socket.SHUT_WR)
+    with pytest.raises(ConnectionAbortedError):
+        receiver.recieve()
+    assert not list(tmp_path.iterdir())